@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+
+"""Benchmark and correctness check of the codebook of stat2csv.py.
+
+Builds the metadata of a synthetic questionnaire (by default 50k variables and 500k value
+labels in label sets that are shared by several variables, with numeric and string
+values) and makes the codebook with stat2csv.make_codebook and with the nested loops
+that stat2csv used before. Time and peak memory (tracemalloc) of both are reported, also
+for writing the codebook as CSV, which stat2csv now does in chunks of variables.
+The two codebooks must be equal, except for values that the old str.replace('.0', '')
+mangled, such as 10.05 -> '105'; those are counted separately.
+"""
+
+import argparse, random, sys, time, tracemalloc
+from os.path import dirname, join
+from types import SimpleNamespace
+import pandas as pd
+
+sys.path.insert(0, join(dirname(__file__), '..'))
+from stat2csv import codebook_chunks, make_codebook
+
+def make_metadata(variables, labels, set_size=50, seed=1):
+    """return metadata like pyreadstat's, with `labels` value labels in label sets of
+    `set_size` labels; every variable uses a label set"""
+    rnd = random.Random(seed)
+    value_labels = {}
+    for k in range(max(labels // set_size, 1)):
+        if k % 10 == 9:  # string values
+            value_labels[f"labels{k}"] = {f"{code:02d}": f"option {code}" for code in range(set_size)}
+        else:            # numbers, some with decimals
+            values = [float(code) for code in range(set_size - 3)] + [10.05, 0.5, -1.0]
+            value_labels[f"labels{k}"] = {value: f"answer {value}" for value in values}
+    sets = list(value_labels.keys())
+    names = [f"q{k}" for k in range(variables)]
+    return SimpleNamespace(
+        column_names=names,
+        column_names_to_labels={name: f"question {name}" for name in names},
+        variable_to_label={name: rnd.choice(sets) for name in names if rnd.random() < 0.9},
+        value_labels=value_labels)
+
+def legacy_codebook(metadata):
+    """the codebook as stat2csv.py made it before it was vectorized"""
+    variable_labels = pd.DataFrame().\
+        from_dict(metadata.column_names_to_labels, orient='index').\
+        reset_index().rename(columns={'index': 'variable_name', 0: 'variable_label'})
+    variable_label_id = pd.DataFrame().from_dict(metadata.variable_to_label, orient='index').\
+        reset_index().rename(columns={'index': 'variable_name', 0: 'value_label_id'})
+    variable_labels_with_id = pd.merge(variable_labels, variable_label_id, how='left',
+        left_on='variable_name', right_on='variable_name').fillna('')
+    collect = []
+    for k1, v1 in metadata.value_labels.items():
+        for k2, v2 in v1.items():
+            collect.append([str(k2).replace('.0', ''), v2, k1])
+    value_labels = pd.DataFrame(collect).\
+        rename(columns={0: 'value_label', 1: 'value', 2: 'value_label_id'})
+    return pd.merge(variable_labels_with_id, value_labels, how='left',
+                    left_on='value_label_id',
+                    right_on='value_label_id').fillna('').drop('value_label_id', axis=1)
+
+class Sink:
+    """file-like object that only counts what is written to it"""
+    def __init__(self):
+        self.size = 0
+
+    def write(self, text):
+        self.size += len(text)
+        return len(text)
+
+def legacy_csv(metadata):
+    legacy_codebook(metadata).to_csv(Sink(), index=False, sep=';')
+
+def streamed_csv(metadata):
+    sink = Sink()
+    for number, chunk in enumerate(codebook_chunks(metadata)):
+        chunk.to_csv(sink, index=False, sep=';', header=(number == 0))
+
+def measure(func, metadata):
+    """return (seconds, peak MB) of func(metadata); the peak is measured in a second
+    run, because tracemalloc slows down the allocation of every object"""
+    start = time.perf_counter()
+    func(metadata)
+    seconds = time.perf_counter() - start
+    tracemalloc.start()
+    func(metadata)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return seconds, peak / 2**20
+
+def compare(old, new):
+    """return (number of equal rows, number of rows with a value that the old code mangled);
+    raise AssertionError for any other difference"""
+    assert list(old.columns) == list(new.columns), (old.columns, new.columns)
+    assert len(old) == len(new), (len(old), len(new))
+    old_text = old.astype(str).reset_index(drop=True)
+    new_text = new.astype(str).reset_index(drop=True)
+    differs = (old_text != new_text).any(axis=1)
+    for column in ('variable_name', 'variable_label', 'value'):
+        assert (old_text[column] == new_text[column]).all(), column
+    mangled = new_text.loc[differs, 'value_label']
+    assert (mangled.str.replace('.0', '', regex=False) == old_text.loc[differs, 'value_label']).all()
+    return int((~differs).sum()), int(differs.sum())
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--variables', type=int, default=50000)
+    parser.add_argument('--labels',    type=int, default=500000)
+    args = parser.parse_args()
+    metadata = make_metadata(args.variables, args.labels)
+    print(f"{len(metadata.column_names)} variables, "
+          f"{sum(len(labels) for labels in metadata.value_labels.values())} value labels")
+    for label, func in (('legacy codebook', legacy_codebook), ('vectorized codebook', make_codebook),
+                        ('legacy CSV', legacy_csv), ('streamed CSV', streamed_csv)):
+        seconds, peak = measure(func, metadata)
+        print(f"{label:20} {seconds:6.2f} s, peak {peak:7.1f} MB")
+    equal, mangled = compare(legacy_codebook(metadata), make_codebook(metadata))
+    print(f"{equal} rows equal, {mangled} rows differ only by values that the legacy code mangled")
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+
+"""Benchmark of the DIP tree index (dave.dip) on a synthetic DIP.
+
+Creates a DIP with N empty object files named '<UUID>-<name>' in a temporary
+directory, builds the tree and looks up every file by its UUID, like dvupload
+does for the entries of the METS fileSec. For comparison, a sample of lookups is
+done with a linear scan over the folder, as the tree did before it was indexed.
+"""
+
+import argparse, os, sys, tempfile, time, uuid
+from os.path import dirname, join
+
+sys.path.insert(0, join(dirname(__file__), '..'))
+from dave.dip import generate_tree
+
+def make_dip(root, count, folders=0):
+    """create a DIP with `count` object files; return the list of file UUIDs"""
+    objects = join(root, 'objects')
+    os.makedirs(objects)
+    for k in range(folders):  # folders with the same name at different depths
+        os.makedirs(join(objects, 'sub', 'data' if k % 2 else '', 'data', str(k)), exist_ok=True)
+    fids = []
+    for k in range(count):
+        fid = str(uuid.uuid4())
+        fids.append(fid)
+        open(join(objects, '{}-file{}.dat'.format(fid, k)), 'w').close()
+    open(join(root, 'METS.{}.xml'.format(uuid.uuid4())), 'w').close()
+    return fids
+
+def linear_find(folder, prefix):
+    matches = [child for child in folder.files() if child.name.startswith(prefix)]
+    return matches[0] if matches else None
+
+def run(count, sample):
+    with tempfile.TemporaryDirectory() as root:
+        fids = make_dip(root, count, folders=10)
+        start = time.perf_counter()
+        tree = generate_tree(root)
+        build = time.perf_counter() - start
+        objects = tree.folder('objects')
+        start = time.perf_counter()
+        found = sum(1 for fid in fids if objects.find(fid) is not None)
+        lookup = time.perf_counter() - start
+        assert found == count, 'found {} of {} files'.format(found, count)
+        start = time.perf_counter()
+        for fid in fids[:sample]:
+            linear_find(objects, fid)
+        linear = (time.perf_counter() - start) / min(sample, count) * count
+    print('{:>8} files  build {:7.3f}s  index lookups {:7.3f}s  linear scan (extrapolated) {:9.1f}s'.\
+          format(count, build, lookup, linear))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--files', type=int, nargs='+', default=[10000, 50000, 100000])
+    parser.add_argument('--sample', type=int, default=200,
+                        help='number of linear-scan lookups to extrapolate from')
+    args = parser.parse_args()
+    for count in args.files:
+        run(count, args.sample)
@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+
+"""Benchmark of the scripts against local mock Dataverse servers (bench/mockserver.py).
+
+Every scenario starts its own mock server(s) in a subprocess, points a temporary
+~/.config/dataverse.json at them and runs a script with --metrics-json:
+    - dvstats:        file report of a tree with --datasets datasets (default 10000)
+    - dvstats-search: the same report with the Search API
+    - dvupload:       upload of a synthetic DIP with --dip-files files of --dip-size bytes
+    - dvupload-direct: upload of a DIP with --direct-files files of --direct-size bytes
+                      directly to the S3 stand-in of the mock server, in parts of 5 MiB
+    - dvclone:        clone of --clone-dataverses dataverses, their groups and role
+                      assignments to an empty demo server
+Reported are wall time, requests/s, MB/s (request and response bodies), p50/p99 latency
+(interpolated in the histograms of dave.metrics) and the peak RSS of the script.
+The results are compared with the stored baseline (bench/baseline.json); a metric that
+is worse than the baseline by more than --tolerance is a regression, which makes the
+exit status 1. With --save-baseline, the results become the new baseline.
+"""
+
+import argparse, csv, hashlib, json, os, subprocess, sys, tempfile, time, uuid
+from os.path import dirname, join, abspath
+
+REPO = abspath(join(dirname(__file__), '..'))
+MOCK = join(REPO, 'bench', 'mockserver.py')
+DEFAULT_BASELINE = join(REPO, 'bench', 'baseline.json')
+SCENARIOS = ['dvstats', 'dvstats-search', 'dvupload', 'dvupload-direct', 'dvclone']
+# metric: True if higher is better
+METRICS = {'seconds': False, 'requests_per_second': True, 'mb_per_second': True,
+           'p50_ms': False, 'p99_ms': False, 'peak_rss_mb': False}
+
+# the minimal dataset metadata that Dataverse.create_dataset reads from the working directory
+DATASET_TEMPLATE = {'datasetVersion': {'metadataBlocks': {'citation': {'fields': [
+    {'typeName': 'title', 'value': '$title'},
+    {'typeName': 'author', 'value': [{'authorName': {'value': '$authorname'},
+                                      'authorAffiliation': {'value': '$authoraffiliation'}}]},
+    {'typeName': 'datasetContact', 'value': [{'datasetContactEmail': {'value': '$contactemail'},
+                                              'datasetContactName': {'value': '$contactname'}}]},
+    {'typeName': 'dsDescription', 'value': [{'dsDescriptionValue': {'value': '$description'}}]},
+    {'typeName': 'subject', 'value': ['Medicine, Health and Life Sciences']}]}}}}
+
+METS = """<?xml version="1.0" encoding="UTF-8"?>
+<mets:mets xmlns:mets="http://www.loc.gov/METS/" xmlns:xlink="http://www.w3.org/1999/xlink"
+           xmlns:premis="http://www.loc.gov/premis/v3" xmlns:dcterms="http://purl.org/dc/terms/"
+           xmlns:dc="http://purl.org/dc/elements/1.1/">
+<mets:dmdSec ID="dmdSec_1"><mets:mdWrap MDTYPE="DC"><mets:xmlData><dcterms:dublincore>
+<dc:title>Benchmark DIP</dc:title><dc:creator>Benchmark</dc:creator><dc:publisher>UMCU</dc:publisher>
+<dc:description>Synthetic DIP</dc:description><dc:relation>{relation}</dc:relation>
+</dcterms:dublincore></mets:xmlData></mets:mdWrap></mets:dmdSec>
+{amdsecs}
+<mets:fileSec><mets:fileGrp USE="original">
+{files}
+</mets:fileGrp></mets:fileSec>
+</mets:mets>
+"""
+
+AMDSEC = """<mets:amdSec ID="amdSec_{k}"><mets:techMD ID="techMD_{k}"><mets:mdWrap MDTYPE="PREMIS:OBJECT"><mets:xmlData>
+<premis:object><premis:objectCharacteristics><premis:fixity><premis:messageDigestAlgorithm>md5</premis:messageDigestAlgorithm>
+<premis:messageDigest>{md5}</premis:messageDigest></premis:fixity></premis:objectCharacteristics></premis:object>
+</mets:xmlData></mets:mdWrap></mets:techMD><mets:rightsMD ID="rightsMD_{k}"><mets:mdWrap MDTYPE="PREMIS:RIGHTS"><mets:xmlData>
+<premis:rightsStatement><premis:rightsGranted><premis:act>disseminate</premis:act><premis:restriction>{restriction}</premis:restriction>
+</premis:rightsGranted></premis:rightsStatement></mets:xmlData></mets:mdWrap></mets:rightsMD></mets:amdSec>"""
+
+FILE = """<mets:file ID="file-{fid}" ADMID="amdSec_{k}"><mets:FLocat xlink:href="objects/{name}" LOCTYPE="OTHER"/></mets:file>"""
+
+def make_dip(root, count, size):
+    """create a DIP with `count` object files of `size` random bytes and its METS file;
+    every tenth file is restricted. Like Archivematica, the object files are all in the
+    objects folder, named '<UUID>-<name>', and the METS file has their original paths."""
+    objects = join(root, 'objects')
+    os.makedirs(objects)
+    amdsecs, files = [], []
+    for k in range(count):
+        fid = str(uuid.uuid4())
+        name = f"data/file{k}.dat"
+        digest = hashlib.md5()
+        with open(join(objects, f"{fid}-file{k}.dat"), 'wb') as f:
+            for start in range(0, size, 1 << 20):  # in chunks: see run_script about the peak RSS
+                chunk = os.urandom(min(1 << 20, size - start))
+                digest.update(chunk)
+                f.write(chunk)
+        amdsecs.append(AMDSEC.format(k=k, md5=digest.hexdigest(),
+                                     restriction='Conditional' if k % 10 == 9 else 'Allow'))
+        files.append(FILE.format(fid=fid, k=k, name=name))
+    with open(join(root, f"METS.{uuid.uuid4()}.xml"), 'w') as f:
+        f.write(METS.format(relation='Dataverse 0', amdsecs='\n'.join(amdsecs), files='\n'.join(files)))
+
+def start_mock(options, fault_options):
+    """start a mock server on a free port; return (process, url)"""
+    process = subprocess.Popen([sys.executable, MOCK, '--port', '0', *options, *fault_options],
+                               stdout=subprocess.PIPE, text=True)
+    line = process.stdout.readline()
+    if not line:
+        raise RuntimeError('mock server did not start')
+    return process, line.split()[3].rstrip(':')
+
+def run_script(command, home, cwd, client_rate=0):
+    """run a script; return (exit status, seconds, peak RSS in MB, metrics dict). The
+    adaptive rate limit of the scripts is set to `client_rate` requests per second, so that
+    it does not hide the speed of the rest. On Linux, a child starts with the peak RSS of
+    its parent, so the harness itself must stay smaller than the scripts."""
+    metrics_path = join(home, 'metrics.json')
+    env = dict(os.environ, HOME=home, PYTHONPATH=REPO)
+    with open(join(home, 'stdout.txt'), 'w') as stdout, open(join(home, 'stderr.txt'), 'w') as stderr:
+        start = time.perf_counter()
+        rate = ['--rate', str(client_rate), '--max-rate', str(client_rate)] if client_rate else []
+        process = subprocess.Popen([sys.executable, *command, *rate, '--metrics-json', metrics_path],
+                                   cwd=cwd, env=env, stdout=stdout, stderr=stderr)
+        _, status, usage = os.wait4(process.pid, 0)
+        seconds = time.perf_counter() - start
+    process.returncode = os.waitstatus_to_exitcode(status)
+    rss = usage.ru_maxrss / (2**20 if sys.platform == 'darwin' else 2**10)  # bytes on macOS, KB elsewhere
+    metrics = json.load(open(metrics_path)) if os.path.exists(metrics_path) else {}
+    return process.returncode, seconds, rss, metrics
+
+def quantile(buckets, q):
+    """quantile q of a histogram {upper bound: count}, interpolated linearly within its
+    bucket like Prometheus' histogram_quantile"""
+    bounds = sorted((float(bound), count) for bound, count in buckets.items())
+    total = sum(count for _, count in bounds)
+    if total == 0:
+        return None
+    rank, seen, lower = q * total, 0, 0.0
+    for bound, count in bounds:
+        if count and seen + count >= rank:
+            if bound == float('inf'):
+                return lower
+            return lower + (bound - lower) * (rank - seen) / count
+        seen += count
+        lower = bound
+    return lower
+
+def summarize(seconds, rss, metrics):
+    """return the benchmark metrics of a run"""
+    requests = sum(endpoint['count'] for endpoint in metrics.values())
+    volume = sum(endpoint['bytes_in'] + endpoint['bytes_out'] for endpoint in metrics.values())
+    buckets = {}
+    for endpoint in metrics.values():
+        for bound, count in endpoint['buckets'].items():
+            buckets[bound] = buckets.get(bound, 0) + count
+    p50, p99 = quantile(buckets, 0.5), quantile(buckets, 0.99)
+    return {'seconds': round(seconds, 3), 'requests': requests,
+            'retries': sum(endpoint['retries'] for endpoint in metrics.values()),
+            'requests_per_second': round(requests / seconds, 1), 'mb_per_second': round(volume / seconds / 2**20, 3),
+            'p50_ms': round(p50 * 1000, 2) if p50 is not None else None,
+            'p99_ms': round(p99 * 1000, 2) if p99 is not None else None,
+            'peak_rss_mb': round(rss, 1)}
+
+def write_config(home, production, demo=None):
+    os.makedirs(join(home, '.config'))
+    config = {'production': {'url': production, 'root': 'root', 'key': 'benchmark'},
+              'demo':       {'url': demo or production, 'root': 'root', 'key': 'benchmark'}}
+    with open(join(home, '.config', 'dataverse.json'), 'w') as f:
+        json.dump(config, f)
+
+def scenario(name, args, fault_options):
+    """run one scenario; return its metrics"""
+    with tempfile.TemporaryDirectory() as home:
+        servers = []
+        try:
+            if name.startswith('dvstats'):
+                process, url = start_mock(['--datasets', str(args.datasets), '--dataverses', str(args.dataverses),
+                                           '--depth', '3', '--files', str(args.files)], fault_options)
+                servers.append(process)
+                write_config(home, url)
+                command = [join(REPO, 'dvstats'), '--jobs', str(args.jobs)]
+                if name == 'dvstats-search':
+                    command.append('--search')
+            elif name.startswith('dvupload'):
+                direct = name == 'dvupload-direct'
+                process, url = start_mock(['--datasets', '0', '--dataverses', '1'] + (['--direct'] if direct else []),
+                                          fault_options)
+                servers.append(process)
+                write_config(home, url)
+                if direct:
+                    make_dip(join(home, 'dip'), args.direct_files, args.direct_size)
+                else:
+                    make_dip(join(home, 'dip'), args.dip_files, args.dip_size)
+                with open(join(home, 'dataset-minimal-metadata.json'), 'w') as f:
+                    json.dump(DATASET_TEMPLATE, f)
+                command = [join(REPO, 'dvupload'), join(home, 'dip'), '--jobs', str(args.upload_jobs)]
+                if direct:
+                    command += ['--direct-above', '1']
+            elif name == 'dvclone':
+                production, production_url = start_mock(['--datasets', '0', '--dataverses', str(args.clone_dataverses)],
+                                                        fault_options)
+                demo, demo_url = start_mock(['--datasets', '0', '--dataverses', '0'], fault_options)
+                servers += [production, demo]
+                write_config(home, production_url, demo_url)
+                with open(join(home, 'dataverses.csv'), 'w', newline='') as f:
+                    writer = csv.writer(f, delimiter=';', quoting=csv.QUOTE_ALL)
+                    writer.writerow(['name', 'alias', 'group', 'email'])
+                    writer.writerow(['Root', 'root', 'adminroot', 'root'])
+                    writer.writerows([f"Dataverse {k}", f"dv{k}", f"ds{k}", f"dv{k}"]
+                                     for k in range(args.clone_dataverses))
+                command = [join(REPO, 'dvclone'), '--jobs', str(args.jobs), '--file', join(home, 'dataverses.csv')]
+            else:
+                raise ValueError(f"unknown scenario {name}")
+            status, seconds, rss, metrics = run_script(command, home, cwd=home, client_rate=args.client_rate)
+            if status != 0:
+                with open(join(home, 'stderr.txt')) as f:
+                    tail = f.read()[-2000:]
+                raise RuntimeError(f"{name} exited with status {status}:\n{tail}")
+            return summarize(seconds, rss, metrics)
+        finally:
+            for process in servers:
+                process.terminate()
+                process.wait()
+
+def compare(results, baseline, tolerance):
+    """print the results next to the baseline; return the list of regressions"""
+    regressions = []
+    print(f"{'scenario':16} {'metric':20} {'result':>10} {'baseline':>10} {'change':>8}")
+    for name, result in results.items():
+        for metric, higher_is_better in METRICS.items():
+            value, base = result.get(metric), baseline.get(name, {}).get(metric)
+            if value is None or not base:
+                print(f"{name:16} {metric:20} {value if value is not None else '-':>10} {'-':>10}")
+                continue
+            change = (value - base) / base
+            worse = -change if higher_is_better else change
+            flag = '  REGRESSION' if worse > tolerance else ''
+            if flag:
+                regressions.append((name, metric))
+            print(f"{name:16} {metric:20} {value:10} {base:10} {change:+8.1%}{flag}")
+    return regressions
+
+if __name__ == '__main__':
+    sys.path.insert(0, join(REPO, 'bench'))
+    from mockserver import add_fault_arguments
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('scenarios', nargs='*', default=SCENARIOS, help=f"scenarios (default: {' '.join(SCENARIOS)})")
+    parser.add_argument('--datasets',   type=int, default=10000, help='datasets in the dvstats tree (default 10000)')
+    parser.add_argument('--dataverses', type=int, default=300, help='dataverses in the dvstats tree (default 300)')
+    parser.add_argument('--files',      type=int, default=3, help='files per dataset (default 3)')
+    parser.add_argument('--jobs',       type=int, default=16, help='--jobs of dvstats and dvclone (default 16)')
+    parser.add_argument('--dip-files',  type=int, default=200, help='files in the DIP (default 200)')
+    parser.add_argument('--dip-size',   type=int, default=256 * 1024, help='bytes per DIP file (default 256 KB)')
+    parser.add_argument('--direct-files', type=int, default=4, help='files in the DIP of dvupload-direct (default 4)')
+    parser.add_argument('--direct-size', type=int, default=32 << 20,
+                        help='bytes per file of dvupload-direct (default 32 MiB)')
+    parser.add_argument('--upload-jobs', type=int, default=4, help='--jobs of dvupload (default 4)')
+    parser.add_argument('--clone-dataverses', type=int, default=50, help='dataverses that dvclone clones (default 50)')
+    parser.add_argument('--client-rate', type=float, default=1000,
+                        help='--rate and --max-rate of the scripts (default 1000; 0: their defaults)')
+    parser.add_argument('--baseline',   default=DEFAULT_BASELINE, help='baseline file (default bench/baseline.json)')
+    parser.add_argument('--save-baseline', action='store_true', help='store the results as the new baseline')
+    parser.add_argument('--tolerance',  type=float, default=0.2,
+                        help='fraction by which a metric may be worse than the baseline (default 0.2)')
+    add_fault_arguments(parser)
+    args = parser.parse_args()
+    fault_options = ['--latency', str(args.latency), '--jitter', str(args.jitter),
+                     '--error-rate', str(args.error_rate), '--error-status', str(args.error_status)]
+    if args.rate:
+        fault_options += ['--rate', str(args.rate)]
+    results = {}
+    for name in args.scenarios:
+        results[name] = scenario(name, args, fault_options)
+        print(f"{name}: {json.dumps(results[name])}", flush=True)
+    settings = {key: value for key, value in vars(args).items()
+                if key not in ('scenarios', 'baseline', 'save_baseline', 'tolerance')}
+    if args.save_baseline:
+        baseline = json.load(open(args.baseline)) if os.path.exists(args.baseline) else {}
+        baseline.update(results, settings=settings)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2)
+        print(f"baseline saved to {args.baseline}")
+    elif os.path.exists(args.baseline):
+        baseline = json.load(open(args.baseline))
+        if baseline.get('settings') != settings:
+            print('warning: the baseline was made with other settings', file=sys.stderr)
+        regressions = compare(results, baseline, args.tolerance)
+        sys.exit(1 if regressions else 0)
+    else:
+        print(f"no baseline {args.baseline}: run with --save-baseline to make one")
@@ -0,0 +1,693 @@
+#!/usr/bin/env python3
+
+"""Local stand-in for a Dataverse server, for benchmarks and for trying the scripts
+without touching dataverse.nl.
+
+Serves a synthetic tree: a root dataverse with `--dataverses` sub-dataverses (one level
+deep, or nested with --depth), `--datasets` datasets spread over them, and `--files`
+files per dataset. It implements the endpoints that dave and the scripts use:
+/info/server, /dataverses/{id} (view, create), /contents, /groups, /assignments,
+/actions/:publish, /datasets (create), /datasets/{id}, /versions, /versions/{v}/files,
+/datasets/{id}/add, /search and /access/datafile/{id} (with Range). Writes change the tree
+in memory; an uploaded file is checksummed (MD5) and a zip file is unpacked, as Dataverse
+does, but only the synthetic files can be downloaded. Their contents are generated from
+the file id; with --content their MD5 is computed at startup, otherwise it is made up.
+With --direct, datasets allow direct upload: /uploadurls hands out presigned URLs of an
+S3 stand-in on the same port (/s3/...), files larger than --part-size are uploaded in
+parts and completed or aborted through /datasets/mpupload, and /addFiles registers
+the files; a file whose MD5 does not match the stored object is refused.
+
+Every request can be slowed down (--latency, --jitter), throttled (--rate: above it
+the server answers 429 with Retry-After) and failed at random (--error-rate with
+--error-status); with --cut-rate, a download stops halfway. GET /mock/stats returns the number of requests per endpoint and of
+injected failures.
+"""
+
+import argparse, atexit, hashlib, io, json, os, random, re, shutil, tempfile, time, uuid, zipfile
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from urllib.parse import parse_qs, urlsplit
+
+AUTHORITY = '10.5072'
+
+class Tree:
+    """The dataverses, datasets, groups and role assignments of the mock server
+       Instance variables:
+           - dataverses: dict {id: dataverse dict}, with 'children' and 'datasets' lists of ids
+           - aliases: dict {alias: dataverse id}
+           - datasets: dict {id: dataset dict}, with its 'files'
+           - groups, assignments: dict {dataverse id: list}
+           - store: Store for direct upload, or None if direct upload is not allowed
+           - synthetic: dict {file id: size} of the files whose contents can be downloaded
+    """
+    def __init__(self, dataverses=10, datasets=100, files=3, depth=1, root='root', store=None, content=False):
+        self.lock = Lock()
+        self.store = store
+        self.synthetic = {}
+        self.next_id = 1
+        self.dataverses, self.aliases, self.datasets = {}, {}, {}
+        self.groups, self.assignments = {}, {}
+        self.root = self.add_dataverse(None, root, root.upper())
+        parent = self.root
+        for k in range(dataverses):
+            # chains of `depth` nested dataverses below the root
+            parent = self.root if k % max(depth, 1) == 0 else parent
+            dvid = parent = self.add_dataverse(parent, f"dv{k}", f"Dataverse {k}")
+            self.groups[self.root].append(self.group(f"ds{k}", f"Data stewards {k}"))
+            self.assignments[dvid].append({'id': self.new_id(), 'assignee': f"&explicit/{self.root}-ds{k}",
+                                           'roleId': 7, '_roleAlias': 'curator', 'definitionPointId': dvid})
+        owners = [dvid for dvid in self.dataverses if dvid != self.root] or [self.root]
+        for k in range(datasets):
+            dsid = self.add_dataset(owners[k % len(owners)], f"Dataset {k}", f"Author {k % 97}")
+            for n in range(files):
+                size = 1000 + (k * 7919 + n * 104729) % 1000000
+                md5 = None if content else hashlib.md5(str((k, n)).encode()).hexdigest()
+                self.add_file(dsid, f"file{n}.csv", f"data/{n % 3}", size, md5)
+            self.datasets[dsid]['state'] = 'RELEASED' if k % 5 else 'DRAFT'
+
+    def new_id(self):
+        with self.lock:
+            self.next_id += 1
+            return self.next_id - 1
+
+    def group(self, alias, name):
+        return {'identifier': f"&explicit/{self.root}-{alias}",
+                'groupAliasInOwner': alias, 'displayName': name, 'description': name}
+
+    def add_dataverse(self, parent, alias, name, released=True):
+        dvid = self.new_id()
+        self.dataverses[dvid] = {'id': dvid, 'alias': alias, 'name': name, 'dataverseType': 'DEPARTMENT',
+                                 'isReleased': released, 'parent': parent, 'children': [], 'datasets': []}
+        self.aliases[alias] = dvid
+        self.groups[dvid], self.assignments[dvid] = [], []
+        if parent is not None:
+            self.dataverses[parent]['children'].append(dvid)
+        return dvid
+
+    def add_dataset(self, owner, title, author):
+        dsid = self.new_id()
+        self.datasets[dsid] = {'id': dsid, 'identifier': f"FK2/{dsid:06d}", 'owner': owner, 'title': title,
+                               'authors': [author], 'state': 'DRAFT', 'updated': time.strftime('%Y-%m-%dT%H:%M:%SZ'),
+                               'files': []}
+        self.dataverses[owner]['datasets'].append(dsid)
+        return dsid
+
+    def add_file(self, dsid, label, directory, size, md5, content_type='text/csv', restricted=False):
+        """add a file to a dataset; with md5 None, a synthetic file that can be downloaded"""
+        fid = self.new_id()
+        if md5 is None:
+            digest = hashlib.md5()
+            for chunk in synthetic_chunks(fid, 0, size):
+                digest.update(chunk)
+            md5 = digest.hexdigest()
+            self.synthetic[fid] = size
+        desc = {'label': label, 'directoryLabel': directory, 'restricted': restricted, 'version': 1,
+                'dataFile': {'id': fid, 'filename': label, 'contentType': content_type, 'filesize': size,
+                             'md5': md5, 'checksum': {'type': 'MD5', 'value': md5}}}
+        dataset = self.datasets[dsid]
+        with self.lock:
+            dataset['files'].append(desc)
+            dataset['updated'] = time.strftime('%Y-%m-%dT%H:%M:%SZ')
+        return desc
+
+    def dataverse(self, key):
+        """return the dataverse with id or alias `key`, or None"""
+        if key == ':root':
+            key = self.root
+        dvid = int(key) if str(key).isdigit() else self.aliases.get(key)
+        return self.dataverses.get(dvid)
+
+    def view(self, dataverse):
+        result = {key: value for key, value in dataverse.items() if key not in ('children', 'datasets', 'parent')}
+        if dataverse['parent'] is not None:
+            result['ownerId'] = dataverse['parent']
+        return result
+
+    def version(self, dataset, files=True):
+        result = {'id': dataset['id'], 'datasetId': dataset['id'], 'versionNumber': 1, 'versionMinorNumber': 0,
+                  'versionState': dataset['state'], 'lastUpdateTime': dataset['updated'],
+                  'datasetPersistentId': f"doi:{AUTHORITY}/{dataset['identifier']}",
+                  'metadataBlocks': {'citation': {'fields': [
+                      {'typeName': 'title', 'value': dataset['title']},
+                      {'typeName': 'author', 'value': [{'authorName': {'value': author}} for author in dataset['authors']]}]}}}
+        if files:
+            result['files'] = list(dataset['files'])
+        return result
+
+    def dataset(self, dataset):
+        return {'id': dataset['id'], 'identifier': dataset['identifier'], 'protocol': 'doi', 'authority': AUTHORITY,
+                'persistentUrl': f"https://doi.org/{AUTHORITY}/{dataset['identifier']}",
+                'latestVersion': dict(self.version(dataset), createTime=dataset['updated'])}
+
+    def subtree(self, dataverse):
+        """generate the ids of the dataverse and all dataverses below it"""
+        stack = [dataverse['id']]
+        while stack:
+            dvid = stack.pop()
+            yield dvid
+            stack.extend(self.dataverses[dvid]['children'])
+
+    def search(self, query):
+        """return the items of a search; only the parameters type and subtree are used"""
+        subtree = self.dataverse(query.get('subtree', [':root'])[0])
+        types = query.get('type', ['dataverse', 'dataset', 'file'])
+        items = []
+        for dvid in self.subtree(subtree) if subtree else ():
+            alias = self.dataverses[dvid]['alias']
+            for dsid in self.dataverses[dvid]['datasets']:
+                dataset = self.datasets[dsid]
+                pid = f"doi:{AUTHORITY}/{dataset['identifier']}"
+                if 'dataset' in types:
+                    items.append({'type': 'dataset', 'name': dataset['title'], 'global_id': pid, 'entity_id': dsid,
+                                  'identifier_of_dataverse': alias, 'versionState': dataset['state'],
+                                  'majorVersion': 1, 'minorVersion': 0, 'updatedAt': dataset['updated'],
+                                  'authors': dataset['authors']})
+                if 'file' in types:
+                    items.extend({'type': 'file', 'name': desc['label'], 'file_id': desc['dataFile']['id'],
+                                  'dataset_id': str(dsid), 'dataset_persistent_id': pid,
+                                  'size_in_bytes': desc['dataFile']['filesize'],
+                                  'file_content_type': desc['dataFile']['contentType']} for desc in dataset['files'])
+        return items
+
+SYNTHETIC_BLOCK = 64 * 1024
+
+def synthetic_chunks(fid, start, end):
+    """generate the bytes start to end (exclusive) of the contents of a synthetic file"""
+    block = hashlib.sha256(str(fid).encode()).digest() * (SYNTHETIC_BLOCK // 32)
+    while start < end:
+        offset = start % SYNTHETIC_BLOCK
+        chunk = block[offset:offset + end - start]
+        yield chunk
+        start += len(chunk)
+
+class Store:
+    """S3 stand-in for direct upload; the parts of a multipart upload are kept in a
+    temporary directory until the upload is completed or aborted
+       Instance variables:
+           - part_size: size of the parts of a multipart upload
+           - objects: dict {key: (size, MD5)} of the uploaded objects
+           - uploads: dict {upload id: (key, {part number: (path, ETag)})}
+    """
+    def __init__(self, part_size):
+        self.part_size = part_size
+        self.objects, self.uploads = {}, {}
+        self.directory = tempfile.mkdtemp(prefix='mockstore')
+        atexit.register(shutil.rmtree, self.directory, True)
+
+    def urls(self, base, size):
+        """return the data of /uploadurls for a file of `size` bytes"""
+        key = uuid.uuid4().hex
+        result = {'partSize': self.part_size, 'storageIdentifier': f"s3://mockbucket:{key}"}
+        if size <= self.part_size:
+            result['url'] = f"{base}/s3/mockbucket/{key}"
+            return result
+        upload_id = uuid.uuid4().hex
+        self.uploads[upload_id] = (key, {})
+        parts = (size + self.part_size - 1) // self.part_size
+        result['urls'] = {str(n): f"{base}/s3/mockbucket/{key}?uploadId={upload_id}&partNumber={n}"
+                          for n in range(1, parts + 1)}
+        query = f"uploadid={upload_id}&storageidentifier=s3://mockbucket:{key}"
+        result['complete'] = f"/api/datasets/mpupload?{query}"
+        result['abort'] = f"/api/datasets/mpupload?{query}"
+        return result
+
+    def put(self, key, body, query):
+        """store an object or a part; return its ETag"""
+        etag = hashlib.md5(body).hexdigest()
+        if 'uploadId' not in query:
+            self.objects[key] = (len(body), etag)
+            return etag
+        _, parts = self.uploads[query['uploadId'][0]]
+        path = os.path.join(self.directory, f"{query['uploadId'][0]}.{query['partNumber'][0]}")
+        with open(path, 'wb') as f:
+            f.write(body)
+        parts[int(query['partNumber'][0])] = (path, etag)
+        return etag
+
+    def complete(self, upload_id, etags):
+        """join the parts of a multipart upload; return an error message or None"""
+        key, parts = self.uploads.pop(upload_id)
+        if sorted(int(n) for n in etags) != sorted(parts) or \
+           any(parts[int(n)][1] != etag.strip('"') for n, etag in etags.items()):
+            return 'ETags of the parts do not match'
+        digest, size = hashlib.md5(), 0
+        for n in sorted(parts):
+            with open(parts[n][0], 'rb') as f:
+                data = f.read()
+            digest.update(data)
+            size += len(data)
+            os.remove(parts[n][0])
+        self.objects[key] = (size, digest.hexdigest())
+        return None
+
+    def abort(self, upload_id):
+        _, parts = self.uploads.pop(upload_id, (None, {}))
+        for path, _ in parts.values():
+            os.remove(path)
+
+def multipart_parts(content_type, body):
+    """return {name: (filename, content)} of a multipart/form-data body"""
+    boundary = re.search(r'boundary="?([^";]+)"?', content_type).group(1).encode()
+    parts = {}
+    for part in body.split(b'--' + boundary)[1:-1]:
+        head, _, content = part.partition(b'\r\n\r\n')
+        disposition = head.decode('utf-8', errors='replace')
+        name = re.search(r'name="([^"]*)"', disposition).group(1)
+        filename = re.search(r'filename="([^"]*)"', disposition)
+        parts[name] = (filename.group(1) if filename else None, content[:-2])  # without the final CRLF
+    return parts
+
+class Faults:
+    """Latency, throttling and error injection
+       Instance variables:
+           - latency, jitter: every request takes latency + uniform(0, jitter) seconds
+           - rate: requests per second above which the server answers 429, None: no limit
+           - error_rate: fraction of requests that fail with error_status
+           - cut_rate: fraction of downloads that stop halfway
+    """
+    def __init__(self, latency=0.0, jitter=0.0, rate=None, error_rate=0.0, error_status=503, seed=None,
+                 cut_rate=0.0):
+        self.latency, self.jitter = latency, jitter
+        self.rate = rate
+        self.error_rate, self.error_status = error_rate, error_status
+        self.cut_rate = cut_rate
+        self.random = random.Random(seed)
+        self.lock = Lock()
+        self.tokens, self.stamp = rate or 0.0, time.monotonic()
+
+    def delay(self):
+        if self.latency or self.jitter:
+            time.sleep(self.latency + self.random.uniform(0, self.jitter))
+
+    def throttled(self):
+        if not self.rate:
+            return False
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.stamp) * self.rate)
+            self.stamp = now
+            if self.tokens < 1:
+                return True
+            self.tokens -= 1
+            return False
+
+    def failed(self):
+        with self.lock:
+            return self.random.random() < self.error_rate
+
+    def cut(self):
+        with self.lock:
+            return self.random.random() < self.cut_rate
+
+def make_handler(tree, faults, stats):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        disable_nagle_algorithm = True  # headers and body are separate writes
+
+        def log_message(self, *args):
+            pass
+
+        def reply(self, status, data=None, message=None, headers=()):
+            body = {'status': 'OK' if status < 400 else 'ERROR'}
+            if data is not None:
+                body['data'] = data
+            if message is not None:
+                body['message'] = message
+            content = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(content)))
+            for name, value in headers:
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(content)
+
+        def stream(self, status, length, chunks, headers=(), cut=False):
+            """send `length` bytes from the generator `chunks`; if `cut`, close the
+            connection after half of them"""
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('Content-Length', str(length))
+            for name, value in headers:
+                self.send_header(name, value)
+            self.end_headers()
+            limit = length // 2 if cut else length
+            for chunk in chunks:
+                if limit <= 0:
+                    break
+                self.wfile.write(chunk[:limit])
+                limit -= len(chunk)
+            if cut:
+                self.close_connection = True
+
+        def body(self):
+            if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+                chunks = []
+                while True:
+                    size = int(self.rfile.readline().split(b';')[0], 16)
+                    chunks.append(self.rfile.read(size))
+                    self.rfile.readline()
+                    if size == 0:
+                        return b''.join(chunks)
+            return self.rfile.read(int(self.headers.get('Content-Length') or 0))
+
+        def handle_request(self, method):
+            url = urlsplit(self.path)
+            path = re.sub(r'^/api(/v1)?', '', url.path).rstrip('/') or '/'
+            query = parse_qs(url.query)
+            body = self.body() if method in ('POST', 'PUT') else b''
+            if path == '/mock/stats':
+                return self.reply(200, dict(stats))
+            route, handler, groups = f"{method} {path}", None, ()
+            for pattern, methods in ROUTES:
+                match = re.fullmatch(pattern, path)
+                if match and method in methods:
+                    route, handler, groups = f"{method} {pattern}", methods[method], match.groups()
+                    break
+            count(stats, route)
+            faults.delay()
+            if faults.throttled():
+                count(stats, 'throttled')
+                return self.reply(429, message='Too many requests', headers=[('Retry-After', '1')])
+            if faults.failed():
+                count(stats, 'failed')
+                return self.reply(faults.error_status, message='Injected failure')
+            if handler is None:
+                return self.reply(404, message=f"API endpoint does not exist: {method} {path}")
+            handler(self, tree, query, body, *groups)
+
+        def do_GET(self):
+            self.handle_request('GET')
+
+        def do_POST(self):
+            self.handle_request('POST')
+
+        def do_PUT(self):
+            self.handle_request('PUT')
+
+        def do_DELETE(self):
+            self.handle_request('DELETE')
+    Handler.faults = faults
+    return Handler
+
+stats_lock = Lock()
+
+def count(stats, key):
+    with stats_lock:
+        stats[key] = stats.get(key, 0) + 1
+
+def dataverse_or_404(handler, tree, key):
+    dataverse = tree.dataverse(key)
+    if dataverse is None:
+        handler.reply(404, message=f"Can't find dataverse with identifier='{key}'")
+    return dataverse
+
+def dataset_or_404(handler, tree, key, query):
+    if key == ':persistentId':
+        pid = query.get('persistentId', [''])[0]
+        key = next((dsid for dsid, dataset in tree.datasets.items()
+                    if pid.endswith(dataset['identifier'])), None)
+    dataset = tree.datasets.get(int(key)) if str(key).isdigit() else None
+    if dataset is None:
+        handler.reply(404, message=f"Dataset with ID {key} not found.")
+    return dataset
+
+def get_server(handler, tree, query, body):
+    handler.reply(200, {'message': 'Dataverse mock server', 'version': '6.1'})
+
+def get_dataverse(handler, tree, query, body, key):
+    dataverse = dataverse_or_404(handler, tree, key)
+    if dataverse:
+        handler.reply(200, tree.view(dataverse))
+
+def post_dataverse(handler, tree, query, body, key):
+    parent = dataverse_or_404(handler, tree, key)
+    if parent:
+        props = json.loads(body)
+        if props.get('alias') in tree.aliases:
+            return handler.reply(400, message=f"A dataverse with alias {props['alias']} already exists")
+        dvid = tree.add_dataverse(parent['id'], props['alias'], props['name'], released=False)
+        handler.reply(201, tree.view(tree.dataverses[dvid]))
+
+def get_contents(handler, tree, query, body, key):
+    dataverse = dataverse_or_404(handler, tree, key)
+    if dataverse:
+        children = [{'type': 'dataverse', 'id': dvid, 'title': tree.dataverses[dvid]['name']}
+                    for dvid in dataverse['children']]
+        datasets = [{'type': 'dataset', 'id': dsid, 'identifier': tree.datasets[dsid]['identifier'],
+                     'protocol': 'doi', 'authority': AUTHORITY} for dsid in dataverse['datasets']]
+        handler.reply(200, children + datasets)
+
+def publish_dataverse(handler, tree, query, body, key):
+    dataverse = dataverse_or_404(handler, tree, key)
+    if dataverse:
+        dataverse['isReleased'] = True
+        handler.reply(200, tree.view(dataverse))
+
+def get_groups(handler, tree, query, body, key):
+    dataverse = dataverse_or_404(handler, tree, key)
+    if dataverse:
+        handler.reply(200, tree.groups[dataverse['id']])
+
+def post_group(handler, tree, query, body, key):
+    dataverse = dataverse_or_404(handler, tree, key)
+    if dataverse:
+        props = json.loads(body)
+        group = {'identifier': f"&explicit/{dataverse['id']}-{props['aliasInOwner']}",
+                 'groupAliasInOwner': props['aliasInOwner'], 'displayName': props['displayName'],
+                 'description': props.get('description', '')}
+        tree.groups[dataverse['id']].append(group)
+        handler.reply(201, group)
+
+def get_assignments(handler, tree, query, body, key):
+    dataverse = dataverse_or_404(handler, tree, key)
+    if dataverse:
+        handler.reply(200, tree.assignments[dataverse['id']])
+
+def post_assignment(handler, tree, query, body, key):
+    dataverse = dataverse_or_404(handler, tree, key)
+    if dataverse:
+        props = json.loads(body)
+        assignment = {'id': tree.new_id(), 'assignee': props['assignee'], 'roleId': 7,
+                      '_roleAlias': props['role'], 'definitionPointId': dataverse['id']}
+        tree.assignments[dataverse['id']].append(assignment)
+        handler.reply(200, assignment)
+
+def post_dataset(handler, tree, query, body, key):
+    dataverse = dataverse_or_404(handler, tree, key)
+    if dataverse:
+        fields = json.loads(body)['datasetVersion']['metadataBlocks']['citation']['fields']
+        title = next((elt['value'] for elt in fields if elt['typeName'] == 'title'), 'New dataset')
+        dsid = tree.add_dataset(dataverse['id'], title, 'Mock')
+        dataset = tree.datasets[dsid]
+        handler.reply(201, {'id': dsid, 'persistentId': f"doi:{AUTHORITY}/{dataset['identifier']}"})
+
+def publish_dataset(handler, tree, query, body, key):
+    dataset = dataset_or_404(handler, tree, key, query)
+    if dataset:
+        dataset['state'] = 'RELEASED'
+        handler.reply(200, tree.dataset(dataset))
+
+def get_dataset(handler, tree, query, body, key):
+    dataset = dataset_or_404(handler, tree, key, query)
+    if dataset:
+        handler.reply(200, tree.dataset(dataset))
+
+def get_versions(handler, tree, query, body, key):
+    dataset = dataset_or_404(handler, tree, key, query)
+    if dataset:
+        handler.reply(200, [tree.version(dataset)])
+
+def get_version(handler, tree, query, body, key, version):
+    dataset = dataset_or_404(handler, tree, key, query)
+    if dataset:
+        handler.reply(200, tree.version(dataset, files=query.get('excludeFiles') != ['true']))
+
+def get_version_files(handler, tree, query, body, key, version):
+    dataset = dataset_or_404(handler, tree, key, query)
+    if dataset:
+        handler.reply(200, list(dataset['files']))
+
+def post_file(handler, tree, query, body, key):
+    dataset = dataset_or_404(handler, tree, key, query)
+    if not dataset:
+        return
+    parts = multipart_parts(handler.headers.get('Content-Type', ''), body)
+    if 'file' not in parts:
+        return handler.reply(400, message='No file in the request')
+    filename, content = parts['file']
+    metadata = json.loads(parts['jsonData'][1]) if 'jsonData' in parts else {}
+    restricted = bool(metadata.get('restrict'))
+    if filename.endswith('.zip'):  # Dataverse unpacks a zip file, with its folders as directoryLabel
+        files = []
+        with zipfile.ZipFile(io.BytesIO(content)) as archive:
+            for info in archive.infolist():
+                if info.is_dir():
+                    continue
+                data = archive.read(info)
+                directory, _, label = info.filename.rpartition('/')
+                files.append(tree.add_file(dataset['id'], label, directory, len(data),
+                                           hashlib.md5(data).hexdigest(), restricted=restricted))
+    else:
+        files = [tree.add_file(dataset['id'], filename, metadata.get('directoryLabel', ''), len(content),
+                               hashlib.md5(content).hexdigest(), restricted=restricted)]
+    handler.reply(200, {'files': files})
+
+def get_datafile(handler, tree, query, body, key):
+    size = tree.synthetic.get(int(key))
+    if size is None:
+        return handler.reply(404, message=f"File {key} not found, or its contents were not kept")
+    match = re.fullmatch(r'bytes=(\d+)-(\d*)', handler.headers.get('Range', ''))
+    if match is None:
+        return handler.stream(200, size, synthetic_chunks(int(key), 0, size), [('Accept-Ranges', 'bytes')],
+                              handler.faults.cut())
+    start, end = int(match.group(1)), int(match.group(2) or size - 1) + 1
+    if start >= size:
+        return handler.reply(416, message='Range not satisfiable', headers=[('Content-Range', f"bytes */{size}")])
+    end = min(end, size)
+    handler.stream(206, end - start, synthetic_chunks(int(key), start, end),
+                   [('Content-Range', f"bytes {start}-{end - 1}/{size}")], handler.faults.cut())
+
+def get_upload_urls(handler, tree, query, body, key):
+    dataset = dataset_or_404(handler, tree, key, query)
+    if not dataset:
+        return
+    if tree.store is None:
+        return handler.reply(400, message='Direct upload not supported for files in this dataset')
+    base = f"http://{handler.headers.get('Host')}"
+    handler.reply(200, tree.store.urls(base, int(query.get('size', ['0'])[0])))
+
+def put_object(handler, tree, query, body, key):
+    if tree.store is None:
+        return handler.reply(404, message='No store')
+    etag = tree.store.put(key, body, query)
+    handler.reply(200, headers=[('ETag', f'"{etag}"')])
+
+def complete_upload(handler, tree, query, body):
+    upload_id = query.get('uploadid', [''])[0]
+    if tree.store is None or upload_id not in tree.store.uploads:
+        return handler.reply(404, message=f"No multipart upload {upload_id}")
+    error = tree.store.complete(upload_id, json.loads(body))
+    handler.reply(400 if error else 200, message=error)
+
+def abort_upload(handler, tree, query, body):
+    if tree.store is not None:
+        tree.store.abort(query.get('uploadid', [''])[0])
+    handler.reply(200)
+
+def post_files(handler, tree, query, body, key):
+    dataset = dataset_or_404(handler, tree, key, query)
+    if not dataset:
+        return
+    parts = multipart_parts(handler.headers.get('Content-Type', ''), body)
+    results = []
+    for entry in json.loads(parts['jsonData'][1]):
+        storage_identifier = entry.get('storageIdentifier', '')
+        stored = tree.store.objects.get(storage_identifier.rpartition(':')[2]) if tree.store else None
+        checksum = entry.get('checksum', {})
+        if stored is None:
+            results.append({'storageIdentifier': storage_identifier, 'errorMessage': 'No such object in the store'})
+        elif checksum.get('@type') == 'MD5' and checksum.get('@value') != stored[1]:
+            results.append({'storageIdentifier': storage_identifier,
+                            'errorMessage': f"MD5 {checksum.get('@value')} does not match the stored object"})
+        else:
+            desc = tree.add_file(dataset['id'], entry['fileName'], entry.get('directoryLabel', ''), stored[0],
+                                 checksum.get('@value'), entry.get('mimeType', 'application/octet-stream'),
+                                 restricted=bool(entry.get('restrict')))
+            if checksum.get('@type') != 'MD5':
+                desc['dataFile']['checksum'] = {'type': checksum.get('@type'), 'value': checksum.get('@value')}
+            results.append({'storageIdentifier': storage_identifier, 'fileDetails': desc})
+    added = sum(1 for result in results if 'fileDetails' in result)
+    handler.reply(200, {'Files': results, 'Result': {'Total number of files': len(results),
+                                                     'Number of files successfully added': added}})
+
+def get_search(handler, tree, query, body):
+    items = tree.search(query)
+    start = int(query.get('start', ['0'])[0])
+    per_page = int(query.get('per_page', ['10'])[0])
+    handler.reply(200, {'q': query.get('q', ['*'])[0], 'total_count': len(items), 'start': start,
+                        'items': items[start:start + per_page], 'count_in_response': len(items[start:start + per_page])})
+
+DATASET = r'/datasets/(\d+|:persistentId)'
+ROUTES = [
+    (r'/info/(?:server|version)',               {'GET': get_server}),
+    (r'/dataverses/([^/]+)',                    {'GET': get_dataverse, 'POST': post_dataverse}),
+    (r'/dataverses/([^/]+)/contents',           {'GET': get_contents}),
+    (r'/dataverses/([^/]+)/actions/:publish',   {'POST': publish_dataverse}),
+    (r'/dataverses/([^/]+)/groups',             {'GET': get_groups, 'POST': post_group}),
+    (r'/dataverses/([^/]+)/assignments',        {'GET': get_assignments, 'POST': post_assignment}),
+    (r'/dataverses/([^/]+)/datasets',           {'POST': post_dataset}),
+    (DATASET,                                   {'GET': get_dataset}),
+    (DATASET + r'/actions/:publish',            {'POST': publish_dataset}),
+    (DATASET + r'/versions',                    {'GET': get_versions}),
+    (DATASET + r'/versions/([^/]+)',            {'GET': get_version}),
+    (DATASET + r'/versions/([^/]+)/files',      {'GET': get_version_files}),
+    (DATASET + r'/add',                         {'POST': post_file}),
+    (DATASET + r'/uploadurls',                  {'GET': get_upload_urls}),
+    (DATASET + r'/addFiles',                    {'POST': post_files}),
+    (r'/datasets/mpupload',                     {'PUT': complete_upload, 'DELETE': abort_upload}),
+    (r'/s3/mockbucket/([^/]+)',                 {'PUT': put_object}),
+    (r'/search',                                {'GET': get_search}),
+    (r'/access/datafile/(\d+)',                 {'GET': get_datafile}),
+]
+
+def serve(port, tree, faults, host='127.0.0.1'):
+    """return a server for `tree` on `port` (0: any free port); call serve_forever() on it"""
+    stats = {}
+    server = ThreadingHTTPServer((host, port), make_handler(tree, faults, stats))
+    server.daemon_threads = True
+    server.stats = stats
+    return server
+
+@contextmanager
+def running(tree, faults=None):
+    """serve `tree` on a free port in a thread, e.g. in a test; yield the server, whose
+    url is its base URL"""
+    server = serve(0, tree, faults or Faults())
+    server.url = f"http://127.0.0.1:{server.server_address[1]}"
+    thread = Thread(target=server.serve_forever, args=(0.05,), daemon=True)
+    thread.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+def add_fault_arguments(parser):
+    parser.add_argument('--latency',      type=float, default=0.0, help='seconds per request (default 0)')
+    parser.add_argument('--jitter',       type=float, default=0.0, help='random extra seconds per request (default 0)')
+    parser.add_argument('--rate',         type=float, help='requests per second above which 429 is answered')
+    parser.add_argument('--error-rate',   type=float, default=0.0, help='fraction of requests that fail (default 0)')
+    parser.add_argument('--error-status', type=int, default=503, help='status of a failed request (default 503)')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port',       type=int, default=8080)
+    parser.add_argument('--root',       default='root', help='alias of the root dataverse (default root)')
+    parser.add_argument('--dataverses', type=int, default=10, help='number of sub-dataverses (default 10)')
+    parser.add_argument('--depth',      type=int, default=1, help='depth of the tree of dataverses (default 1)')
+    parser.add_argument('--datasets',   type=int, default=100, help='number of datasets (default 100)')
+    parser.add_argument('--files',      type=int, default=3, help='files per dataset (default 3)')
+    parser.add_argument('--direct',     action='store_true', help='allow direct upload to the S3 stand-in')
+    parser.add_argument('--part-size',  type=int, default=5 << 20,
+                        help='part size of multipart direct uploads (default 5 MiB)')
+    parser.add_argument('--content',    action='store_true',
+                        help='compute the MD5 of the synthetic files, so that downloads can be verified')
+    parser.add_argument('--cut-rate',   type=float, default=0.0,
+                        help='fraction of downloads that stop halfway (default 0)')
+    parser.add_argument('--seed',       type=int, help='seed of the injected latency and failures')
+    add_fault_arguments(parser)
+    args = parser.parse_args()
+    tree = Tree(args.dataverses, args.datasets, args.files, args.depth, args.root,
+                Store(args.part_size) if args.direct else None, args.content)
+    faults = Faults(args.latency, args.jitter, args.rate, args.error_rate, args.error_status, args.seed,
+                    args.cut_rate)
+    server = serve(args.port, tree, faults)
+    print(f"mock Dataverse on http://127.0.0.1:{server.server_address[1]}: {len(tree.dataverses)} dataverses, "
+          f"{len(tree.datasets)} datasets", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -1,5 +1,13 @@
+from .bulk       import DatasetTemplate, IdMap, bulk_create, load_template
+from .cache      import ResponseCache
 from .common     import *
 from .connection import *
+from .inventory  import DEFAULT_INVENTORY, Inventory
+from .metrics    import Metrics, RequestRecord, add_hook, remove_hook
 from .models     import *
+from .multipart  import MultipartEncoder
+from .scheduler  import Scheduler, TokenBucket, configure_scheduler, get_scheduler
+from .session    import add_session_arguments, apply_session_arguments, configure_session, \
+                        get_session, print_session_stats, session_stats
 from .simple     import Api
 from .terms      import *
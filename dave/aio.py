@@ -0,0 +1,198 @@
+"""Asyncio interface to Dataverse.
+AsyncApi has the same dataverse_* and dataset_* methods as dave.simple.Api, but they are
+coroutines: many requests can be in flight from a single thread. Requests share one
+aiohttp session with a pool of keep-alive connections, a semaphore bounds the number
+of requests in flight, and rate limiting and retries are done by the scheduler of the
+host, which AsyncApi shares with the blocking clients.
+aiohttp is an optional dependency: it is only needed for this module.
+
+Example:
+    async with AsyncApi(url, key) as api:
+        async for alias, dataset, versions in api.versions(api.crawl(root)):
+            ...
+"""
+
+import asyncio, json
+from os.path import basename
+from urllib.parse import urlencode
+import aiohttp
+from .common import DataverseError
+from .metrics import RequestTimer
+from .multipart import DEFAULT_CHUNK_SIZE, MultipartEncoder
+from .scheduler import get_scheduler
+from .session import auth_headers
+from .simple import SEARCH_PAGE_SIZE, Api
+
+DEFAULT_LIMIT = 100   # requests in flight
+DEFAULT_TIMEOUT = 300 # seconds per request
+
+class Response:
+    """Completely read aiohttp response, with the attributes of a requests response
+    that Api and the scheduler use"""
+    def __init__(self, status, headers, content):
+        self.status_code = status
+        self.headers = headers
+        self.content = content
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8', errors='replace')
+
+    def json(self):
+        return json.loads(self.content)
+
+class AsyncApi(Api):
+    """Api with coroutines instead of blocking methods
+       Instance variables (besides those of Api):
+           - limit: maximum number of requests in flight
+           - semaphore: bounds the number of requests in flight
+           - views: dict {dataverse id: view} of the dataverses that crawl() viewed
+    """
+    def __init__(self, base_url, api_token, readonly=False, scheduler=None, cache=None,
+                 limit=DEFAULT_LIMIT, timeout=DEFAULT_TIMEOUT):
+        self.base_url = base_url
+        self.api_token = api_token
+        self.readonly = readonly
+        self.headers = auth_headers(api_token, **{'Content-Type': 'application/json'})
+        self.scheduler = scheduler if scheduler is not None else get_scheduler(base_url)
+        self.cache = cache
+        self.limit = limit
+        self.timeout = timeout
+        self.semaphore = None
+        self.session = None
+        self.views = {}
+
+    def __str__(self):
+        return f"AsyncApi(url='{self.base_url}', key='{self.api_token}')"
+
+    def _open(self):
+        # the session and semaphore belong to the running event loop, so they are made on first use
+        if self.session is None:
+            connector = aiohttp.TCPConnector(limit=self.limit, limit_per_host=self.limit)
+            self.session = aiohttp.ClientSession(connector=connector,
+                                                 timeout=aiohttp.ClientTimeout(total=self.timeout))
+            self.semaphore = asyncio.Semaphore(self.limit)
+        return self.session
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def __aenter__(self):
+        self._open()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def _request(self, method, endpoint, **kwarg):
+        path, payload, headers = self._prepare(method, endpoint, kwarg)
+        if self.readonly and method != 'GET':
+            print(f"[readonly] {method} {path}\n{payload}")
+            return
+        if self.cache is not None and method == 'GET':
+            cached = self.cache.get(path)
+            if cached is not None:
+                return cached
+        session = self._open()
+        async def send():
+            body = _async_body(payload) if hasattr(payload, 'rewind') else payload
+            async with session.request(method, path, data=body, headers=headers) as response:
+                return Response(response.status, response.headers, await response.read())
+        async with self.semaphore:
+            with RequestTimer(method, endpoint, payload) as timer:
+                timer.response = await self.scheduler.send_async(
+                    method, timer.wrap_async(send), errors=(aiohttp.ClientConnectionError, asyncio.TimeoutError))
+        return self._result(method, path, timer.response)
+
+    async def dataset_add_file(self, dataset_id, filename, metadata, progress=None,
+                               chunk_size=DEFAULT_CHUNK_SIZE):
+        """Add a file to a dataset (see Api.dataset_add_file); the file is read in a thread,
+        so the event loop is not blocked by disk access"""
+        json_data = json.dumps(metadata)
+        with open(filename, 'rb') as file_obj:
+            body = MultipartEncoder([('file', (basename(filename), file_obj)),
+                                     ('jsonData', json_data)],
+                                    chunk_size=chunk_size, progress=progress)
+            return await self.post_request("{url}/api/datasets/{dsid}/add", dsid=dataset_id, data=body,
+                                           headers={'Content-Type': body.content_type,
+                                                    'Content-Length': str(len(body))})
+
+    async def search(self, query='*', types=('dataset', 'file'), subtree=None,
+                     per_page=SEARCH_PAGE_SIZE, **params):
+        """Generate the items of a search (see Api.search); the next page is requested
+        while the items of the current one are consumed"""
+        start = 0
+        page = asyncio.ensure_future(self._search_page(query, types, subtree, per_page, 0, params))
+        while page is not None:
+            data = await page
+            if not isinstance(data, dict) or 'items' not in data:
+                raise DataverseError(f"search failed at start={start}: {data}")
+            start += len(data['items'])
+            more = data['items'] and start < data.get('total_count', 0)
+            page = asyncio.ensure_future(self._search_page(query, types, subtree, per_page, start, params)) \
+                   if more else None
+            for item in data['items']:
+                yield item
+
+    async def _search_page(self, query, types, subtree, per_page, start, params):
+        params = dict(params, q=query, type=list(types), per_page=per_page, show_entity_ids='true',
+                      start=start)
+        if subtree is not None:
+            params['subtree'] = subtree
+        query_string = urlencode(params, doseq=True).replace('{', '{{').replace('}', '}}')
+        return await self.get_request("{url}/api/search?" + query_string)
+
+    async def _listing(self, dataverse_id, alias=None):
+        """Return (alias, contents) of a dataverse; every dataverse is viewed once"""
+        if alias is None:
+            if dataverse_id not in self.views:
+                self.views[dataverse_id] = await self.dataverse_view(dataverse_id)
+            alias = self.views[dataverse_id].get('alias', dataverse_id)
+        contents = await self.dataverse_contents(dataverse_id)
+        return alias, contents if isinstance(contents, list) else []
+
+    async def crawl(self, root):
+        """Generate (alias, dataset) for every dataset in the tree below the dataverse with
+        alias `root`, at any depth; the contents of all dataverses are requested concurrently"""
+        pending = {asyncio.ensure_future(self._listing(root, root))}
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                alias, contents = task.result()
+                for elt in contents:
+                    if elt['type'] == 'dataverse':
+                        pending.add(asyncio.ensure_future(self._listing(elt['id'])))
+                    elif elt['type'] == 'dataset':
+                        yield alias, elt
+
+    async def versions(self, datasets):
+        """Generate (alias, dataset, versions) for the (alias, dataset) pairs of the (async)
+        iterable `datasets`, in the order in which the versions arrive"""
+        async def fetch(alias, dataset):
+            return alias, dataset, await self.dataset_versions(dataset['id'])
+        pending = set()
+        if hasattr(datasets, '__aiter__'):
+            async for alias, dataset in datasets:
+                pending.add(asyncio.ensure_future(fetch(alias, dataset)))
+                done = {task for task in pending if task.done()}
+                pending -= done
+                for task in done:
+                    yield task.result()
+        else:
+            pending = {asyncio.ensure_future(fetch(alias, dataset)) for alias, dataset in datasets}
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield task.result()
+
+async def _async_body(payload):
+    """Async iterator over the chunks of a MultipartEncoder; the file is read in a thread"""
+    loop = asyncio.get_running_loop()
+    payload.rewind()
+    while True:
+        chunk = await loop.run_in_executor(None, payload.read, payload.chunk_size)
+        if not chunk:
+            return
+        yield chunk
@@ -0,0 +1,202 @@
+"""Bulk creation of datasets from a manifest.
+A manifest is a CSV file (with a header line) or a JSONL file with one record per dataset:
+'key' (a unique name of the record, e.g. the identifier in the legacy collection),
+'dataverse' (id or alias), optionally 'terms' (type_1, type_2, type_3a or type_3b), and
+the replacement fields of the metadata template, e.g. $title $authorname $description.
+The template is read and parsed once, and every record is validated before the first
+dataset is created. Created datasets are appended to an id map (JSONL), so a run that is
+interrupted can be restarted: a record whose key is in the id map is not created again.
+"""
+
+import csv, json, os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache
+from string import Template
+from threading import Lock
+from requests import RequestException
+from .common import DataverseError, read_file
+from .terms import terms
+
+DEFAULT_TEMPLATE = 'dataset-minimal-metadata.json'
+DEFAULT_TERMS = 'type_1'
+DEFAULT_JOBS = 4
+RESERVED_FIELDS = ('key', 'dataverse', 'terms')
+
+class DatasetTemplate:
+    """Metadata template with replacement fields, e.g. dataset-minimal-metadata.json
+       Instance variables:
+           - template: string.Template of the JSON text
+           - fields: names of the replacement fields
+    """
+    def __init__(self, text):
+        self.template = Template(text)
+        matches = Template.pattern.finditer(text)
+        self.fields = sorted({match.group('named') or match.group('braced') for match in matches} - {None})
+
+    @classmethod
+    def read(cls, filename=DEFAULT_TEMPLATE):
+        return cls(read_file(filename))
+
+    def render(self, values, terms_type=None):
+        """Return the metadata dict for the replacement values in the dict `values`, plus
+        the terms of `terms_type`. Values are escaped, so quotes and newlines are allowed.
+        Raise DataverseError if a replacement field has no value."""
+        missing = [field for field in self.fields if field not in values]
+        if missing:
+            raise DataverseError(f"no value for the replacement field(s) {', '.join(missing)}")
+        escaped = {field: json.dumps(str(values[field]))[1:-1] for field in self.fields}
+        metadata = json.loads(self.template.substitute(escaped))
+        if terms_type is not None:
+            metadata['datasetVersion'].update(terms[terms_type])
+        return metadata
+
+@lru_cache(maxsize=None)
+def load_template(filename=DEFAULT_TEMPLATE):
+    """DatasetTemplate of a file, which is read only once"""
+    return DatasetTemplate.read(filename)
+
+def read_manifest(filename):
+    """Return the records of a manifest: a list of dicts; a file with extension .jsonl or
+    .json has one JSON object per line, any other file is CSV"""
+    if filename.endswith(('.jsonl', '.json')):
+        with open(filename) as f:
+            return [json.loads(line) for line in f if line.strip()]
+    with open(filename, newline='') as f:
+        sample = f.read(4096)
+        f.seek(0)
+        dialect = csv.Sniffer().sniff(sample, delimiters=',;\t')
+        return [dict(row) for row in csv.DictReader(f, dialect=dialect)]
+
+def validate(records, template, default_terms=DEFAULT_TERMS):
+    """Return a list of error messages for the records; empty if all records are valid"""
+    errors, keys = [], set()
+    for number, record in enumerate(records, 1):
+        key = str(record.get('key') or '').strip()
+        where = f"record {number} ({key})" if key else f"record {number}"
+        if not key:
+            errors.append(f"{where}: no key")
+        elif key in keys:
+            errors.append(f"{where}: duplicate key")
+        keys.add(key)
+        if not str(record.get('dataverse') or '').strip():
+            errors.append(f"{where}: no dataverse")
+        terms_type = record.get('terms') or default_terms
+        if terms_type not in terms:
+            errors.append(f"{where}: unknown terms '{terms_type}', expected one of {', '.join(terms)}")
+        missing = [field for field in template.fields if not str(record.get(field) or '').strip()]
+        if missing:
+            errors.append(f"{where}: no value for {', '.join(missing)}")
+        unknown = [field for field in record if field not in template.fields and field not in RESERVED_FIELDS]
+        if unknown:
+            errors.append(f"{where}: unknown field(s) {', '.join(unknown)}")
+    return errors
+
+class IdMap:
+    """Append-only JSONL file with a line {key, dataverse, id, persistentId, published}
+    for every dataset that was created or published; a later line of a key overrides an
+    earlier one. Every line is flushed, so that a restart knows what was done.
+       Instance variables:
+           - path: path of the file
+           - entries: dict {key: latest entry}
+    """
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # the last line of a run that was killed
+                    self.entries[entry['key']] = dict(self.entries.get(entry['key'], {}), **entry)
+        self.file = open(path, 'a')
+        self.lock = Lock()
+
+    def get(self, key):
+        return self.entries.get(key)
+
+    def add(self, key, **values):
+        with self.lock:
+            entry = dict(self.entries.get(key, {}), key=key, **values)
+            self.entries[key] = entry
+            self.file.write(json.dumps(entry) + '\n')
+            self.file.flush()
+            return entry
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def _message(result):
+    if isinstance(result, dict):
+        return result.get('message', json.dumps(result)[:200])
+    return str(result)
+
+def check_dataverses(api, records):
+    """Return an error message for every dataverse of the records that does not exist"""
+    aliases = sorted({str(record['dataverse']).strip() for record in records})
+    views = dict(zip(aliases, map(api.dataverse_view, aliases)))
+    return [f"dataverse {alias} does not exist: {_message(view)}"
+            for alias, view in views.items() if not (isinstance(view, dict) and 'id' in view)]
+
+def create_datasets(api, records, template, id_map, jobs=DEFAULT_JOBS, publish=False,
+                    default_terms=DEFAULT_TERMS):
+    """Create a dataset for every record that is not in `id_map` yet, with at most `jobs`
+    requests in flight, and publish it if `publish`. Generate (key, status, entry or error
+    message) as the records finish, where status is 'created', 'published', 'exists' or
+    'failed'. The records should be valid (see validate). A network error fails only its
+    record: a POST is not retried, so the dataset may have been created after all."""
+    def create(record):
+        key = str(record['key']).strip()
+        try:
+            return _create(key, record)
+        except (DataverseError, RequestException) as e:
+            return key, 'failed', str(e)
+    def _create(key, record):
+        entry, status = id_map.get(key), 'exists'
+        if entry is None:
+            metadata = template.render(record, record.get('terms') or default_terms)
+            dataverse = str(record['dataverse']).strip()
+            result = api.dataset_create(dataverse, props=metadata)
+            if not (isinstance(result, dict) and 'id' in result):
+                return key, 'failed', f"could not be created: {_message(result)}"
+            entry = id_map.add(key, dataverse=dataverse, id=result['id'],
+                               persistentId=result.get('persistentId'), published=False)
+            status = 'created'
+        if publish and not entry.get('published'):
+            result = api.dataset_publish(entry['persistentId'])
+            if not isinstance(result, dict) or result.get('status') == 'ERROR':
+                return key, 'failed', f"dataset {entry['id']} could not be published: {_message(result)}"
+            entry = id_map.add(key, published=True)
+            status = 'published'
+        return key, status, entry
+    with ThreadPoolExecutor(max_workers=max(jobs, 1)) as executor:
+        futures = [executor.submit(create, record) for record in records]
+        for future in as_completed(futures):
+            yield future.result()
+
+def bulk_create(api, manifest, id_map_path, template=DEFAULT_TEMPLATE, jobs=DEFAULT_JOBS,
+                publish=False, default_terms=DEFAULT_TERMS):
+    """Validate the records of `manifest` and the dataverses they refer to, then create
+    the datasets; raise DataverseError with all problems if a record is invalid. Return a
+    dict {status: count}; the results are printed as they finish."""
+    template = load_template(template)
+    records = read_manifest(manifest)
+    errors = validate(records, template, default_terms) or check_dataverses(api, records)
+    if errors:
+        raise DataverseError(f"{len(errors)} problem(s) in {manifest}:\n" + '\n'.join(errors))
+    counts = {}
+    with IdMap(id_map_path) as id_map:
+        for key, status, entry in create_datasets(api, records, template, id_map, jobs, publish, default_terms):
+            counts[status] = counts.get(status, 0) + 1
+            if status == 'failed':
+                print(f"{key}: {entry}")
+            elif status != 'exists':
+                print(f"{key}: {status} {entry['persistentId']} (id {entry['id']})")
+    return counts
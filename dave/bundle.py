@@ -0,0 +1,53 @@
+"""Bundling of small files into zip archives.
+Dataverse unpacks an uploaded zip archive and keeps the directory structure of its
+entries, so many small files can be added to a dataset with one request. A bundle is
+built in a spooled temporary file: in memory up to `spool_size` bytes, on disk beyond.
+"""
+
+from tempfile import SpooledTemporaryFile
+from zipfile import ZipFile, ZIP_DEFLATED
+
+DEFAULT_MAX_BYTES = 100 << 20  # 100 MiB of file contents per bundle
+DEFAULT_MAX_FILES = 500        # Dataverse unpacks at most :ZipUploadFilesLimit (default 1000)
+DEFAULT_SPOOL_SIZE = 32 << 20  # 32 MiB
+
+class Grouper:
+    """Collects items per key into groups of at most `max_files` items, with sizes that
+    add up to at most `max_bytes`; items with different keys never share a group, and
+    an item that is larger than `max_bytes` gets a group of its own"""
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, max_files=DEFAULT_MAX_FILES):
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.groups = {}  # key -> (items, total size)
+
+    def add(self, key, item, size):
+        """Add `item` to the group of `key`. If the group was full, return its items
+        (the item is added to a new group); otherwise return None."""
+        items, total = self.groups.get(key, ([], 0))
+        full = None
+        if items and (len(items) >= self.max_files or total + size > self.max_bytes):
+            full, items, total = items, [], 0
+        items.append(item)
+        self.groups[key] = (items, total + size)
+        return full
+
+    def flush(self):
+        """Return a list of (key, items) of the groups that are not empty, and start over"""
+        result = [(key, items) for key, (items, _) in self.groups.items() if items]
+        self.groups = {}
+        return result
+
+def build_zip(entries, spool_size=DEFAULT_SPOOL_SIZE):
+    """Return a spooled temporary file, positioned at the start, that contains a zip
+    archive with the files in `entries`, a list of (path, name in archive).
+    The caller should close the returned file."""
+    spool = SpooledTemporaryFile(max_size=spool_size)
+    try:
+        with ZipFile(spool, 'w', ZIP_DEFLATED) as zip_file:
+            for path, arcname in entries:
+                zip_file.write(path, arcname)
+    except Exception:
+        spool.close()
+        raise
+    spool.seek(0)
+    return spool
@@ -0,0 +1,187 @@
+"""Cache of GET responses for dave.simple.Api.
+Responses are kept as JSON text in a least-recently-used dict that is bounded by the
+total size of the texts, with a time to live that depends on the endpoint. Optionally,
+responses are also written to an SQLite file, so that they survive the session and
+entries that were evicted from memory can still be found.
+A POST, PUT or DELETE on a dataverse or dataset invalidates all cached responses of
+that dataverse or dataset (by id and by alias or persistent id), and all search results.
+A write by persistent id of a dataset whose id is not known invalidates all datasets.
+"""
+
+import json, os, re, sqlite3, time
+from collections import OrderedDict
+from os.path import dirname, expanduser
+from threading import Lock
+from urllib.parse import parse_qs, urlsplit
+
+DEFAULT_MAX_BYTES = 64 << 20  # 64 MiB of JSON text
+DEFAULT_TTL = 60              # seconds
+
+# (regular expression on the path of the endpoint, time to live in seconds); first match wins
+DEFAULT_TTLS = [
+    (r'/api/info/', 3600),
+    (r'/api/dataverses/[^/]+$', 600),
+    (r'/api/dataverses/[^/]+/(groups|assignments)$', 300),
+    (r'/api/dataverses/[^/]+/contents$', 60),
+    (r'/api/datasets/[^/]+/versions', 60),
+    (r'/api/search', 30),
+]
+
+OBJECT_PATH = re.compile(r'/api/(dataverses|datasets)/([^/?]+)')
+
+class ResponseCache:
+    """LRU cache of the data of GET responses, keyed by URL
+       Instance variables:
+           - max_bytes: maximum total size of the cached JSON texts in memory
+           - ttls: list of (compiled regex, seconds) for the time to live per endpoint
+           - path: path of the SQLite file of the disk tier, or None
+           - stats: dict with the numbers of hits, disk hits, misses, evictions
+             and invalidations
+    """
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, ttls=None, default_ttl=DEFAULT_TTL, path=None):
+        self.max_bytes = max_bytes
+        self.ttls = [(re.compile(pattern), ttl) for pattern, ttl in
+                     (DEFAULT_TTLS if ttls is None else ttls)]
+        self.default_ttl = default_ttl
+        self.entries = OrderedDict()  # url -> (expiry time, JSON text)
+        self.size = 0
+        self.aliases = {}             # dataverse id <-> alias, dataset id <-> persistent id, as str
+        self.stats = dict(hits=0, disk_hits=0, misses=0, evictions=0, invalidations=0)
+        self.lock = Lock()
+        self.path = expanduser(path) if path else None
+        self.db = None
+        if self.path:
+            if dirname(self.path):
+                os.makedirs(dirname(self.path), exist_ok=True)
+            self.db = sqlite3.connect(self.path, check_same_thread=False)
+            self.db.execute('CREATE TABLE IF NOT EXISTS responses '
+                            '(url TEXT PRIMARY KEY, expires REAL, body TEXT)')
+            self.db.commit()
+
+    def ttl(self, url):
+        """Return the time to live of the response of `url`"""
+        path = urlsplit(url).path
+        for regex, ttl in self.ttls:
+            if regex.search(path):
+                return ttl
+        return self.default_ttl
+
+    def get(self, url):
+        """Return the cached data of `url`, or None. Every hit returns a new copy, so the
+        caller can modify it."""
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(url)
+            if entry is not None and entry[0] < now:
+                self._remove(url)
+                entry = None
+            if entry is not None:
+                self.entries.move_to_end(url)
+                self.stats['hits'] += 1
+                return json.loads(entry[1])
+            if self.db is not None:
+                row = self.db.execute('SELECT expires, body FROM responses WHERE url = ?',
+                                      (url,)).fetchone()
+                if row is not None and row[0] >= now:
+                    self._store(url, row[0], row[1])
+                    self.stats['disk_hits'] += 1
+                    return json.loads(row[1])
+            self.stats['misses'] += 1
+            return None
+
+    def put(self, url, data):
+        """Cache the data of the response of `url`"""
+        ttl = self.ttl(url)
+        if ttl <= 0:
+            return
+        text = json.dumps(data, separators=(',', ':'))
+        expires = time.time() + ttl
+        with self.lock:
+            self._store(url, expires, text)
+            for identifier, name in _names(data):
+                self.aliases[identifier] = name
+                self.aliases[name] = identifier
+            if self.db is not None:
+                self.db.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?)',
+                                (url, expires, text))
+                self.db.commit()
+
+    def invalidate(self, url):
+        """Remove the cached responses that a POST, PUT or DELETE on `url` can change"""
+        target = _object(url)
+        with self.lock:
+            kind, names = None, set()
+            if target is not None:
+                kind, key = target
+                names = {key, self.aliases.get(key)} - {None}
+                if kind == 'datasets' and ':' in key and key not in self.aliases:
+                    names = None  # a persistent id whose dataset id is not known: all datasets
+            def stale(cached):
+                if urlsplit(cached).path.startswith('/api/search'):
+                    return True
+                obj = _object(cached)
+                return obj is not None and obj[0] == kind and (names is None or obj[1] in names)
+            for cached in list(self.entries):
+                if stale(cached):
+                    self._remove(cached)
+                    self.stats['invalidations'] += 1
+            if self.db is not None:
+                urls = [row[0] for row in self.db.execute('SELECT url FROM responses')]
+                self.db.executemany('DELETE FROM responses WHERE url = ?',
+                                    [(cached,) for cached in urls if stale(cached)])
+                self.db.commit()
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+            if self.db is not None:
+                self.db.execute('DELETE FROM responses')
+                self.db.commit()
+
+    def summary(self):
+        """Return a dict with the statistics and the number and size of cached entries"""
+        with self.lock:
+            return dict(self.stats, entries=len(self.entries), bytes=self.size)
+
+    def _store(self, url, expires, text):
+        if url in self.entries:
+            self._remove(url)
+        if len(text) > self.max_bytes:
+            return
+        self.entries[url] = (expires, text)
+        self.size += len(text)
+        while self.size > self.max_bytes:
+            oldest = next(iter(self.entries))
+            self._remove(oldest)
+            self.stats['evictions'] += 1
+
+    def _remove(self, url):
+        _, text = self.entries.pop(url)
+        self.size -= len(text)
+
+def _object(url):
+    """Return ('dataverses' or 'datasets', id or alias or persistent id) of the object that
+    `url` is about, e.g. the persistent id of '/api/datasets/:persistentId/versions?persistentId=doi:...',
+    or None"""
+    parts = urlsplit(url)
+    match = OBJECT_PATH.search(parts.path)
+    if match is None:
+        return None
+    kind, key = match.groups()
+    if key == ':persistentId':
+        key = parse_qs(parts.query).get('persistentId', [key])[0]
+    return kind, key
+
+def _names(data):
+    """Generate (id, alias or persistent id) of the dataverses, datasets and dataset
+    versions in the data of a response"""
+    for item in data if isinstance(data, list) else [data]:
+        if not isinstance(item, dict):
+            continue
+        if 'alias' in item and 'id' in item:
+            yield str(item['id']), item['alias']
+        elif 'datasetPersistentId' in item and 'datasetId' in item:
+            yield str(item['datasetId']), item['datasetPersistentId']
+        elif 'id' in item and item.get('protocol') and item.get('authority') and item.get('identifier'):
+            yield str(item['id']), '{}:{}/{}'.format(item['protocol'], item['authority'], item['identifier'])
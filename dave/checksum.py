@@ -0,0 +1,74 @@
+"""Checksums of local files, in the form that Dataverse reports them.
+Dataverse reports a checksum type (MD5 by default, or SHA-1, SHA-256, SHA-512) and value
+for every data file. ChecksumPipeline hashes files in a thread pool (hashlib releases
+the GIL while hashing large buffers) so that hashing overlaps with uploads, and reuses
+digests that are already known, e.g. PREMIS fixity values from a METS file.
+"""
+
+import hashlib, mmap
+from concurrent.futures import Future, ThreadPoolExecutor
+
+MMAP_BLOCK_SIZE = 8 << 20      # 8 MiB
+
+def normalize_algorithm(name):
+    """Return the hashlib name of a checksum type: 'MD5' -> 'md5', 'SHA-256' -> 'sha256'"""
+    return name.lower().replace('-', '').replace('_', '')
+
+def file_digest(path, algorithm='md5'):
+    """Return the hexadecimal digest of the file at `path`; the file is memory mapped,
+    so it is read in large blocks without copying it into Python buffers"""
+    digest = hashlib.new(normalize_algorithm(algorithm))
+    with open(path, 'rb') as f:
+        try:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # empty file
+            return digest.hexdigest()
+        with mapped:
+            view = memoryview(mapped)
+            try:
+                for start in range(0, len(view), MMAP_BLOCK_SIZE):
+                    digest.update(view[start:start + MMAP_BLOCK_SIZE])
+            finally:
+                view.release()
+    return digest.hexdigest()
+
+def file_md5(path):
+    """Return the hexadecimal MD5 digest of the file at `path`"""
+    return file_digest(path, 'md5')
+
+class ChecksumPipeline:
+    """Computes checksums of files in the background
+       Instance variables:
+           - algorithm: hashlib name of the checksum algorithm
+           - executor: thread pool that hashes the files
+           - futures: dict {key: Future with (digest, source)}, where source is
+             'known' for a reused digest and 'local' for a computed one
+    """
+    def __init__(self, algorithm='md5', jobs=4):
+        self.algorithm = normalize_algorithm(algorithm)
+        self.executor = ThreadPoolExecutor(max_workers=max(jobs, 1))
+        self.futures = {}
+
+    def submit(self, key, path, known=None):
+        """Start hashing `path`, unless `known` = (algorithm, digest) already has
+        a digest with the algorithm of the pipeline"""
+        if known and known[1] and normalize_algorithm(known[0]) == self.algorithm:
+            future = Future()
+            future.set_result((known[1].lower(), 'known'))
+        else:
+            future = self.executor.submit(lambda: (file_digest(path, self.algorithm), 'local'))
+        self.futures[key] = future
+        return future
+
+    def result(self, key):
+        """Return (digest, source) of `key`; waits until the digest is computed"""
+        return self.futures[key].result()
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
@@ -1,15 +1,14 @@
 from datetime import datetime
-import json, sys
-from requests import ConnectionError, delete, get, put, post
+import json
+from requests import ConnectionError, Timeout
 from .common import DataverseError
+from .metrics import RequestTimer
 from .models import Dataverse, Dataset
-
-method_callable = {
-    'GET': get, 'PUT': put, 'POST': post, 'DELETE': delete
-}
+from .scheduler import get_scheduler
+from .session import auth_headers, get_session
 
 class Connection:
-    def __init__(self, base_url, api_token=None, api_version='v1'):
+    def __init__(self, base_url, api_token=None, api_version='v1', session=None, scheduler=None):
         if not isinstance(base_url, str):
             raise ConnectionError('base_url {0} is not a string'.format(base_url))
         self.base_url = base_url
@@ -20,13 +19,22 @@ class Connection:
             if not isinstance(api_token, str):
                 raise ConnectionError('api_token is not a string')
         self.api_token = api_token
+        self.auth_headers = auth_headers(api_token)
+        # the pooled session is shared with other connections to the same host,
+        # so the /info/server request below already opens a reusable connection
+        self.session = session if session is not None else get_session(base_url)
+        # rate limiting and retries are shared with other clients of the same host
+        self.scheduler = scheduler if scheduler is not None else get_scheduler(base_url)
         self.connection_started = datetime.now()
+        # identity map: every dataverse and dataset is fetched at most once per connection,
+        # keyed by ('dataverse', id or alias) and ('dataset', id or persistent id)
+        self.identity = {}
         query = '/info/server'
         if base_url and api_version:
             self.native_api_base_url = '{0}/api'.format(self.base_url)
             url = '{0}{1}'.format(self.native_api_base_url, query)
             try:
-                response = get(url)
+                response = self.scheduler.send('GET', lambda: self.session.get(url))
                 if response:
                     self.status = response.json()['status']
                     print('Succesfully created connection with request {0}'.format(url))
@@ -50,9 +58,7 @@ class Connection:
             auth = False
         if auth:
             if self.api_token:
-                if 'params' not in kwarg:
-                    kwarg['params'] = {}
-                kwarg['params']['key'] = self.api_token
+                kwarg['headers'] = dict(self.auth_headers, **kwarg.get('headers', {}))
             else:
                 DataverseError('{0}: no API token for {1}'.format(method, url))
         try:
@@ -71,12 +77,29 @@ class Connection:
                     raise DataverseError('Metadata must be str of dict, not {}'.\
                                          format(str(type(metadata))))
                 del kwarg['metadata']
+            elif 'data' in kwarg:  # request body such as a MultipartEncoder
+                payload = kwarg.pop('data')
             else:
                 payload = {}
             if debug:
                 print('!!! kwarg={}'.format(kwarg))
-            response = method_callable[method](url, data=payload, **kwarg)
-            # print('response.json={}'.format(response.json()))
+            streamed = []
+            def send():
+                # a retried upload must send the files from the start again
+                for value in kwarg.get('files', {}).values():
+                    if hasattr(value, 'seek'):
+                        value.seek(0)
+                if hasattr(payload, 'rewind'):
+                    payload.rewind()
+                # a streamed response that is retried still holds its connection
+                while streamed:
+                    streamed.pop().close()
+                response = self.session.request(method, url, data=payload, **kwarg)
+                if kwarg.get('stream'):
+                    streamed.append(response)
+                return response
+            with RequestTimer(method, url, payload, stream=kwarg.get('stream', False)) as timer:
+                timer.response = response = self.scheduler.send(method, timer.wrap(send))
             code = response.status_code
             code_class = code // 100
             # 1: informational response, caller should decide what to do
@@ -84,16 +107,19 @@ class Connection:
             # 4: client error, caller should handle this class of error
             if code_class in [1, 2, 4]:
                 return response
-            elif code_class in [3, 5]: # redirection or server error
-                message = response.json()['message']
+            elif code_class in [3, 5]: # redirection or server error, after retries
+                try:
+                    message = response.json()['message']
+                except (ValueError, KeyError):
+                    message = response.text
                 raise DataverseError('{0}: HTTP error {1} - {2}: {3}'.\
                                      format(method, response.status_code, url, message))
             else: # this should never occur
                 raise DataverseError('{}: unexpected status code {} for {}'.\
                                      format(method, code, url))
-        except ConnectionError:
-            print('{}: could not create connection {}'.format(method, url))
-            sys.exit(1)
+        except (ConnectionError, Timeout) as e:
+            raise DataverseError('{0}: could not create connection {1} ({2})'.\
+                                 format(method, url, e))
 
     def get_request(self, endpoint, **kwarg):
         return self._request('GET', endpoint, **kwarg)
@@ -104,17 +130,36 @@ class Connection:
     def put_request(self, endpoint, **kwarg):
         return self._request('PUT', endpoint, **kwarg)
 
+    def known(self, kind, identifier):
+        """Return the dataverse or dataset of `kind` with `identifier` if it was seen before"""
+        return self.identity.get((kind, str(identifier)))
+
+    def remember(self, kind, obj, *identifiers):
+        for identifier in identifiers:
+            self.identity[(kind, str(identifier))] = obj
+
+    def forget(self, kind, obj):
+        """Remove a deleted dataverse or dataset from the identity map"""
+        for key in [key for key, value in self.identity.items() if key[0] == kind and value is obj]:
+            del self.identity[key]
+
     def get_dataverse(self, identifier, auth=False):
-        endpoint = '/dataverses/{0}'.format(identifier)
-        response = self.get_request(endpoint, auth=auth)
-        # print(response.json())
-        return Dataverse(connection=self, data=response.json()['data'])
+        dataverse = self.known('dataverse', identifier)
+        if dataverse is None:
+            endpoint = '/dataverses/{0}'.format(identifier)
+            response = self.get_request(endpoint, auth=auth)
+            dataverse = Dataverse(connection=self, data=response.json()['data'])
+            self.remember('dataverse', dataverse, identifier, dataverse.identifier, dataverse.alias)
+        return dataverse
 
     def get_dataset(self, identifier, is_pid=False, auth=True):
-        if is_pid:
-            endpoint = '/datasets/:persistentId/?persistentId={0}'.format(identifier)
-        else:
-            endpoint = '/datasets/{0}'.format(identifier)
-        response = self.get_request(endpoint, auth=auth)
-        # print(response.json())
-        return Dataset(connection=self, data=response.json()['data'])
\ No newline at end of file
+        dataset = self.known('dataset', identifier)
+        if dataset is None:
+            if is_pid:
+                endpoint = '/datasets/:persistentId/?persistentId={0}'.format(identifier)
+            else:
+                endpoint = '/datasets/{0}'.format(identifier)
+            response = self.get_request(endpoint, auth=auth)
+            dataset = Dataset(connection=self, data=response.json()['data'])
+            self.remember('dataset', dataset, identifier, dataset.dataset_id, dataset.pid())
+        return dataset
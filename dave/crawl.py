@@ -0,0 +1,75 @@
+"""Concurrent crawler of a dataverse tree.
+Crawler walks all sub-dataverses below a root dataverse, at any depth, with a bounded
+thread pool: the contents of sibling dataverses are requested in parallel, and every
+dataverse is viewed at most once. Datasets are handed to a function as soon as the
+contents of their dataverse arrive, and the results are generated as they finish.
+"""
+
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from threading import Lock
+
+DEFAULT_JOBS = 8
+
+class Crawler:
+    """Crawler of the dataverses and datasets below a root dataverse
+       Instance variables:
+           - api: dave.Api instance
+           - jobs: maximum number of requests in flight
+           - views: dict {dataverse id: view}, so that every dataverse is viewed once
+           - errors: number of views and contents listings that failed; the datasets
+             below such a dataverse are missing from the results
+    """
+    def __init__(self, api, jobs=DEFAULT_JOBS):
+        self.api = api
+        self.jobs = jobs
+        self.views = {}
+        self.errors = 0
+        self.lock = Lock()
+
+    def view(self, dataverse_id):
+        """Return the view of a dataverse; every dataverse is requested only once"""
+        with self.lock:
+            if dataverse_id in self.views:
+                return self.views[dataverse_id]
+        view = self.api.dataverse_view(dataverse_id)
+        with self.lock:
+            return self.views.setdefault(dataverse_id, view)
+
+    def _contents(self, dataverse_id, alias=None):
+        """Return (alias, contents) of a dataverse; a failed request is counted in `errors`"""
+        failed = 0
+        if alias is None:
+            view = self.view(dataverse_id)
+            if not (isinstance(view, dict) and 'alias' in view):
+                view, failed = {}, failed + 1
+            alias = view.get('alias', dataverse_id)
+        contents = self.api.dataverse_contents(dataverse_id)
+        if not isinstance(contents, list):
+            contents, failed = [], failed + 1
+        if failed:
+            with self.lock:
+                self.errors += failed
+        return alias, contents
+
+    def map_datasets(self, root, func):
+        """Call func(alias, dataset) for every dataset in the tree below the dataverse with
+        alias `root`, where `dataset` is an item of the contents of the dataverse with
+        alias `alias`. Generate the results of func in the order in which they finish."""
+        with ThreadPoolExecutor(max_workers=max(self.jobs, 1)) as executor:
+            listings = {executor.submit(self._contents, root, root)}
+            results = set()
+            while listings or results:
+                done, _ = wait(listings | results, return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future in results:
+                        results.discard(future)
+                        yield future.result()
+                        continue
+                    listings.discard(future)
+                    alias, contents = future.result()
+                    for elt in contents:
+                        if elt['type'] == 'dataverse':
+                            listings.add(executor.submit(self._contents, elt['id']))
+                        elif elt['type'] == 'dataset':
+                            results.add(executor.submit(func, alias, elt))
+
@@ -0,0 +1,147 @@
+"""Indexed tree of the files and folders in an Archivematica DIP.
+Every node is indexed by its path relative to the DIP root, and every folder indexes
+its files by name and by UUID prefix: Archivematica names object files
+'<file UUID>-<original name>', and the METS file refers to them by that UUID.
+Lookups are dict accesses, so matching all METS entries to files is linear in the
+number of files. Nodes use __slots__, because a DIP can contain 100k files.
+"""
+
+import os
+from os.path import join, abspath
+
+UUID_LENGTH = 36  # e.g. 3cb0dd4e-25f2-418c-9530-30e5fc2ebb5b
+
+class Node:
+    """Node is the base class for Folder and File
+       Instance variables:
+           - name: name of node (last part of path)
+           - path: absolute path of node
+           - relpath: path relative to the root of the tree ('' for the root)
+           - parent: parent node
+
+       Instance methods:
+           - root: find root of tree
+    """
+    __slots__ = ('name', 'path', 'relpath', 'parent')
+    kind = 'Node'
+
+    def __init__(self, name, path, relpath, parent=None):
+        """construct Node with given name, path, relative path and parent"""
+        self.name = name
+        self.path = path
+        self.relpath = relpath
+        self.parent = parent
+
+    def __str__(self):
+        return '{} {}'.format(self.kind, self.path)
+
+    def root(self):
+        """Find root of tree in which this node lives. Follow parent chain until you get 'None'"""
+        this = self
+        while this.parent is not None:
+            this = this.parent
+        return this
+
+class File(Node):
+    __slots__ = ()
+    kind = 'File'
+
+class Folder(Node):
+    """Folder with its child files and folders indexed by name, and its files by UUID prefix"""
+    __slots__ = ('_files', '_folders', '_prefixes')
+    kind = 'Folder'
+
+    def __init__(self, name, path, relpath, parent=None):
+        """create new Folder node"""
+        super().__init__(name, path, relpath, parent)
+        self._files = {}
+        self._folders = {}
+        self._prefixes = {}
+
+    def add(self, node):
+        """add child node"""
+        node.parent = self
+        if node.kind == 'Folder':
+            self._folders[node.name] = node
+        else:
+            self._files[node.name] = node
+            self._prefixes.setdefault(node.name[:UUID_LENGTH], node)
+
+    @property
+    def children(self):
+        return list(self._folders.values()) + list(self._files.values())
+
+    def file(self, name):
+        """return file node with given name in this folder"""
+        return self._files.get(name)
+
+    def find(self, prefix):
+        """return file node with name that starts with prefix"""
+        if len(prefix) == UUID_LENGTH:
+            node = self._prefixes.get(prefix)
+            return node if node is not None and node.name.startswith(prefix) else None
+        for node in self._files.values():  # not a UUID: no index for this prefix length
+            if node.name.startswith(prefix):
+                return node
+        return None
+
+    def files(self):
+        """return all file nodes in this folder"""
+        return list(self._files.values())
+
+    def folder(self, name):
+        """return folder node with given name in this folder"""
+        return self._folders.get(name)
+
+    def folders(self):
+        """return all folder nodes in this folder"""
+        return list(self._folders.values())
+
+class DipTree:
+    """Tree of a DIP on disk
+       Instance variables:
+           - root: root Folder
+           - index: dict {relative path: node} of all files and folders
+    """
+    def __init__(self, dip_root, debug=False):
+        dip_root = abspath(dip_root)
+        self.root = Folder('', dip_root, '')
+        self.index = {'': self.root}
+        for dirpath, dirnames, filenames in os.walk(dip_root):
+            rel = os.path.relpath(dirpath, dip_root)
+            rel = '' if rel == '.' else rel
+            folder = self.index[rel]
+            for name in dirnames:
+                child_rel = join(rel, name) if rel else name
+                if debug:
+                    print('folder: name={} path={}'.format(name, join(dirpath, name)))
+                child = Folder(name, join(dirpath, name), child_rel)
+                folder.add(child)
+                self.index[child_rel] = child
+            for name in filenames:
+                child_rel = join(rel, name) if rel else name
+                if debug:
+                    print('file: name={} path={}'.format(name, join(dirpath, name)))
+                child = File(name, join(dirpath, name), child_rel)
+                folder.add(child)
+                self.index[child_rel] = child
+
+    def get(self, relpath):
+        """return the node with the given path relative to the root, or None"""
+        return self.index.get(relpath.strip('/'))
+
+    def folder(self, relpath):
+        """return the folder with the given relative path, or None"""
+        node = self.get(relpath)
+        return node if node is not None and node.kind == 'Folder' else None
+
+    def files(self):
+        """return the files in the root folder"""
+        return self.root.files()
+
+    def __len__(self):
+        return len(self.index)
+
+def generate_tree(dip_root, debug=False):
+    """generate indexed tree from files and directories in input directory"""
+    return DipTree(dip_root, debug=debug)
@@ -0,0 +1,195 @@
+"""Direct upload of files to the S3-compatible store of a dataset.
+With direct upload, file contents do not pass through the Dataverse application server:
+Dataverse hands out presigned URLs (/datasets/{id}/uploadurls), the file is PUT to the
+store, in parts that are uploaded in parallel if it is larger than the part size of the
+store, and then the file is registered with its checksum (/datasets/{id}/addFiles).
+Every part is read from the file in chunks while it is sent, so memory use does not
+depend on the part size, and it is retried on its own by the scheduler of the store.
+If the store of a dataset does not allow direct upload, DirectUploadUnavailable is
+raised before anything is uploaded, so the caller can use Dataset.add_file instead.
+"""
+
+import json, mimetypes
+from concurrent.futures import ThreadPoolExecutor
+from os.path import basename, getsize
+from threading import Lock
+from .common import DataverseError
+from .metrics import RequestTimer
+from .multipart import DEFAULT_CHUNK_SIZE, MultipartEncoder
+from .scheduler import get_scheduler
+from .session import get_session
+
+DEFAULT_PART_JOBS = 4  # parts of one file in flight
+PART_ATTEMPTS = 3      # a part that fails with a server error (e.g. S3 InternalError) is sent again
+UPLOAD_URL_ERRORS = (401, 403, 429)  # a client error of /uploadurls that is not about the store
+CHECKSUM_TYPES = {'md5': 'MD5', 'sha1': 'SHA-1', 'sha256': 'SHA-256', 'sha512': 'SHA-512'}
+
+class DirectUploadUnavailable(DataverseError):
+    """The store of the dataset does not allow direct upload"""
+
+class _Progress:
+    """Sum of the bytes sent by the parts of a file, for a callable progress(sent, total)"""
+    def __init__(self, progress, total):
+        self.progress = progress
+        self.total = total
+        self.sent = 0
+        self.lock = Lock()
+
+    def add(self, size):
+        if self.progress is not None:
+            with self.lock:
+                self.sent += size
+                self.progress(self.sent, self.total)
+
+class FilePart:
+    """File-like object with the bytes `start` to `start + size` of a file, that requests
+    sends as a stream; every part has its own file handle, so parts can be sent in parallel
+       Instance variables:
+           - path, start, size: the part of the file
+           - sent: number of bytes read since the last rewind
+    """
+    def __init__(self, path, start, size, progress=None, chunk_size=DEFAULT_CHUNK_SIZE):
+        self.path = path
+        self.start = start
+        self.size = size
+        self.progress = progress
+        self.chunk_size = chunk_size
+        self.file = open(path, 'rb')
+        self.sent = 0
+        self.rewind()
+
+    def __len__(self):
+        return self.size
+
+    def rewind(self):
+        """Start reading the part from the beginning (e.g. to retry the upload)"""
+        if self.progress is not None:
+            self.progress.add(-self.sent)
+        self.file.seek(self.start)
+        self.sent = 0
+
+    def read(self, size=-1):
+        remaining = self.size - self.sent
+        if size is None or size < 0 or size > remaining:
+            size = remaining
+        data = self.file.read(min(size, self.chunk_size))
+        self.sent += len(data)
+        if self.progress is not None and data:
+            self.progress.add(len(data))
+        return data
+
+    def close(self):
+        self.file.close()
+
+def _api_endpoint(url):
+    """endpoint for a Connection of a path that Dataverse returns, e.g. '/api/datasets/mpupload?...'"""
+    return url[len('/api'):] if url.startswith('/api/') else url
+
+def put_part(url, part, headers=None):
+    """PUT `part` (a FilePart) to the presigned `url`; return the ETag of the stored part.
+    Throttling and connection errors are retried by the scheduler of the store, server
+    errors PART_ATTEMPTS times in total."""
+    session, scheduler = get_session(url), get_scheduler(url)
+    def send():
+        part.rewind()
+        return session.put(url, data=part, headers=headers)
+    for attempt in range(PART_ATTEMPTS):
+        with RequestTimer('PUT', '/s3/part', part) as timer:
+            timer.response = scheduler.send('PUT', timer.wrap(send))
+        response = timer.response
+        if response.status_code // 100 == 2:
+            return response.headers.get('ETag', '').strip('"')
+        if response.status_code < 500:
+            break
+    raise DataverseError('PUT of bytes {0}-{1} of {2} to the store failed: HTTP error {3} {4}'.\
+                         format(part.start, part.start + part.size - 1, part.path,
+                                response.status_code, response.text[:200]))
+
+def upload_urls(connection, dataset_id, size):
+    """Return the presigned URL(s) for a file of `size` bytes: a dict with either 'url',
+    or 'urls' {part number: url}, 'partSize', 'complete' and 'abort'; and 'storageIdentifier'"""
+    endpoint = '/datasets/{0}/uploadurls?size={1}'.format(dataset_id, size)
+    response = connection.get_request(endpoint, auth=True)
+    code = response.status_code
+    if code == 200:
+        return response.json()['data']
+    try:
+        message = response.json().get('message', '')
+    except ValueError:
+        message = response.text
+    if code // 100 == 4 and code not in UPLOAD_URL_ERRORS:
+        raise DirectUploadUnavailable('Dataset {0} does not allow direct upload: {1} ({2})'.\
+                                      format(dataset_id, message, code))
+    # not an answer about the store: uploading through Dataverse would not help
+    raise DataverseError('Upload URLs of dataset {0} could not be requested: {1} ({2})'.\
+                         format(dataset_id, message, code))
+
+def upload_to_store(connection, dataset_id, path, jobs=DEFAULT_PART_JOBS, progress=None,
+                    chunk_size=DEFAULT_CHUNK_SIZE):
+    """Upload the file at `path` to the store of the dataset, in parts in parallel if the
+    store asks for parts; return the storage identifier for register_files. A multipart
+    upload that fails is aborted, so the store does not keep the parts."""
+    size = getsize(path)
+    urls = upload_urls(connection, dataset_id, size)
+    reporter = _Progress(progress, size)
+    if 'url' in urls:
+        part = FilePart(path, 0, size, reporter, chunk_size)
+        try:
+            put_part(urls['url'], part, headers={'x-amz-tagging': 'dv-state=temp'})
+        finally:
+            part.close()
+        return urls['storageIdentifier']
+    part_size = int(urls['partSize'])
+    numbers = sorted(urls['urls'], key=int)
+    def upload(number):
+        start = (int(number) - 1) * part_size
+        part = FilePart(path, start, min(part_size, size - start), reporter, chunk_size)
+        try:
+            return number, put_part(urls['urls'][number], part)
+        finally:
+            part.close()
+    try:
+        with ThreadPoolExecutor(max_workers=max(min(jobs, len(numbers)), 1)) as executor:
+            etags = dict(executor.map(upload, numbers))
+        response = connection.put_request(_api_endpoint(urls['complete']), metadata=etags, auth=True)
+        if response.status_code != 200:
+            raise DataverseError('Multipart upload of {0} could not be completed: {1} ({2})'.\
+                                 format(path, response.text[:200], response.status_code))
+    except BaseException:
+        try:
+            connection.delete_request(_api_endpoint(urls['abort']), auth=True)
+        except DataverseError:
+            pass  # the original error is more useful
+        raise
+    return urls['storageIdentifier']
+
+def file_entry(path, storage_identifier, checksum, metadata):
+    """Return the jsonData entry of a file for register_files; `checksum` is (type, value),
+    `metadata` a dict with e.g. description, directoryLabel and restrict"""
+    checksum_type, value = checksum
+    entry = dict(metadata, storageIdentifier=storage_identifier, fileName=basename(path),
+                 mimeType=mimetypes.guess_type(path)[0] or 'application/octet-stream')
+    entry['checksum'] = {'@type': CHECKSUM_TYPES.get(checksum_type.lower().replace('-', ''), checksum_type),
+                         '@value': value}
+    return entry
+
+def register_files(connection, dataset_id, entries):
+    """Add the files that were uploaded to the store to the dataset, with one request;
+    return the list of added files, like Dataset.add_file"""
+    body = MultipartEncoder([('jsonData', json.dumps(entries))])
+    response = connection.post_request('/datasets/{0}/addFiles'.format(dataset_id), data=body, auth=True,
+                                       headers={'Content-Type': body.content_type})
+    resp_json = response.json()
+    if response.status_code != 200:
+        raise DataverseError('Files could not be registered in dataset {0}: {1} ({2})'.\
+                             format(dataset_id, resp_json.get('message', ''), response.status_code))
+    files, errors = [], []
+    for result in resp_json['data'].get('Files', []):
+        if 'fileDetails' in result:
+            files.append(result['fileDetails'])
+        else:
+            errors.append('{0}: {1}'.format(result.get('storageIdentifier'), result.get('errorMessage')))
+    if errors:
+        raise DataverseError('Files could not be registered in dataset {0}: {1}'.\
+                             format(dataset_id, '; '.join(errors)))
+    return files
@@ -0,0 +1,173 @@
+"""Streaming download of the files of datasets, e.g. to mirror a dataverse.
+Every file is streamed in chunks to `<name>.part`, so memory use does not depend on the
+file size, and it gets its own name only when its checksum matches the checksum in the
+file listing of the version. A download that breaks off continues where it stopped with
+an HTTP Range request, also in a later run. A file that is present and verified is
+skipped; the verified files are logged in the target folder (size, modification time and
+checksum), so that a later run does not read them again.
+"""
+
+import hashlib, os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from os.path import dirname, exists, getsize, isabs, join, normpath
+from requests.exceptions import ChunkedEncodingError, ConnectionError, Timeout
+from .bulk import IdMap
+from .common import DataverseError
+from .direct import CHECKSUM_TYPES
+from .multipart import DEFAULT_CHUNK_SIZE
+
+DEFAULT_JOBS = 4
+DOWNLOAD_ATTEMPTS = 5  # a download that breaks off continues where it stopped
+PARTIAL_SUFFIX = '.part'
+VERIFIED_LOG = '.dvmirror.jsonl'
+ALGORITHMS = {value: key for key, value in CHECKSUM_TYPES.items()}  # e.g. 'SHA-1': 'sha1'
+
+def is_original(file_meta):
+    """True if the file is an ingested tabular file, whose original is downloaded"""
+    return 'originalFileFormat' in file_meta['dataFile']
+
+def file_checksum(file_meta):
+    """Return (hashlib algorithm, value) of the checksum of a file of a version's file
+    listing, or None if it has none"""
+    data_file = file_meta['dataFile']
+    checksum = data_file.get('checksum') or {}
+    if checksum.get('type') in ALGORITHMS:
+        return ALGORITHMS[checksum['type']], checksum['value']
+    if data_file.get('md5'):
+        return 'md5', data_file['md5']
+    return None
+
+def file_size(file_meta):
+    data_file = file_meta['dataFile']
+    return data_file.get('originalFileSize') if is_original(file_meta) else data_file.get('filesize')
+
+def relative_path(file_meta):
+    """Return the path of a file in the folder of its dataset: directoryLabel/label, with
+    the name of the original of an ingested file; a path outside the folder is refused"""
+    data_file = file_meta['dataFile']
+    label = data_file.get('originalFileName') if is_original(file_meta) else None
+    path = normpath(join(file_meta.get('directoryLabel') or '', label or file_meta['label']))
+    if path.startswith('..') or isabs(path):
+        raise DataverseError('File {0} has an unsafe path: {1}'.format(data_file['id'], path))
+    return path
+
+def dataset_folder(dataset):
+    """name of the folder of a dataset: its persistent id, e.g. doi_10.5072_FK2_ABCDEF"""
+    return dataset.pid().replace(':', '_').replace('/', '_')
+
+def hash_file(path, algorithm, chunk_size=DEFAULT_CHUNK_SIZE):
+    digest = hashlib.new(algorithm)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest
+
+def _verified(path, checksum, verified, key):
+    """True if the file at `path` was verified with `checksum` and has not changed since"""
+    entry = verified.get(key) if verified is not None else None
+    if entry is None or checksum is None:
+        return False
+    stat = os.stat(path)
+    return entry.get('size') == stat.st_size and entry.get('mtime') == stat.st_mtime_ns and \
+           entry.get('checksum') == checksum[1]
+
+def _record(path, checksum, verified, key):
+    if verified is not None and checksum is not None:
+        stat = os.stat(path)
+        verified.add(key, size=stat.st_size, mtime=stat.st_mtime_ns, checksum=checksum[1])
+
+def download_file(dataset, file_meta, path, chunk_size=DEFAULT_CHUNK_SIZE, verified=None, key=None):
+    """Download a file of `dataset` (an item of a version's file listing) to `path`.
+    Return 'present' if it was there already, 'downloaded' or 'resumed'. `verified` is an
+    optional IdMap of verified files, in which the file has `key` (default: `path`).
+    Raise DataverseError if the checksum does not match, or the download keeps failing."""
+    data_file, key = file_meta['dataFile'], key or path
+    size, checksum = file_size(file_meta), file_checksum(file_meta)
+    if exists(path):
+        if _verified(path, checksum, verified, key):
+            return 'present'
+        if checksum is not None and (size is None or getsize(path) == size) and \
+           hash_file(path, checksum[0], chunk_size).hexdigest() == checksum[1]:
+            _record(path, checksum, verified, key)
+            return 'present'
+    os.makedirs(dirname(path) or '.', exist_ok=True)
+    partial = path + PARTIAL_SUFFIX
+    offset = getsize(partial) if exists(partial) else 0
+    if size is not None and offset > size:
+        offset = 0
+    digest = hashlib.new(checksum[0]) if checksum else None
+    if offset and digest is not None:  # the checksum covers the part that is there already
+        with open(partial, 'rb') as f:
+            for chunk in iter(lambda: f.read(min(chunk_size, offset - f.tell())), b''):
+                digest.update(chunk)
+    status = 'resumed' if offset else 'downloaded'
+    complete = False
+    for attempt in range(DOWNLOAD_ATTEMPTS):
+        if size is not None and offset >= size:
+            complete = True
+            break
+        response = dataset.get_datafile(data_file['id'], offset=offset, original=is_original(file_meta),
+                                        stream=True)
+        try:
+            if response.status_code == 200 and offset:  # the server ignored the Range header
+                offset = 0
+                digest = hashlib.new(checksum[0]) if checksum else None
+            with open(partial, 'r+b' if offset else 'wb') as f:
+                f.seek(offset)
+                f.truncate()
+                for chunk in response.iter_content(chunk_size):
+                    f.write(chunk)
+                    offset += len(chunk)
+                    if digest is not None:
+                        digest.update(chunk)
+            complete = size is None or offset >= size
+        except (ChunkedEncodingError, ConnectionError, Timeout):
+            pass  # the next attempt continues from offset
+        finally:
+            response.close()
+        if complete:
+            break
+    if not complete:
+        raise DataverseError('Download of file {0} stopped at byte {1} of {2} after {3} attempts'.\
+                             format(data_file['id'], offset, size, DOWNLOAD_ATTEMPTS))
+    if digest is not None and digest.hexdigest() != checksum[1]:
+        os.remove(partial)
+        raise DataverseError('Checksum of file {0} ({1}) does not match: {2} instead of {3}'.\
+                             format(data_file['id'], path, digest.hexdigest(), checksum[1]))
+    os.replace(partial, path)
+    _record(path, checksum, verified, key)
+    return status
+
+def mirror(datasets, target, jobs=DEFAULT_JOBS, version=':latest', chunk_size=DEFAULT_CHUNK_SIZE):
+    """Download the files of a version of every dataset in `datasets`, a list of (folder,
+    Dataset), to `target`/folder, with at most `jobs` requests in flight. Generate
+    (path relative to `target`, size, status or None, error message or None) as the files
+    finish; status is 'present', 'downloaded' or 'resumed'."""
+    os.makedirs(target, exist_ok=True)
+    with IdMap(join(target, VERIFIED_LOG)) as verified, \
+         ThreadPoolExecutor(max_workers=max(jobs, 1)) as executor:
+        def download(key, dataset, file_meta):
+            try:
+                return key, file_size(file_meta), \
+                       download_file(dataset, file_meta, join(target, key), chunk_size, verified, key), None
+            except (DataverseError, OSError) as e:
+                return key, file_size(file_meta), None, str(e)
+        listings = {executor.submit(dataset.version_files, version): (folder, dataset)
+                    for folder, dataset in datasets}
+        downloads = []
+        for future in as_completed(listings):
+            folder, dataset = listings[future]
+            try:
+                files = future.result()
+            except DataverseError as e:
+                yield folder, None, None, str(e)
+                continue
+            for file_meta in files:
+                try:
+                    key = join(folder, relative_path(file_meta))
+                except DataverseError as e:
+                    yield folder, None, None, str(e)
+                    continue
+                downloads.append(executor.submit(download, key, dataset, file_meta))
+        for future in as_completed(downloads):
+            yield future.result()
@@ -0,0 +1,403 @@
+"""Local cache of dataset version summaries, and a local inventory of a dataverse tree.
+A full `/versions` payload contains the metadata blocks and file lists of every version
+of a dataset, but a storage or status report needs only a small summary of it. The
+summary is kept in an SQLite database, with the stamp of the latest version
+(lastUpdateTime and versionState). A dataset whose stamp has not changed since the
+previous run is reported from the cache, without downloading its versions again.
+
+Inventory goes further: it keeps the dataverses, datasets, versions, files, groups and
+role assignments of a tree in indexed SQLite tables, so that listings, filters and
+storage rollups are answered locally. Its sync uses the same stamps to refresh only the
+datasets that changed, and removes what is no longer on the server.
+"""
+
+import json, os, sqlite3, time
+from concurrent.futures import ThreadPoolExecutor
+from os.path import dirname, expanduser
+from threading import Lock
+from .common import DataverseError
+from .crawl import DEFAULT_JOBS, Crawler
+
+DEFAULT_CACHE = '~/.cache/dataverse/versions.sqlite'
+DEFAULT_INVENTORY = '~/.cache/dataverse/inventory.sqlite'
+COMMIT_INTERVAL = 100  # summaries per transaction; after a crash the rest is fetched again
+
+def version_key(ds_version):
+    """sort key of a dataset version: (major, minor), (0, 0) for a draft"""
+    try:
+        return ds_version['versionNumber'], ds_version['versionMinorNumber']
+    except KeyError:
+        return 0, 0
+
+def latest_version(ds_versions):
+    """return the dataset version with the highest version number"""
+    return max(ds_versions, key=version_key)
+
+def current_version(ds_versions):
+    """return the version that `/versions/:latest` returns: the draft if there is one,
+    otherwise the version with the highest version number"""
+    return next((elt for elt in ds_versions if elt.get('versionState') == 'DRAFT'), None) or \
+           latest_version(ds_versions)
+
+def version_stamp(ds_version):
+    """return a string that changes whenever a new version is made or the latest one is
+    updated or published"""
+    return f"{ds_version.get('lastUpdateTime')}|{ds_version.get('versionState')}"
+
+def summarize(ds_versions):
+    """return a summary of the versions of a dataset: a dict with the stamp of the current
+    version (a draft, if there is one, as `/versions/:latest` with which it is compared),
+    the persistent id and last update time of the latest version, the states of all
+    versions, the authors and a list of [label, size, content type] of the files in the
+    latest version"""
+    latest = latest_version(ds_versions)
+    fields = latest.get('metadataBlocks', {}).get('citation', {}).get('fields', [])
+    authors = next((elt['value'] for elt in fields if elt['typeName'] == 'author'), [])
+    return {
+        'stamp': version_stamp(current_version(ds_versions)),
+        'persistentId': latest.get('datasetPersistentId'),
+        'lastUpdateTime': latest.get('lastUpdateTime'),
+        'states': [elt['versionState'] for elt in ds_versions],
+        'authors': [elt['authorName']['value'] for elt in authors],
+        'files': [[elt['label'], elt['dataFile']['filesize'], elt['dataFile']['contentType']]
+                  for elt in latest.get('files', [])]
+    }
+
+class VersionCache:
+    """Summaries of dataset versions, per server and dataset id
+       Instance variables:
+           - path: path of the SQLite database
+           - server: base URL of the Dataverse server
+           - hits, misses: number of summaries that were and were not up to date
+    """
+    def __init__(self, path, server):
+        self.path = expanduser(path)
+        self.server = server
+        self.hits, self.misses = 0, 0
+        if dirname(self.path):
+            os.makedirs(dirname(self.path), exist_ok=True)
+        self.lock = Lock()
+        self.pending = 0
+        self.db = sqlite3.connect(self.path, check_same_thread=False)
+        self.db.execute('CREATE TABLE IF NOT EXISTS versions (server TEXT, dataset INTEGER, '
+                        'stamp TEXT, summary TEXT, PRIMARY KEY (server, dataset))')
+        self.db.commit()
+
+    def get(self, dataset_id, stamp=None):
+        """return the cached summary of a dataset, or None; with `stamp`, only if the
+        cached summary has that stamp"""
+        with self.lock:
+            row = self.db.execute('SELECT stamp, summary FROM versions WHERE server = ? AND dataset = ?',
+                                  (self.server, dataset_id)).fetchone()
+            if row is None or (stamp is not None and row[0] != stamp):
+                self.misses += 1
+                return None
+            self.hits += 1
+        return json.loads(row[1])
+
+    def put(self, dataset_id, summary):
+        with self.lock:
+            self.db.execute('INSERT OR REPLACE INTO versions VALUES (?, ?, ?, ?)',
+                            (self.server, dataset_id, summary['stamp'],
+                             json.dumps(summary, separators=(',', ':'))))
+            self.pending += 1
+            if self.pending >= COMMIT_INTERVAL:
+                self.db.commit()
+                self.pending = 0
+
+    def summary(self, api, dataset_id, incremental=True):
+        """return the summary of a dataset. If `incremental`, only the latest version
+        without its files is requested when the cached summary is still up to date.
+        Raise DataverseError if the versions cannot be retrieved."""
+        if incremental:
+            latest = api.dataset_version(dataset_id, exclude_files=True)
+            if isinstance(latest, dict) and 'versionState' in latest:
+                cached = self.get(dataset_id, version_stamp(latest))
+                if cached is not None:
+                    return cached
+        ds_versions = api.dataset_versions(dataset_id)
+        if not isinstance(ds_versions, list) or len(ds_versions) == 0:
+            raise DataverseError(f"versions of dataset {dataset_id} could not be retrieved: {ds_versions}")
+        summary = summarize(ds_versions)
+        self.put(dataset_id, summary)
+        return summary
+
+    def close(self):
+        with self.lock:
+            self.db.commit()
+            self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS dataverses (server TEXT, id INTEGER, alias TEXT, name TEXT, parent INTEGER,
+    type TEXT, released INTEGER, generation INTEGER, PRIMARY KEY (server, id));
+CREATE INDEX IF NOT EXISTS dataverses_alias ON dataverses (server, alias);
+CREATE INDEX IF NOT EXISTS dataverses_parent ON dataverses (server, parent);
+CREATE TABLE IF NOT EXISTS datasets (server TEXT, id INTEGER, pid TEXT, dataverse TEXT, title TEXT,
+    state TEXT, states TEXT, last_update TEXT, stamp TEXT, authors TEXT, files INTEGER, size INTEGER,
+    generation INTEGER, PRIMARY KEY (server, id));
+CREATE INDEX IF NOT EXISTS datasets_dataverse ON datasets (server, dataverse);
+CREATE INDEX IF NOT EXISTS datasets_state ON datasets (server, state);
+CREATE INDEX IF NOT EXISTS datasets_size ON datasets (server, size);
+CREATE TABLE IF NOT EXISTS dataset_versions (server TEXT, dataset INTEGER, version TEXT, state TEXT,
+    last_update TEXT, files INTEGER, size INTEGER, PRIMARY KEY (server, dataset, version));
+CREATE TABLE IF NOT EXISTS files (server TEXT, id INTEGER, dataset INTEGER, label TEXT, directory TEXT,
+    size INTEGER, content_type TEXT, md5 TEXT, restricted INTEGER, PRIMARY KEY (server, id));
+CREATE INDEX IF NOT EXISTS files_dataset ON files (server, dataset);
+CREATE TABLE IF NOT EXISTS groups (server TEXT, dataverse INTEGER, identifier TEXT, alias TEXT, name TEXT,
+    PRIMARY KEY (server, dataverse, identifier));
+CREATE TABLE IF NOT EXISTS assignments (server TEXT, dataverse INTEGER, id INTEGER, assignee TEXT, role TEXT,
+    PRIMARY KEY (server, id));
+CREATE TABLE IF NOT EXISTS syncs (server TEXT PRIMARY KEY, root TEXT, generation INTEGER, finished TEXT);
+"""
+
+# the datasets below a dataverse, at any depth: ?1 = server, ?2 = dataverse id
+SUBTREE = """
+WITH RECURSIVE tree(id, alias) AS (
+    SELECT id, alias FROM dataverses WHERE server = ?1 AND id = ?2
+    UNION ALL
+    SELECT dataverses.id, dataverses.alias FROM dataverses JOIN tree ON dataverses.parent = tree.id
+    WHERE dataverses.server = ?1)
+"""
+
+def version_label(ds_version):
+    major, minor = version_key(ds_version)
+    return 'DRAFT' if ds_version.get('versionState') == 'DRAFT' else f"{major}.{minor}"
+
+class Inventory:
+    """Local copy of the dataverses, datasets, versions, files, groups and role assignments
+    of a server, in an SQLite database with one set of tables for all servers
+       Instance variables:
+           - path: path of the SQLite database
+           - server: base URL of the Dataverse server
+    """
+    def __init__(self, path, server):
+        self.path = expanduser(path)
+        self.server = server
+        if dirname(self.path):
+            os.makedirs(dirname(self.path), exist_ok=True)
+        self.lock = Lock()
+        self.pending = 0
+        self.db = sqlite3.connect(self.path, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        self.db.executescript(SCHEMA)
+        self.db.commit()
+
+    def close(self):
+        with self.lock:
+            self.db.commit()
+            self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _write(self, statements):
+        """execute a list of (sql, parameters) in the transaction of the sync"""
+        with self.lock:
+            for sql, parameters in statements:
+                self.db.execute(sql, parameters)
+            self.pending += 1
+            if self.pending >= COMMIT_INTERVAL:
+                self.db.commit()
+                self.pending = 0
+
+    def _query(self, sql, parameters=()):
+        with self.lock:
+            return [dict(row) for row in self.db.execute(sql, parameters)]
+
+    # synchronization
+
+    def sync(self, api, root, jobs=DEFAULT_JOBS, incremental=True):
+        """Bring the inventory of the tree below the dataverse with alias `root` up to date.
+        If `incremental`, the versions and files of a dataset are only downloaded when the
+        stamp of its latest version has changed. Dataverses and datasets that were not
+        found are removed, unless a request failed. Return a dict with counts."""
+        start = time.monotonic()
+        generation = (self._query('SELECT generation FROM syncs WHERE server = ?', (self.server,)) or
+                      [{'generation': 0}])[0]['generation'] + 1
+        stamps = {row['id']: row['stamp'] for row in
+                  self._query('SELECT id, stamp FROM datasets WHERE server = ?', (self.server,))}
+        counts = {'dataverses': 0, 'datasets': 0, 'updated': 0, 'unchanged': 0, 'errors': 0, 'removed': 0}
+        # the crawler gives the id instead of the alias of a dataverse whose view failed
+        aliases = {row['id']: row['alias'] for row in
+                   self._query('SELECT id, alias FROM dataverses WHERE server = ?', (self.server,))}
+        def sync_dataset(alias, item):
+            return self._sync_dataset(api, aliases.get(alias, alias), item['id'],
+                                      stamps.get(item['id']) if incremental else None, generation)
+        crawler = Crawler(api, jobs=jobs)
+        for result in crawler.map_datasets(root, sync_dataset):
+            counts['datasets'] += 1
+            counts[result] += 1
+        views = dict(crawler.views, **{root: api.dataverse_view(root)})
+        views = [view for view in views.values() if isinstance(view, dict) and 'id' in view]
+        # a dataverse whose view or contents failed would be purged with all its datasets
+        counts['errors'] += crawler.errors + int(not any(view.get('alias') == root for view in views))
+        counts['dataverses'] = len(views)
+        for view in views:
+            self._write([('INSERT OR REPLACE INTO dataverses VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                          (self.server, view['id'], view.get('alias'), view.get('name'),
+                           view.get('ownerId') if view.get('alias') != root else None,
+                           view.get('dataverseType'), int(bool(view.get('isReleased', True))), generation))])
+        with ThreadPoolExecutor(max_workers=max(jobs, 1)) as executor:
+            counts['errors'] += sum(executor.map(lambda view: self._sync_permissions(api, view['id']), views))
+        with self.lock:
+            if counts['errors'] == 0:  # a failed request could hide objects that still exist
+                for table in ('dataverses', 'datasets'):
+                    counts['removed'] += self.db.execute(f'DELETE FROM {table} WHERE server = ? AND generation < ?',
+                                                         (self.server, generation)).rowcount
+                for table, column in (('dataset_versions', 'dataset'), ('files', 'dataset')):
+                    self.db.execute(f'DELETE FROM {table} WHERE server = ? AND {column} NOT IN '
+                                    '(SELECT id FROM datasets WHERE server = ?)', (self.server, self.server))
+                for table in ('groups', 'assignments'):
+                    self.db.execute(f'DELETE FROM {table} WHERE server = ? AND dataverse NOT IN '
+                                    '(SELECT id FROM dataverses WHERE server = ?)', (self.server, self.server))
+            self.db.execute('INSERT OR REPLACE INTO syncs VALUES (?, ?, ?, ?)',
+                            (self.server, root, generation, time.strftime('%Y-%m-%d %H:%M:%S')))
+            self.db.commit()
+            self.pending = 0
+        counts['seconds'] = round(time.monotonic() - start, 1)
+        return counts
+
+    def _sync_dataset(self, api, alias, dataset_id, stamp, generation):
+        """refresh one dataset; return 'updated', 'unchanged' or 'errors'"""
+        keep = ('UPDATE datasets SET generation = ? WHERE server = ? AND id = ?', (generation, self.server, dataset_id))
+        if stamp is not None:
+            latest = api.dataset_version(dataset_id, exclude_files=True)
+            if isinstance(latest, dict) and version_stamp(latest) == stamp:
+                self._write([keep])
+                return 'unchanged'
+        ds_versions = api.dataset_versions(dataset_id)
+        if not isinstance(ds_versions, list) or len(ds_versions) == 0:
+            self._write([keep])
+            return 'errors'
+        summary = summarize(ds_versions)
+        latest = current_version(ds_versions)  # the version that the stamp is compared with
+        fields = latest.get('metadataBlocks', {}).get('citation', {}).get('fields', [])
+        title = next((elt['value'] for elt in fields if elt['typeName'] == 'title'), None)
+        files = latest.get('files', [])
+        statements = [
+            ('DELETE FROM dataset_versions WHERE server = ? AND dataset = ?', (self.server, dataset_id)),
+            ('DELETE FROM files WHERE server = ? AND dataset = ?', (self.server, dataset_id)),
+            ('INSERT OR REPLACE INTO datasets VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+             (self.server, dataset_id, summary['persistentId'], alias, title, latest.get('versionState'),
+              ' | '.join(summary['states']), latest.get('lastUpdateTime'), summary['stamp'],
+              ' | '.join(summary['authors']), len(files), sum(elt['dataFile'].get('filesize', 0) for elt in files),
+              generation))]
+        for ds_version in ds_versions:
+            version_files = ds_version.get('files', [])
+            statements.append(('INSERT OR REPLACE INTO dataset_versions VALUES (?, ?, ?, ?, ?, ?, ?)',
+                               (self.server, dataset_id, version_label(ds_version), ds_version.get('versionState'),
+                                ds_version.get('lastUpdateTime'), len(version_files),
+                                sum(elt['dataFile'].get('filesize', 0) for elt in version_files))))
+        for elt in files:
+            data_file = elt['dataFile']
+            statements.append(('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                               (self.server, data_file['id'], dataset_id, elt.get('label'),
+                                elt.get('directoryLabel', ''), data_file.get('filesize', 0),
+                                data_file.get('contentType'), data_file.get('md5'),
+                                int(bool(elt.get('restricted'))))))
+        self._write(statements)
+        return 'updated'
+
+    def _sync_permissions(self, api, dataverse_id):
+        """refresh the groups and role assignments of a dataverse; return the number of
+        failed requests"""
+        groups, roles = api.dataverse_groups(dataverse_id), api.dataverse_roles(dataverse_id)
+        statements = []
+        if isinstance(groups, list):
+            statements.append(('DELETE FROM groups WHERE server = ? AND dataverse = ?', (self.server, dataverse_id)))
+            statements += [('INSERT OR REPLACE INTO groups VALUES (?, ?, ?, ?, ?)',
+                            (self.server, dataverse_id, group['identifier'], group.get('groupAliasInOwner'),
+                             group.get('displayName'))) for group in groups]
+        if isinstance(roles, list):
+            statements.append(('DELETE FROM assignments WHERE server = ? AND dataverse = ?',
+                               (self.server, dataverse_id)))
+            statements += [('INSERT OR REPLACE INTO assignments VALUES (?, ?, ?, ?, ?)',
+                            (self.server, dataverse_id, role['id'], role.get('assignee'), role.get('_roleAlias')))
+                           for role in roles]
+        self._write(statements)
+        return int(not isinstance(groups, list)) + int(not isinstance(roles, list))
+
+    # queries
+
+    def last_sync(self):
+        """return the root, generation and time of the last sync, or None"""
+        rows = self._query('SELECT root, generation, finished FROM syncs WHERE server = ?', (self.server,))
+        return rows[0] if rows else None
+
+    def resolve(self, dataverse):
+        """return the id of the dataverse with id or alias `dataverse`, or None"""
+        rows = self._query('SELECT id FROM dataverses WHERE server = ? AND (alias = ? OR id = ?)',
+                           (self.server, str(dataverse), str(dataverse)))
+        return rows[0]['id'] if rows else None
+
+    def dataverse(self, dataverse_id):
+        rows = self._query('SELECT id, alias, name, parent, type, released FROM dataverses '
+                           'WHERE server = ? AND id = ?', (self.server, dataverse_id))
+        return rows[0] if rows else None
+
+    def children(self, dataverse_id):
+        """return (child dataverses, datasets) of a dataverse"""
+        dataverses = self._query('SELECT id, alias, name, type FROM dataverses WHERE server = ? AND parent = ? '
+                                 'ORDER BY alias', (self.server, dataverse_id))
+        datasets = self._query('SELECT datasets.id, pid, title, state, files, size FROM datasets '
+                               'JOIN dataverses ON dataverses.server = datasets.server AND dataverses.alias = datasets.dataverse '
+                               'WHERE datasets.server = ? AND dataverses.id = ? ORDER BY datasets.id',
+                               (self.server, dataverse_id))
+        return dataverses, datasets
+
+    def groups(self, dataverse_id):
+        return self._query('SELECT identifier, alias, name FROM groups WHERE server = ? AND dataverse = ? '
+                           'ORDER BY alias', (self.server, dataverse_id))
+
+    def assignments(self, dataverse_id):
+        return self._query('SELECT id, assignee, role FROM assignments WHERE server = ? AND dataverse = ? '
+                           'ORDER BY assignee', (self.server, dataverse_id))
+
+    def versions(self, dataset_id):
+        return self._query('SELECT version, state, last_update, files, size FROM dataset_versions '
+                           'WHERE server = ? AND dataset = ? ORDER BY last_update DESC', (self.server, dataset_id))
+
+    def files(self, dataset_id):
+        return self._query('SELECT id, directory, label, size, content_type, md5, restricted FROM files '
+                           'WHERE server = ? AND dataset = ? ORDER BY directory, label', (self.server, dataset_id))
+
+    def datasets(self, dataverse_id, state=None, min_size=None):
+        """return the datasets below a dataverse, at any depth, largest first; optionally
+        only those whose latest version has `state` or that have at least `min_size` bytes"""
+        sql = SUBTREE + ('SELECT datasets.dataverse, datasets.id, pid, title, state, last_update, files, size '
+                         'FROM datasets JOIN tree ON datasets.dataverse = tree.alias WHERE datasets.server = ?1')
+        parameters = [self.server, dataverse_id]
+        if state is not None:
+            sql += ' AND state = ?3'
+            parameters.append(state.upper())
+        if min_size is not None:
+            sql += f' AND size >= ?{len(parameters) + 1}'
+            parameters.append(min_size)
+        return self._query(sql + ' ORDER BY size DESC', parameters)
+
+    def rollup(self, dataverse_id):
+        """return the storage per child of a dataverse, each with its whole subtree, plus a
+        row for the datasets in the dataverse itself: alias, datasets, files and bytes"""
+        sql = """
+            WITH RECURSIVE tree(id, alias, branch) AS (
+                SELECT id, alias, id FROM dataverses WHERE server = ?1 AND parent = ?2
+                UNION ALL
+                SELECT id, alias, ?2 FROM dataverses WHERE server = ?1 AND id = ?2
+                UNION ALL
+                SELECT dataverses.id, dataverses.alias, tree.branch FROM dataverses JOIN tree
+                ON dataverses.parent = tree.id AND tree.id != ?2 WHERE dataverses.server = ?1)
+            SELECT branches.alias AS dataverse, COUNT(datasets.id) AS datasets,
+                   COALESCE(SUM(datasets.files), 0) AS files, COALESCE(SUM(datasets.size), 0) AS size
+            FROM tree JOIN dataverses AS branches ON branches.server = ?1 AND branches.id = tree.branch
+            LEFT JOIN datasets ON datasets.server = ?1 AND datasets.dataverse = tree.alias
+            GROUP BY tree.branch ORDER BY size DESC"""
+        return self._query(sql, (self.server, dataverse_id))
@@ -0,0 +1,102 @@
+"""Checkpoint journal of an upload.
+The journal is an append-only JSONL file with one record per line: a 'dataset'
+record with the id of the dataset that receives the files, and a 'file' record
+for every upload attempt, with the METS file id, size, modification time and MD5
+of the local file and the upload status. The last record of a file wins, and a
+partial last line (e.g. after a crash) is ignored, so an interrupted upload can
+be resumed by uploading only the files without an 'OK' record.
+"""
+
+import json, os
+from datetime import datetime
+from threading import Lock
+from .checksum import file_md5
+
+class Journal:
+    """Append-only upload journal
+       Instance variables:
+           - path: path of the JSONL file
+           - dataset: the last 'dataset' record, or None
+           - files: dict {METS file id: last 'file' record}
+    """
+    def __init__(self, path):
+        self.path = path
+        self.dataset = None
+        self.files = {}
+        self.lock = Lock()
+        partial = False
+        if os.path.exists(path):
+            partial = self._load()
+        self.file = open(path, 'a', encoding='utf-8')
+        if partial:  # terminate the partial line, so that the next record is readable
+            self.file.write('\n')
+
+    def _load(self):
+        """read the records; return True if the file ends with a partial line"""
+        line = '\n'
+        with open(self.path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # partially written line
+                if record.get('event') == 'dataset':
+                    self.dataset = record
+                elif record.get('event') == 'file':
+                    self.files[record['fid']] = record
+        return not line.endswith('\n')
+
+    def _append(self, record):
+        record['time'] = datetime.now().isoformat(timespec='seconds')
+        with self.lock:
+            self.file.write(json.dumps(record) + '\n')
+            self.file.flush()
+            os.fsync(self.file.fileno())
+
+    def record_dataset(self, dataset_id, base_url):
+        self.dataset = {'event': 'dataset', 'dataset_id': dataset_id, 'url': base_url}
+        self._append(dict(self.dataset))
+
+    def record_file(self, fid, path, status, md5=None, message=''):
+        """Record the result of the upload of the local file `path` with METS id `fid`; a
+        failure is also recorded if the file cannot be read (size and mtime are None)"""
+        try:
+            stat = os.stat(path)
+        except OSError:
+            if status == 'OK':
+                raise
+            stat = None
+        if md5 is None and status == 'OK':
+            md5 = file_md5(path)
+        record = {'event': 'file', 'fid': fid, 'path': path, 'size': stat.st_size if stat else None,
+                  'mtime': stat.st_mtime if stat else None, 'md5': md5, 'status': status}
+        if message:
+            record['message'] = message
+        self.files[fid] = record
+        self._append(dict(record))
+
+    def uploaded(self, fid, path):
+        """Return True if the journal shows that `path` was uploaded, and the file
+        did not change since: same size and modification time, or else the same MD5.
+        A file that was moved or deleted (or cannot be read) counts as not uploaded."""
+        record = self.files.get(fid)
+        if not record or record['status'] != 'OK':
+            return False
+        try:
+            stat = os.stat(path)
+            if stat.st_size != record['size']:
+                return False
+            if stat.st_mtime == record['mtime']:
+                return True
+            return file_md5(path) == record['md5']
+        except OSError:
+            return False
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,254 @@
+"""Instrumentation of HTTP requests.
+Connection, Api and AsyncApi time every request with a RequestTimer, which passes a
+RequestRecord to the hooks that are installed with add_hook. Without hooks, a timer
+costs a few attribute assignments.
+Metrics is a hook that aggregates the records per method and endpoint template (e.g.
+'GET /api/dataverses/{id}/contents') into latency histograms, byte counts and
+retry counts, logs slow requests, and exports a JSON summary or a Prometheus textfile
+(for the textfile collector of node_exporter).
+"""
+
+import json, os, re, sys, time
+from collections import namedtuple
+from threading import Lock
+
+"""A request:
+    - method: HTTP method
+    - endpoint: endpoint template, e.g. '/api/datasets/{id}/versions'
+    - status: HTTP status code of the last response, or None if there was no response
+    - bytes_out: size of the request body
+    - bytes_in: size of the response body
+    - seconds: latency, including waiting for the rate limiter and retries
+    - retries: number of retries
+"""
+RequestRecord = namedtuple('RequestRecord',
+                           ['method', 'endpoint', 'status', 'bytes_out', 'bytes_in', 'seconds', 'retries'])
+
+# upper bounds in seconds of the histogram buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, float('inf'))
+
+_hooks = []
+
+def add_hook(hook):
+    """Call hook(record) with a RequestRecord after every request"""
+    _hooks.append(hook)
+
+def remove_hook(hook):
+    _hooks.remove(hook)
+
+# path segments after which comes an identifier; a fixed endpoint in that place is kept
+IDENTIFIED = ('dataverses', 'datasets', 'datafile', 'files', 'versions', 'assignments')
+FIXED = ('mpupload',)
+IDENTIFIER = re.compile(r'\d+|\{\w*\}')
+
+def endpoint_template(endpoint):
+    """Return the template of an endpoint, the same for the URL of a Connection request and
+    the format string of an Api request: the '{url}' prefix or base URL, the API version,
+    the query string and a final '/' are removed, and every identifier (a number, alias,
+    ':persistentId', version or a placeholder such as '{dvid}') becomes '{id}'"""
+    path = endpoint.replace('{url}', '').split('?')[0]
+    path = re.sub(r'^[a-z]+://[^/]+', '', path)
+    path = re.sub(r'^/api/v\d+(?=/|$)', '/api', path).rstrip('/') or '/'
+    segments = path.split('/')
+    for k in range(1, len(segments)):
+        segment = segments[k]
+        if IDENTIFIER.fullmatch(segment) or \
+           segments[k - 1] in IDENTIFIED and segment and segment not in FIXED:
+            segments[k] = '{id}'
+    return '/'.join(segments)
+
+def _size(body):
+    try:
+        return len(body) if body is not None else 0
+    except TypeError:  # e.g. a generator
+        return 0
+
+class RequestTimer:
+    """Context manager that times one request and passes its record to the hooks.
+    The send callable that is given to the scheduler should be wrapped with wrap() (or
+    wrap_async()), so that retries are counted; set `response` before the end. The body of a
+    `stream` response is not read: its size is taken from the Content-Length header."""
+    def __init__(self, method, endpoint, body=None, stream=False):
+        self.method = method
+        self.endpoint = endpoint
+        self.body = body
+        self.stream = stream
+        self.attempts = 0
+        self.response = None
+
+    def wrap(self, send):
+        def counted():
+            self.attempts += 1
+            return send()
+        return counted
+
+    def wrap_async(self, send):
+        async def counted():
+            self.attempts += 1
+            return await send()
+        return counted
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        if not _hooks:
+            return
+        response = self.response
+        if response is None:
+            bytes_in = 0
+        elif self.stream:
+            bytes_in = int(response.headers.get('Content-Length') or 0)
+        else:
+            bytes_in = _size(response.content)
+        record = RequestRecord(self.method, endpoint_template(self.endpoint),
+                               response.status_code if response is not None else None,
+                               _size(self.body), bytes_in,
+                               time.perf_counter() - self.start, max(self.attempts - 1, 0))
+        for hook in list(_hooks):
+            hook(record)
+
+def _label(bound):
+    return '+Inf' if bound == float('inf') else repr(bound)
+
+class Histogram:
+    """Latency histogram and totals of the requests to one endpoint"""
+    def __init__(self):
+        self.buckets = [0] * len(BUCKETS)
+        self.count = 0
+        self.seconds = 0.0
+        self.bytes_out = 0
+        self.bytes_in = 0
+        self.retries = 0
+        self.statuses = {}
+
+    def add(self, record):
+        for k, bound in enumerate(BUCKETS):
+            if record.seconds <= bound:
+                self.buckets[k] += 1
+                break
+        self.count += 1
+        self.seconds += record.seconds
+        self.bytes_out += record.bytes_out
+        self.bytes_in += record.bytes_in
+        self.retries += record.retries
+        status = str(record.status) if record.status is not None else 'error'
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+
+    def quantile(self, q):
+        """upper bound of the bucket that contains quantile q"""
+        rank, seen = q * self.count, 0
+        for bound, count in zip(BUCKETS, self.buckets):
+            seen += count
+            if seen >= rank and count:
+                return bound
+        return None
+
+    def summary(self):
+        return {'count': self.count, 'seconds': round(self.seconds, 6),
+                'mean': round(self.seconds / self.count, 6) if self.count else None,
+                'p50': self.quantile(0.5), 'p99': self.quantile(0.99),
+                'bytes_out': self.bytes_out, 'bytes_in': self.bytes_in,
+                'retries': self.retries, 'statuses': dict(self.statuses),
+                'buckets': {_label(bound): count for bound, count in zip(BUCKETS, self.buckets)}}
+
+class Metrics:
+    """Hook that aggregates request records
+       Instance variables:
+           - histograms: dict {(method, endpoint template): Histogram}
+           - slow_threshold: requests that take longer (seconds) are logged, None: no log
+           - slow_log: file to which slow requests are written (default stderr)
+    """
+    def __init__(self, slow_threshold=None, slow_log=None):
+        self.histograms = {}
+        self.slow_threshold = slow_threshold
+        self.slow_log = slow_log
+        self.lock = Lock()
+
+    def __call__(self, record):
+        with self.lock:
+            key = (record.method, record.endpoint)
+            if key not in self.histograms:
+                self.histograms[key] = Histogram()
+            self.histograms[key].add(record)
+        if self.slow_threshold is not None and record.seconds > self.slow_threshold:
+            print(f"slow request: {record.method} {record.endpoint} -> {record.status} in "
+                  f"{record.seconds:.3f} s ({record.retries} retries, {record.bytes_out} bytes out, "
+                  f"{record.bytes_in} bytes in)", file=self.slow_log or sys.stderr, flush=True)
+
+    def close(self):
+        """Close the slow log; slow requests after this are logged to stderr"""
+        slow_log, self.slow_log = self.slow_log, None
+        if slow_log is not None:
+            slow_log.close()
+
+    def summary(self):
+        """Return a dict {'METHOD endpoint': summary of its histogram}"""
+        with self.lock:
+            return {f"{method} {endpoint}": histogram.summary()
+                    for (method, endpoint), histogram in sorted(self.histograms.items())}
+
+    def write_json(self, path):
+        _write_atomic(path, json.dumps(self.summary(), indent=2))
+
+    def prometheus(self):
+        """Return the metrics in the Prometheus text format"""
+        lines = ['# HELP dave_request_duration_seconds Latency of Dataverse API requests, including retries.',
+                 '# TYPE dave_request_duration_seconds histogram']
+        totals = []
+        with self.lock:
+            for (method, endpoint), histogram in sorted(self.histograms.items()):
+                labels = f'method="{method}",endpoint="{endpoint}"'
+                cumulative = 0
+                for bound, count in zip(BUCKETS, histogram.buckets):
+                    cumulative += count
+                    lines.append(f'dave_request_duration_seconds_bucket{{{labels},le="{_label(bound)}"}} {cumulative}')
+                lines.append(f'dave_request_duration_seconds_sum{{{labels}}} {histogram.seconds}')
+                lines.append(f'dave_request_duration_seconds_count{{{labels}}} {histogram.count}')
+                totals.append((labels, histogram))
+        for name, help_text, attribute in (
+                ('dave_request_bytes_sent_total', 'Bytes in request bodies.', 'bytes_out'),
+                ('dave_response_bytes_received_total', 'Bytes in response bodies.', 'bytes_in'),
+                ('dave_request_retries_total', 'Retries of requests.', 'retries')):
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+            lines += [f'{name}{{{labels}}} {getattr(histogram, attribute)}' for labels, histogram in totals]
+        lines += ['# HELP dave_requests_total Requests by response status.', '# TYPE dave_requests_total counter']
+        for labels, histogram in totals:
+            lines += [f'dave_requests_total{{{labels},status="{status}"}} {count}'
+                      for status, count in sorted(histogram.statuses.items())]
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path):
+        _write_atomic(path, self.prometheus())
+
+def _write_atomic(path, text):
+    """write via a temporary file, so that a reader (e.g. node_exporter) never sees half a file"""
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, 'w') as f:
+        f.write(text)
+    os.replace(temporary, path)
+
+def add_metrics_arguments(parser):
+    """Add the command line options for metrics to an argparse parser"""
+    parser.add_argument('--metrics-json', metavar='FILE', help='write a JSON summary of all requests at exit')
+    parser.add_argument('--metrics-prom', metavar='FILE', help='write request metrics as a Prometheus textfile at exit')
+    parser.add_argument('--slow-threshold', type=float, metavar='SECONDS',
+                        help='log requests that take longer than this')
+    parser.add_argument('--slow-log', metavar='FILE', help='log slow requests to this file instead of stderr')
+
+def apply_metrics_arguments(args, register=None):
+    """Install a Metrics hook if any of the options of add_metrics_arguments is used, and
+    register the export at exit with `register` (e.g. atexit.register); return the hook"""
+    if not (args.metrics_json or args.metrics_prom or args.slow_threshold is not None):
+        return None
+    slow_log = open(args.slow_log, 'a') if args.slow_log else None
+    metrics = Metrics(slow_threshold=args.slow_threshold, slow_log=slow_log)
+    add_hook(metrics)
+    if register is not None:
+        register(metrics.close)  # registered first, so it runs after the exports
+        if args.metrics_json:
+            register(metrics.write_json, args.metrics_json)
+        if args.metrics_prom:
+            register(metrics.write_prometheus, args.metrics_prom)
+    return metrics
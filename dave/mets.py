@@ -0,0 +1,145 @@
+"""Streaming reader for Archivematica METS files.
+The METS file of a large DIP can be hundreds of MB. MetsReader parses it once with
+iterparse: amdSec elements (which precede the fileSec) are reduced to their rights
+and fixity information in a dict indexed by ID, and every mets:file of the 'original'
+fileGrp is yielded as a MetsFile record as soon as it has been parsed. Elements are
+removed from the tree when they have been processed, so memory use does not grow
+with the size of the METS file.
+"""
+
+from collections import namedtuple
+from xml.etree.ElementTree import iterparse
+
+namespaces = {
+    'xlink':   'http://www.w3.org/1999/xlink',
+    'mets':    'http://www.loc.gov/METS/',
+    'premis':  'http://www.loc.gov/premis/v3',
+    'dc':      'http://purl.org/dc/elements/1.1/',
+    'dcterms': 'http://purl.org/dc/terms/'
+}
+
+def _tag(prefix, name):
+    return '{{{0}}}{1}'.format(namespaces[prefix], name)
+
+AMDSEC = _tag('mets', 'amdSec')
+DMDSEC = _tag('mets', 'dmdSec')
+FILEGRP = _tag('mets', 'fileGrp')
+DIV = _tag('mets', 'div')
+FILE = _tag('mets', 'file')
+DUBLINCORE = _tag('dcterms', 'dublincore')
+HREF = _tag('xlink', 'href')
+
+"""A file in the fileSec:
+    - file_id: value of the ID attribute, e.g. 'file-0b3f...'
+    - href: xlink:href of FLocat, e.g. 'objects/data/results.csv'
+    - rights: (act, restriction) of the first premis:rightsGranted, or None
+    - fixity: (messageDigestAlgorithm, messageDigest) of premis:fixity, or None
+"""
+MetsFile = namedtuple('MetsFile', ['file_id', 'href', 'rights', 'fixity'])
+
+def find_one(node, path):
+    return node.find(path, namespaces)
+
+def find_all(node, path):
+    return node.findall(path, namespaces)
+
+def _text(node, path):
+    child = find_one(node, path)
+    return child.text if child is not None else None
+
+def amdsec_rights(amdsec):
+    """return (act, restriction) of the first premis:rightsGranted in amdsec, or None"""
+    rights_granted = find_one(amdsec, './/premis:rightsGranted')
+    if rights_granted is None:
+        return None
+    return _text(rights_granted, './premis:act'), _text(rights_granted, './premis:restriction')
+
+def amdsec_fixity(amdsec):
+    """return (algorithm, digest) of the premis:fixity element in amdsec, or None"""
+    fixity = find_one(amdsec, './/premis:fixity')
+    if fixity is None:
+        return None
+    algorithm = _text(fixity, './premis:messageDigestAlgorithm')
+    digest = _text(fixity, './premis:messageDigest')
+    if algorithm is None or digest is None:
+        return None
+    return algorithm, digest
+
+class MetsReader:
+    """Single-pass reader of a METS file
+       Instance variables:
+           - path: path of the METS file
+           - file_group: USE attribute of the fileGrp whose files are read
+           - amdsecs: dict {amdSec ID: (rights, fixity)}
+    """
+    def __init__(self, path, file_group='original'):
+        self.path = path
+        self.file_group = file_group
+        self.amdsecs = {}
+        self._metadata = None
+        self._pending = []  # files parsed before the package metadata was found
+        self._events = self._parse()
+
+    def _parse(self):
+        """generate ('metadata', dict) and ('file', element) events, after removing
+        processed elements from their parents"""
+        stack, groups = [], []
+        for event, elem in iterparse(self.path, events=('start', 'end')):
+            if event == 'start':
+                stack.append(elem)
+                if elem.tag == FILEGRP:
+                    groups.append(elem.get('USE'))
+                continue
+            stack.pop()
+            if elem.tag == AMDSEC:
+                self.amdsecs[elem.get('ID')] = (amdsec_rights(elem), amdsec_fixity(elem))
+            elif elem.tag == DUBLINCORE and self._metadata is None:
+                self._metadata = {child.tag.split('}')[1]: child.text for child in elem}
+                yield 'metadata', self._metadata
+            elif elem.tag == FILE and groups and groups[-1] == self.file_group:
+                yield 'file', elem
+            elif elem.tag == FILEGRP:
+                groups.pop()
+            if stack and elem.tag in (AMDSEC, DMDSEC, FILE, FILEGRP, DIV):
+                stack[-1].remove(elem)
+
+    def _record(self, elem):
+        flocat = find_one(elem, './mets:FLocat')
+        rights, fixity = None, None
+        for admid in (elem.get('ADMID') or '').split():
+            if admid in self.amdsecs:
+                rights, fixity = self.amdsecs[admid]
+                break
+        return MetsFile(elem.get('ID'), flocat.get(HREF) if flocat is not None else None,
+                        rights, fixity)
+
+    def metadata(self):
+        """return the package metadata: a dict with the elements of the first
+        dcterms:dublincore (title, creator, relation, ...); files that are parsed
+        on the way are kept for files()"""
+        while self._metadata is None:
+            event = next(self._events, None)
+            if event is None:
+                return {}
+            if event[0] == 'file':
+                self._pending.append(event[1])
+        return self._metadata
+
+    def _elements(self):
+        while self._pending:
+            yield self._pending.pop(0)
+        for kind, elem in self._events:
+            if kind == 'file':
+                yield elem
+
+    def files(self):
+        """generate a MetsFile record for every mets:file in the file group, in document
+        order; a file whose amdSec comes after it (unusual) is yielded at the end"""
+        deferred = []
+        for elem in self._elements():
+            if any(admid not in self.amdsecs for admid in (elem.get('ADMID') or '').split()):
+                deferred.append(elem)
+            else:
+                yield self._record(elem)
+        for elem in deferred:
+            yield self._record(elem)
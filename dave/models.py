@@ -1,10 +1,49 @@
-from string import Template
+from abc import ABC, abstractmethod
+from os.path import basename
+from threading import RLock
 import time
+from .bulk import load_template
 from .common import *
+from .direct import DEFAULT_PART_JOBS, file_entry, register_files, upload_to_store
+from .multipart import DEFAULT_CHUNK_SIZE, MultipartEncoder
 
 def dataset_pid(protocol, authority, identifier):
     return '{}:{}/{}'.format(protocol, authority, identifier)
 
+class _Lazy(ABC):
+    """Mixin for a model object that is built from the contents listing of a dataverse.
+    Attributes that the listing does not provide are fetched from the server when
+    one of them is first accessed; `_load` returns the fully fetched object. A fetch
+    that fails raises DataverseError, and is tried again at the next access. Proxies
+    are shared through the identity map of a Connection, so the fetch holds a lock:
+    other threads wait for it, and then see the complete object."""
+    _loaded = False
+    _loading = False
+
+    def __init__(self):
+        self._lock = RLock()
+
+    @abstractmethod
+    def _load(self):
+        """Fetch the object from the server and return it"""
+
+    def __getattr__(self, name):
+        # only called for attributes that are not set (yet)
+        if name.startswith('__') or name == '_lock':
+            raise AttributeError(name)
+        with self._lock:
+            # _loading: an attribute that _load itself looks up in this thread
+            if not self._loaded and not self._loading:
+                self._loading = True
+                try:
+                    full = self._load()
+                finally:
+                    self._loading = False
+                for key, value in vars(full).items():
+                    self.__dict__.setdefault(key, value)
+                self._loaded = True
+        return object.__getattribute__(self, name)
+
 class Dataverse(object):
     _attr_required_metadata = ['alias', 'name', 'dataverseContacts']
     _attr_valid_metadata = _attr_required_metadata + \
@@ -29,11 +68,11 @@ class Dataverse(object):
         return 'Dataverse {} name={} alias={}'.format(self.identifier, self.name, self.alias)
 
     def find_dataverse(self, name, auth=True):
-        result = [child for child in self.contents() if child.name == name]
+        result = [child for child in self.contents() if isinstance(child, Dataverse) and child.name == name]
         if result:
             return result[0]
         else:
-            raise DataverseError("Dataverse {0} does not have child dataverse '{}'".\
+            raise DataverseError("Dataverse {0} does not have child dataverse '{1}'".\
                                  format(self.identifier, name))
 
     def create_dataverse(self, metadata, auth=True):
@@ -62,16 +101,17 @@ class Dataverse(object):
             raise DataverseError('Child of dataverse {0} could not be created: {1} ({2})'.\
                                  format(self.identifier, message, code))
 
-    def create_dataset(self, metadata, auth=True, test=False):
+    def create_dataset(self, metadata, auth=True, test=False, template=None, terms_type=None):
         """Add new dataset to this dataverse.
         To create a dataset, you must create a JSON file containing all the
         metadata in `dataset-minimal-metadata.json`. The contents of this file
         are a template string with replacement fields: $title $authorname
         $authoraffiliation $contactemail $contactname $description.
-        The replacements should be in the dict variable `metadata`."""
+        The replacements should be in the dict variable `metadata`; the file
+        is read once, or `template` is a DatasetTemplate. With `terms_type`
+        (e.g. 'type_1'), the terms of that type are added."""
         endpoint = '/dataverses/{0}/datasets'.format(self.identifier)
-        template = read_file('dataset-minimal-metadata.json')
-        result = Template(template).substitute(metadata)
+        result = (template or load_template()).render(metadata, terms_type)
         if test:
             print('add dataset with metadata {}'.format(result))
         response = self.connection.post_request(endpoint, metadata=result, auth=auth)
@@ -104,6 +144,8 @@ class Dataverse(object):
                                  format(self.identifier, message, code))
 
     def contents(self, json=False):
+        """Return the child dataverses and datasets. The children are built from the
+        listing, with one request in total: other attributes are fetched on first use."""
         endpoint = '/dataverses/{0}/contents'.format(self.identifier)
         response = self.connection.get_request(endpoint, auth=True)
         if json:
@@ -112,20 +154,27 @@ class Dataverse(object):
             result = []
             for el in response.json()['data']:
                 if el['type'] == 'dataverse':
-                    lookup_id = el['id']
-                    result.append(self.connection.get_dataverse(lookup_id, auth=True))
+                    child = self.connection.known('dataverse', el['id'])
+                    if child is None:
+                        child = DataverseProxy(self.connection, el)
+                        self.connection.remember('dataverse', child, el['id'])
+                    result.append(child)
                 elif el['type'] == 'dataset':
                     # persistentId = doi:10.5072/FK2/J8SJZB
-                    lookup_id = dataset_pid(el['protocol'], el['authority'], el['identifier'])
-                    result.append(self.connection.get_dataset(lookup_id, is_pid=True, auth=True))
+                    child = self.connection.known('dataset', el['id'])
+                    if child is None:
+                        child = DatasetProxy(self.connection, el)
+                        self.connection.remember('dataset', child, el['id'], child.pid())
+                    result.append(child)
             return result
 
     def delete(self, auth=True):
         endpoint = '/dataverses/{0}'.format(self.identifier)
-        response = self.connection.delete_request(endpoint, auth)
+        response = self.connection.delete_request(endpoint, auth=auth)
         code = response.status_code
         message = response.json().get('message', '')
         if code == 200:
+            self.connection.forget('dataverse', self)
             self.connection = None  # object remains alive, but is useless without connection
             return True
         elif code == 401:
@@ -146,7 +195,6 @@ class Dataset(object):
     _attr_required_metadata = ['title', 'author', 'datasetContact', 'dsDescription', 'subject']
 
     def __init__(self, connection, data):
-        print("Dataset.init: data={}".format(data))
         self.connection = connection
         self.dataset_id = data.get('id', '')
         self.identifier = data.get('identifier', '')
@@ -194,6 +242,7 @@ class Dataset(object):
         code = response.status_code
         message = response.json().get('message', '')
         if code == 200:
+            self.connection.forget('dataset', self)
             self.connection = None  # object remains alive, but is useless without connection
             return True
         elif code == 404:
@@ -220,18 +269,54 @@ class Dataset(object):
         response = self.connection.get_request(endpoint, auth=True)
         return response.json()
 
-    def get_datafile(self, identifier, is_pid=True):
+    def version_files(self, version=':latest'):
+        """Return the list of file metadata (label, directoryLabel, dataFile) of a version"""
+        endpoint = '/datasets/{0}/versions/{1}/files'.format(self.dataset_id, version)
+        response = self.connection.get_request(endpoint, auth=True)
+        if response.status_code != 200:
+            raise DataverseError('Files of dataset {0} version {1} not found: {2} ({3})'.\
+                                 format(self.dataset_id, version,
+                                        response.json().get('message', ''), response.status_code))
+        return response.json()['data']
+
+    def get_datafile(self, identifier, is_pid=False, offset=0, original=False, stream=False):
+        """Download a data file, by id or by persistent id if `is_pid`. Return its contents
+        (bytes), or with `stream` the response, whose contents the caller reads with
+        iter_content and then closes. With `offset`, only the bytes from `offset` on are
+        asked for (HTTP Range): the status of the response is 206 if the server sends
+        only those, or 200 if it sends the whole file. With `original`, the original file
+        of an ingested tabular file is downloaded (the checksum in the listing is of it)."""
         if is_pid:
-            endpoint = '/access/datafile/{0}'.format(identifier)
-        else:
             endpoint = '/access/datafile/:persistentId/?persistentId={0}'.format(identifier)
-        response = self.connection.get_request(endpoint, auth=True)
-        return response.json()
+        else:
+            endpoint = '/access/datafile/{0}'.format(identifier)
+        if original:
+            endpoint += '{0}format=original'.format('&' if is_pid else '?')
+        headers = {'Range': 'bytes={0}-'.format(offset)} if offset else {}
+        response = self.connection.get_request(endpoint, auth=True, headers=headers, stream=stream)
+        code = response.status_code
+        if code not in (200, 206):
+            try:
+                message = response.json().get('message', '')
+            except ValueError:
+                message = response.text[:200]
+            response.close()
+            raise DataverseError('Data file {0} could not be downloaded: {1} ({2})'.\
+                                 format(identifier, message, code))
+        return response if stream else response.content
 
-    def add_file(self, filename, metadata, test=False):
+    def add_file(self, filename, metadata, test=False, pause=0, progress=None,
+                 chunk_size=DEFAULT_CHUNK_SIZE, file_obj=None):
         """Add file to the present dataset. The argument `metadata` should
         be a dict object containing at least description (str),
         directoryLabel (str, relative file path), restrict = True|False
+        After a successful upload the calling thread sleeps `pause` seconds.
+        Uploads that hit a dataset lock are retried by the scheduler of the connection.
+        The file is streamed in chunks of `chunk_size` bytes; `progress` is an optional
+        callable progress(bytes_sent, total_bytes). If `file_obj` is given, its contents
+        are uploaded under the name `filename` (e.g. a zip archive built in memory).
+        Returns the list of added files from the response (see below), which includes
+        the checksum that the server computed; the list is also added to `datafiles`.
         Via the shell, one would add a file like so:
         /usr/bin/curl -H X-Dataverse-key:2a4e470d-c316-48c3-9a30-1d819b0bdbc8 \
          -X POST -F 'file=@description.json' \
@@ -243,19 +328,26 @@ class Dataset(object):
         if 'categories' not in metadata:
             metadata['categories'] = ['Data']
         json_data = json.dumps(metadata)
-        params = {'file':open(filename, 'rb'), 'jsonData':json_data}
         if test:
             print('add file {} with metadata {}'.format(filename, json_data))
+        if file_obj is None:
+            with open(filename, 'rb') as file_obj:
+                return self.add_file(filename, metadata, test=False, pause=pause, progress=progress,
+                                     chunk_size=chunk_size, file_obj=file_obj)
         endpoint = '/datasets/{0}/add'.format(self.dataset_id)
-        response = self.connection.post_request(endpoint, files=params, auth=True)
+        body = MultipartEncoder([('file', (basename(filename), file_obj)), ('jsonData', json_data)],
+                                chunk_size=chunk_size, progress=progress)
+        response = self.connection.post_request(endpoint, data=body, auth=True,
+                                                headers={'Content-Type': body.content_type})
         code = response.status_code
         resp_json = response.json()
         message = resp_json.get('message', '')
         if code == 200:
-            # Dataverse server needs some time in between file uploads.
-            # If you omit this, you run the risk of HTTP 400 on some of the requests.
-            time.sleep(1)
-            return True
+            files = resp_json['data']['files']
+            self.datafiles.extend(files)
+            if pause:
+                time.sleep(pause)
+            return files
         elif code == 404:
             raise DataverseError('Dataset {0} was not found: {1} (404)'.\
                                  format(self.dataset_id, message))
@@ -269,6 +361,74 @@ class Dataset(object):
             raise DataverseError('Dataset {0}: file could not be added: {1} ({2})'. \
                                  format(self.identifier, message, code))
 
+    def add_file_direct(self, filename, metadata, checksum, jobs=DEFAULT_PART_JOBS, pause=0,
+                        progress=None, chunk_size=DEFAULT_CHUNK_SIZE):
+        """Add file to the present dataset by direct upload to its S3-compatible store
+        (see dave.direct): the file does not pass through the Dataverse server, and a large
+        file is uploaded in parts, `jobs` at a time. The argument `metadata` is as for
+        add_file. `checksum` is (type, value), e.g. ('MD5', '73dd...'), or a function that
+        returns it: it is called when the upload is done, so the checksum can be computed
+        in parallel with the upload. Raises dave.direct.DirectUploadUnavailable if the
+        store does not allow direct upload. Returns the list of added files, like add_file.
+        """
+        if 'categories' not in metadata:
+            metadata['categories'] = ['Data']
+        storage_identifier = upload_to_store(self.connection, self.dataset_id, filename, jobs=jobs,
+                                             progress=progress, chunk_size=chunk_size)
+        if callable(checksum):
+            checksum = checksum()
+        entry = file_entry(filename, storage_identifier, checksum, metadata)
+        files = register_files(self.connection, self.dataset_id, [entry])
+        self.datafiles.extend(files)
+        if pause:
+            time.sleep(pause)
+        return files
+
+class DataverseProxy(_Lazy, Dataverse):
+    """Dataverse from a contents listing: knows its identifier and name"""
+    def __init__(self, connection, item):
+        _Lazy.__init__(self)
+        self.connection = connection
+        self.datasets = []
+        self.dataverses = []
+        self.identifier = item['id']
+        self.name = item.get('title')
+
+    def _load(self):
+        response = self.connection.get_request('/dataverses/{0}'.format(self.identifier), auth=True)
+        _check_found(response, 'Dataverse {0}'.format(self.identifier))
+        full = Dataverse(connection=self.connection, data=response.json()['data'])
+        self.connection.remember('dataverse', self, full.alias)
+        return full
+
+class DatasetProxy(_Lazy, Dataset):
+    """Dataset from a contents listing: knows its id and persistent identifier"""
+    def __init__(self, connection, item):
+        _Lazy.__init__(self)
+        self.connection = connection
+        self.dataset_id = item['id']
+        self.identifier = item.get('identifier', '')
+        self.protocol = item.get('protocol', '')
+        self.authority = item.get('authority', '')
+        self.datafiles = []
+
+    def _load(self):
+        endpoint = '/datasets/{0}'.format(self.dataset_id)
+        response = self.connection.get_request(endpoint, auth=True)
+        _check_found(response, 'Dataset {0}'.format(self.dataset_id))
+        return Dataset(connection=self.connection, data=response.json()['data'])
+
+def _check_found(response, name):
+    """Raise DataverseError if `response` is not the object `name`, e.g. it was deleted or
+    the API token does not give access to it"""
+    if response.status_code != 200:
+        try:
+            message = response.json().get('message', '')
+        except ValueError:
+            message = response.text
+        raise DataverseError('{0} could not be retrieved: {1} ({2})'.\
+                             format(name, message, response.status_code))
+
 """Response of add_file should look like this:
 {
   "status": "OK",
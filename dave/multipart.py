@@ -0,0 +1,115 @@
+"""Streaming multipart/form-data encoder.
+requests builds a multipart body from `files=` completely in memory before sending it.
+MultipartEncoder is a file-like object with a known length, that requests sends as
+a stream: file contents are read in chunks of a fixed size when the body is sent,
+so memory use does not depend on the size of the uploaded files.
+"""
+
+import os, uuid
+
+DEFAULT_CHUNK_SIZE = 1 << 20  # 1 MiB
+
+def _to_bytes(value):
+    return value.encode('utf-8') if isinstance(value, str) else value
+
+def _file_size(fileobj):
+    """number of bytes from the current position to the end (no fileno(), because
+    that moves a SpooledTemporaryFile to disk)"""
+    position = fileobj.tell()
+    size = fileobj.seek(0, os.SEEK_END) - position
+    fileobj.seek(position)
+    return size
+
+class MultipartEncoder:
+    """Multipart/form-data body that is read in chunks
+       Instance variables:
+           - fields: list of (name, value), where value is a str or bytes, or a
+             tuple (filename, fileobj) or (filename, fileobj, content_type)
+           - boundary: multipart boundary
+           - content_type: value for the Content-Type header
+           - chunk_size: number of bytes read from a file at a time
+           - progress: optional callable progress(bytes_read, total_bytes)
+    """
+    def __init__(self, fields, boundary=None, chunk_size=DEFAULT_CHUNK_SIZE, progress=None):
+        self.fields = list(fields)
+        self.boundary = boundary or uuid.uuid4().hex
+        self.content_type = f'multipart/form-data; boundary={self.boundary}'
+        self.chunk_size = chunk_size
+        self.progress = progress
+        self.parts = []  # list of (header bytes, bytes or fileobj, start offset, size)
+        for name, value in self.fields:
+            if isinstance(value, tuple):
+                filename, fileobj = value[0], value[1]
+                content_type = value[2] if len(value) > 2 else 'application/octet-stream'
+                header = (f'--{self.boundary}\r\n'
+                          f'Content-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                          f'Content-Type: {content_type}\r\n\r\n')
+                self.parts.append((header.encode('utf-8'), fileobj, fileobj.tell(), _file_size(fileobj)))
+            else:
+                data = _to_bytes(value)
+                header = (f'--{self.boundary}\r\n'
+                          f'Content-Disposition: form-data; name="{name}"\r\n\r\n')
+                self.parts.append((header.encode('utf-8'), data, 0, len(data)))
+        self.trailer = f'--{self.boundary}--\r\n'.encode('utf-8')
+        self.total = sum(len(header) + size + 2 for header, _, _, size in self.parts) + len(self.trailer)
+        self.rewind()
+
+    def __len__(self):
+        return self.total
+
+    def __repr__(self):
+        names = ', '.join(name for name, _ in self.fields)
+        return f'MultipartEncoder({names}; {self.total} bytes)'
+
+    def _chunks(self):
+        for header, content, start, size in self.parts:
+            yield header
+            if isinstance(content, bytes):
+                yield content
+            else:
+                content.seek(start)
+                remaining = size
+                while remaining > 0:
+                    chunk = content.read(min(self.chunk_size, remaining))
+                    if not chunk:
+                        raise IOError(f'{getattr(content, "name", "file")} ended {remaining} bytes early')
+                    remaining -= len(chunk)
+                    yield chunk
+            yield b'\r\n'
+        yield self.trailer
+
+    def rewind(self):
+        """Start reading the body from the beginning (e.g. to retry a request)"""
+        self.iterator = self._chunks()
+        self.buffer = b''
+        self.offset = 0  # position in buffer
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        """Return at most `size` bytes of the body (all remaining bytes if size < 0);
+        at the end of the body an empty bytes object"""
+        if size is None or size < 0:
+            size = self.total
+        result = bytearray()
+        while len(result) < size:
+            if self.offset >= len(self.buffer):
+                chunk = next(self.iterator, None)
+                if chunk is None:
+                    break
+                self.buffer, self.offset = chunk, 0
+            end = self.offset + size - len(result)
+            result += self.buffer[self.offset:end]
+            self.offset = min(end, len(self.buffer))
+        result = bytes(result)
+        if result:
+            self.bytes_read += len(result)
+            if self.progress:
+                self.progress(self.bytes_read, self.total)
+        return result
+
+    def __iter__(self):
+        while True:
+            chunk = self.read(self.chunk_size)
+            if not chunk:
+                return
+            yield chunk
@@ -0,0 +1,83 @@
+"""Plans of dependent actions, applied in parallel.
+A plan is a list of actions, such as 'create dataverse' or 'assign role', where an
+action can depend on earlier actions. Applying a plan runs the actions in a thread
+pool: an action starts as soon as all actions it depends on have succeeded, and it is
+skipped if one of them failed. The result of every action is kept, so that a later
+action can use it (e.g. the identifier of a group that was just created).
+"""
+
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+class Action:
+    """Step of a plan
+       Instance variables:
+           - key: unique key of the action in the plan
+           - description: human readable description, shown by a dry run
+           - func: callable without arguments that performs the action
+           - depends: keys of the actions that must succeed first
+    """
+    def __init__(self, key, description, func, depends=()):
+        self.key = key
+        self.description = description
+        self.func = func
+        self.depends = tuple(depends)
+
+    def __str__(self):
+        return self.description
+
+class Plan:
+    """Actions with dependencies
+       Instance variables:
+           - actions: dict {key: Action}, in the order in which they were added
+           - results: dict {key: return value} of the actions that succeeded
+           - errors: dict {key: exception} of the actions that failed or were skipped
+    """
+    def __init__(self):
+        self.actions = {}
+        self.results = {}
+        self.errors = {}
+
+    def add(self, key, description, func, depends=()):
+        """Add an action. Dependencies on keys that are not in the plan are already
+        satisfied (e.g. a dataverse that exists); other dependencies must have been added
+        before, so the plan cannot have cycles."""
+        if key in self.actions:
+            raise ValueError(f"duplicate action {key}")
+        self.actions[key] = Action(key, description, func, [dep for dep in depends if dep in self.actions])
+        return self.actions[key]
+
+    def __len__(self):
+        return len(self.actions)
+
+    def __str__(self):
+        return '\n'.join(f"{number:4}. {action}" for number, action in
+                         enumerate(self.actions.values(), start=1))
+
+    def apply(self, jobs=4, report=print):
+        """Perform the actions, at most `jobs` at the same time; `report` is called with
+        a line of text for every action that is done. Return True if all actions succeeded."""
+        waiting = list(self.actions.values())
+        running = {}
+        with ThreadPoolExecutor(max_workers=max(jobs, 1)) as executor:
+            while waiting or running:
+                for action in list(waiting):
+                    failed = [dep for dep in action.depends if dep in self.errors]
+                    if failed:
+                        waiting.remove(action)
+                        self.errors[action.key] = RuntimeError(f"skipped, because {failed[0]} failed")
+                        report(f"skip: {action} ({failed[0]} failed)")
+                    elif all(dep in self.results for dep in action.depends):
+                        waiting.remove(action)
+                        running[executor.submit(action.func)] = action
+                if not running:
+                    continue
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    action = running.pop(future)
+                    try:
+                        self.results[action.key] = future.result()
+                        report(f"done: {action}")
+                    except Exception as e:
+                        self.errors[action.key] = e
+                        report(f"fail: {action} ({e})")
+        return not self.errors
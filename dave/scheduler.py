@@ -0,0 +1,234 @@
+"""Adaptive rate limiter and retry scheduler.
+Connection and Api send every request through the Scheduler of the target host.
+The scheduler hands out tokens from a token bucket whose rate is adapted AIMD-style:
+every successful request raises the rate by a constant, every throttling response
+(429, 503, or a 400 because the dataset is locked) halves it. Transient failures
+are retried with jittered exponential backoff, honoring the Retry-After header.
+Requests that are not idempotent (POST) are only retried when the server tells
+us that it did not process them.
+"""
+
+import asyncio, random, time
+from email.utils import parsedate_to_datetime
+from threading import Lock
+from urllib.parse import urlsplit
+from requests import ConnectionError, Timeout
+
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS')
+THROTTLE_CODES = (429, 503)   # server did not process the request, retry any method
+GATEWAY_CODES = (502, 504)    # request may or may not have been processed
+
+DEFAULT_RATE = 5.0        # initial number of requests per second
+DEFAULT_MIN_RATE = 0.2
+DEFAULT_MAX_RATE = 100.0
+DEFAULT_INCREASE = 0.5    # additive increase of the rate per successful request
+DEFAULT_DECREASE = 0.5    # multiplicative decrease of the rate per throttling response
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_BACKOFF = 1.0     # base delay in seconds of the exponential backoff
+DEFAULT_MAX_BACKOFF = 60.0
+
+class TokenBucket:
+    """Token bucket with a variable rate (tokens per second) and a fixed capacity"""
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self):
+        """Take one token and return 0 if one is available; otherwise return the number
+        of seconds until one is"""
+        with self.lock:
+            self._refill(time.monotonic())
+            if self.tokens >= 1.0:
+                self.tokens -= 1.0
+                return 0
+            return (1.0 - self.tokens) / self.rate
+
+    def acquire(self):
+        """Take one token, and sleep until one is available if the bucket is empty"""
+        while True:
+            wait = self.reserve()
+            if not wait:
+                return
+            time.sleep(wait)
+
+    def set_rate(self, rate):
+        with self.lock:
+            self._refill(time.monotonic())
+            self.rate = rate
+            self.capacity = max(rate, 1.0)
+            self.tokens = min(self.tokens, self.capacity)
+
+def retry_after(response):
+    """Return the delay in seconds from the Retry-After header of `response`, or None"""
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+def is_lock_error(response):
+    """Dataverse answers 400 when a dataset is locked by a concurrent change (e.g. an upload)"""
+    if response.status_code != 400:
+        return False
+    try:
+        message = str(response.json().get('message', ''))
+    except ValueError:
+        message = response.text
+    return 'lock' in message.lower()
+
+class Scheduler:
+    """Rate limiter and retry scheduler for the requests to one host
+       Instance variables:
+           - bucket: token bucket that limits the request rate
+           - min_rate, max_rate: bounds of the adaptive rate
+           - increase, decrease: AIMD parameters
+           - max_retries, backoff, max_backoff: retry parameters
+           - retries, throttled: counters, for reporting
+    """
+    def __init__(self, rate=DEFAULT_RATE, min_rate=DEFAULT_MIN_RATE, max_rate=DEFAULT_MAX_RATE,
+                 increase=DEFAULT_INCREASE, decrease=DEFAULT_DECREASE,
+                 max_retries=DEFAULT_MAX_RETRIES, backoff=DEFAULT_BACKOFF,
+                 max_backoff=DEFAULT_MAX_BACKOFF):
+        self.bucket = TokenBucket(rate)
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.retries = 0
+        self.throttled = 0
+        self.lock = Lock()
+
+    def configure(self, rate=None, **settings):
+        """Change the settings of this scheduler; `settings` are named like the instance variables"""
+        with self.lock:
+            if rate is not None:
+                self.bucket.set_rate(rate)
+            for key, value in settings.items():
+                if not hasattr(self, key):
+                    raise TypeError(f"unknown scheduler setting '{key}'")
+                setattr(self, key, value)
+
+    @property
+    def rate(self):
+        return self.bucket.rate
+
+    def _success(self):
+        with self.lock:
+            self.bucket.set_rate(min(self.bucket.rate + self.increase, self.max_rate))
+
+    def _throttle(self):
+        with self.lock:
+            self.throttled += 1
+            self.bucket.set_rate(max(self.bucket.rate * self.decrease, self.min_rate))
+
+    def _delay(self, attempt):
+        """full jitter: uniform between 0 and the exponential backoff"""
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def _retryable(self, method, response):
+        code = response.status_code
+        if code in THROTTLE_CODES or is_lock_error(response):
+            return True
+        return code in GATEWAY_CODES and method in IDEMPOTENT_METHODS
+
+    def send(self, method, send):
+        """Call `send()` (which performs the request and returns the response) when the
+        rate limit allows it, and call it again for transient failures.
+        The last response is returned when the retries are exhausted; a connection error
+        of the last attempt, or of a request that is not idempotent, is raised."""
+        attempt = 0
+        while True:
+            self.bucket.acquire()
+            try:
+                response = send()
+            except (ConnectionError, Timeout):
+                if method not in IDEMPOTENT_METHODS or attempt >= self.max_retries:
+                    raise
+                self._throttle()
+                delay = self._delay(attempt)
+            else:
+                if not self._retryable(method, response):
+                    self._success()
+                    return response
+                self._throttle()
+                if attempt >= self.max_retries:
+                    return response
+                delay = retry_after(response)
+                if delay is None:
+                    delay = self._delay(attempt)
+                else:
+                    delay += random.uniform(0, self.backoff)
+            with self.lock:
+                self.retries += 1
+            time.sleep(delay)
+            attempt += 1
+
+    async def send_async(self, method, send, errors=(ConnectionError, Timeout)):
+        """Like send(), for a coroutine function `send` in an event loop: waiting for
+        a token or a retry does not block other requests. `errors` are the exceptions
+        of the HTTP client that mean that the connection failed."""
+        attempt = 0
+        while True:
+            wait = self.bucket.reserve()
+            while wait:
+                await asyncio.sleep(wait)
+                wait = self.bucket.reserve()
+            try:
+                response = await send()
+            except errors:
+                if method not in IDEMPOTENT_METHODS or attempt >= self.max_retries:
+                    raise
+                self._throttle()
+                delay = self._delay(attempt)
+            else:
+                if not self._retryable(method, response):
+                    self._success()
+                    return response
+                self._throttle()
+                if attempt >= self.max_retries:
+                    return response
+                delay = retry_after(response)
+                if delay is None:
+                    delay = self._delay(attempt)
+                else:
+                    delay += random.uniform(0, self.backoff)
+            with self.lock:
+                self.retries += 1
+            await asyncio.sleep(delay)
+            attempt += 1
+
+_settings = {}
+_schedulers = {}
+_lock = Lock()
+
+def configure_scheduler(**settings):
+    """Change the settings (keyword arguments of Scheduler) of all schedulers"""
+    with _lock:
+        settings = {key: value for key, value in settings.items() if value is not None}
+        _settings.update(settings)
+        for scheduler in _schedulers.values():
+            scheduler.configure(**settings)
+
+def get_scheduler(base_url):
+    """Return the scheduler for the host of `base_url`; all clients of a host share it"""
+    host = urlsplit(base_url).netloc
+    with _lock:
+        if host not in _schedulers:
+            _schedulers[host] = Scheduler(**_settings)
+        return _schedulers[host]
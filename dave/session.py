@@ -0,0 +1,121 @@
+"""Shared HTTP session layer.
+All requests of Connection and Api go through one requests.Session, so that
+TCP+TLS connections to a Dataverse server are pooled and kept alive instead of
+being opened anew for every request. Every host gets its own connection pool,
+whose size can be configured per host.
+"""
+
+import atexit, sys
+from threading import Lock
+from urllib.parse import urlsplit
+from requests import Session
+from requests.adapters import HTTPAdapter
+from .metrics import add_metrics_arguments, apply_metrics_arguments
+from .scheduler import DEFAULT_MAX_RETRIES, DEFAULT_RATE, configure_scheduler
+
+DEFAULT_POOL_CONNECTIONS = 4  # number of host pools that are kept per adapter
+DEFAULT_POOL_MAXSIZE = 10     # number of keep-alive connections per host
+
+_settings = {'pool_connections': DEFAULT_POOL_CONNECTIONS,
+             'pool_maxsize': DEFAULT_POOL_MAXSIZE,
+             'pool_maxsize_per_host': {}}
+_session = None
+_mounted = set()  # prefixes 'scheme://host' that have their own adapter
+_lock = Lock()
+
+def _prefix(base_url):
+    parts = urlsplit(base_url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+def _mount(session, prefix):
+    host = urlsplit(prefix).netloc
+    maxsize = _settings['pool_maxsize_per_host'].get(host, _settings['pool_maxsize'])
+    adapter = HTTPAdapter(pool_connections=_settings['pool_connections'],
+                          pool_maxsize=maxsize, pool_block=False)
+    session.mount(prefix, adapter)
+    _mounted.add(prefix)
+
+def configure_session(pool_connections=None, pool_maxsize=None, pool_maxsize_per_host=None):
+    """Change the pool settings of the shared session.
+    `pool_maxsize` is the number of keep-alive connections per host, and
+    `pool_maxsize_per_host` is a dict {host: size} that overrides it for specific hosts.
+    Hosts that already have a pool get a new one with the new settings."""
+    with _lock:
+        if pool_connections is not None:
+            _settings['pool_connections'] = pool_connections
+        if pool_maxsize is not None:
+            _settings['pool_maxsize'] = pool_maxsize
+        if pool_maxsize_per_host is not None:
+            _settings['pool_maxsize_per_host'].update(pool_maxsize_per_host)
+        if _session is not None:
+            for prefix in list(_mounted):
+                _mount(_session, prefix)
+
+def get_session(base_url):
+    """Return the shared session, with a connection pool for the host of `base_url`."""
+    global _session
+    with _lock:
+        if _session is None:
+            _session = Session()
+        prefix = _prefix(base_url)
+        if prefix not in _mounted:
+            _mount(_session, prefix)
+        return _session
+
+def auth_headers(api_token, **extra):
+    """Return the headers that authenticate a request with `api_token`.
+    The result can be reused for every request of a client."""
+    headers = {'X-Dataverse-key': api_token} if api_token else {}
+    headers.update(extra)
+    return headers
+
+def session_stats():
+    """Return a dict {host: {'requests': n, 'opened': n, 'reused': n}} for the shared session."""
+    stats = {}
+    with _lock:
+        if _session is None:
+            return stats
+        for adapter in set(_session.adapters.values()):
+            if not isinstance(adapter, HTTPAdapter):
+                continue
+            pools = adapter.poolmanager.pools
+            for key in list(pools.keys()):
+                pool = pools.get(key)
+                if pool is None:
+                    continue
+                host = pool.host if pool.port in (None, 80, 443) else f"{pool.host}:{pool.port}"
+                entry = stats.setdefault(host, {'requests': 0, 'opened': 0, 'reused': 0})
+                entry['requests'] += pool.num_requests
+                entry['opened'] += pool.num_connections
+        for entry in stats.values():
+            entry['reused'] = max(entry['requests'] - entry['opened'], 0)
+    return stats
+
+def print_session_stats(file=sys.stderr):
+    """Print the number of reused and opened connections per host."""
+    for host, entry in sorted(session_stats().items()):
+        print(f"{host}: {entry['requests']} requests, {entry['opened']} connections opened, "
+              f"{entry['reused']} reused", file=file)
+
+def add_session_arguments(parser):
+    """Add the command line options of the session layer to an argparse parser."""
+    parser.add_argument('--pool-size', type=int, default=DEFAULT_POOL_MAXSIZE,
+                        help='maximum number of keep-alive connections per host')
+    parser.add_argument('--connection-stats', action='store_true',
+                        help='print number of reused and opened connections at exit')
+    parser.add_argument('--rate', type=float, default=DEFAULT_RATE,
+                        help='initial number of requests per second; adapts to the server')
+    parser.add_argument('--max-rate', type=float, default=None,
+                        help='upper bound of the adaptive number of requests per second')
+    parser.add_argument('--max-retries', type=int, default=DEFAULT_MAX_RETRIES,
+                        help='number of retries of a transient failure')
+    add_metrics_arguments(parser)
+
+def apply_session_arguments(args):
+    """Configure the shared session and the schedulers from the options
+    added by add_session_arguments."""
+    configure_session(pool_maxsize=args.pool_size)
+    configure_scheduler(rate=args.rate, max_rate=args.max_rate, max_retries=args.max_retries)
+    if args.connection_stats:
+        atexit.register(print_session_stats)
+    apply_metrics_arguments(args, register=atexit.register)
@@ -3,21 +3,29 @@ Please read the API Guide at https://guides.dataverse.org/en/latest/api/index.ht
 if you want to understand the implemented dataverse and dataset functions.
 """
 
-from requests import get, put, post, delete
 import json
+from os.path import basename
+from urllib.parse import urlencode
+from .common import DataverseError
+from .metrics import RequestTimer
+from .multipart import DEFAULT_CHUNK_SIZE, MultipartEncoder
+from .scheduler import get_scheduler
+from .session import auth_headers, get_session
 
 verbose = False # set this to True if you prefer more output
-
-method_callable = {
-    'GET': get, 'PUT': put, 'POST': post, 'DELETE': delete
-}
+SEARCH_PAGE_SIZE = 1000 # the maximum number of items per page of the Search API
 
 class Api:
-    def __init__(self, base_url, api_token, readonly=False):
+    def __init__(self, base_url, api_token, readonly=False, session=None, scheduler=None,
+                 cache=None):
+        """`cache` is an optional dave.cache.ResponseCache for GET responses"""
         self.base_url = base_url
         self.api_token = api_token
         self.readonly = readonly
-        self.headers = {'X-Dataverse-key': api_token, 'Content-Type': 'application/json'}
+        self.headers = auth_headers(api_token, **{'Content-Type': 'application/json'})
+        self.session = session if session is not None else get_session(base_url)
+        self.scheduler = scheduler if scheduler is not None else get_scheduler(base_url)
+        self.cache = cache
 
     def __str__(self):
         return f"Api(url='{self.base_url}', key='{self.api_token}')"
@@ -32,7 +40,8 @@ class Api:
         5: server error
     """
 
-    def _request(self, method, endpoint, **kwarg):
+    def _prepare(self, method, endpoint, kwarg):
+        """Return (path, payload, headers) of a request"""
         if 'props' in kwarg:
             props = kwarg['props']
             del kwarg['props']
@@ -44,13 +53,19 @@ class Api:
                 if verbose: print(f"Props: {props}")
             else:
                 raise ValueError(f"props must be str or dict, not {type(props)}")
+        elif 'data' in kwarg:  # request body such as a MultipartEncoder
+            payload = kwarg.pop('data')
         else:
             payload = ''
+        headers = dict(self.headers, **kwarg.pop('headers', {}))
         path = endpoint.format(url=self.base_url, **kwarg)
-        if self.readonly and method != 'GET':
-            print(f"[readonly] {method} {path}\n{payload}")
-            return
-        response = method_callable[method](path, data=payload, headers=self.headers)
+        return path, payload, headers
+
+    def _result(self, method, path, response):
+        """Return the data of a response (see above), or the whole JSON response if the
+        request failed"""
+        if self.cache is not None and method != 'GET':
+            self.cache.invalidate(path)  # after the write, so no stale response is cached again
         code = response.status_code
         code_class = code // 100
         if code_class in [1, 2, 4]:
@@ -58,6 +73,8 @@ class Api:
             if 'data' in resp_json:
                 if verbose:
                     print(resp_json['data'])
+                if self.cache is not None and method == 'GET' and code_class == 2:
+                    self.cache.put(path, resp_json['data'])
                 return resp_json['data']
             else:
                 print(f"{method} {path} -> code {code}")
@@ -76,6 +93,23 @@ class Api:
             print(f"{method} {path} -> unexpected status code {code}")
             return None
 
+    def _request(self, method, endpoint, **kwarg):
+        path, payload, headers = self._prepare(method, endpoint, kwarg)
+        if self.readonly and method != 'GET':
+            print(f"[readonly] {method} {path}\n{payload}")
+            return
+        if self.cache is not None and method == 'GET':
+            cached = self.cache.get(path)
+            if cached is not None:
+                return cached
+        def send():
+            if hasattr(payload, 'rewind'):  # a retry sends the body from the start
+                payload.rewind()
+            return self.session.request(method, path, data=payload, headers=headers)
+        with RequestTimer(method, endpoint, payload) as timer:
+            timer.response = self.scheduler.send(method, timer.wrap(send))
+        return self._result(method, path, timer.response)
+
     def get_request(self, endpoint, **kwarg):
         return self._request('GET', endpoint, **kwarg)
 
@@ -127,10 +161,55 @@ class Api:
         is derived from on the file `dataset-minimal-metadata.json` (see Dataverse API documentation).`"""
         return self.post_request("{url}/api/dataverses/{dvid}/datasets", dvid=dataverse_id, props=props)
 
+    def dataset_publish(self, persistent_id, dstype='major'):
+        """Publish a dataset; the first version of a dataset must be a major version."""
+        return self.post_request("{url}/api/datasets/:persistentId/actions/:publish?persistentId={pid}&type={dstype}",
+                                 pid=persistent_id, dstype=dstype)
+
     def dataset_versions(self, dataset_id):
         """Retrieve versions of dataset."""
         return self.get_request("{url}/api/datasets/{dvid}/versions", dvid=dataset_id)
 
+    def dataset_version(self, dataset_id, version=':latest', exclude_files=False):
+        """Retrieve one version of dataset, e.g. ':latest', ':latest-published' or '1.0'.
+        With `exclude_files`, the server leaves out the file list (Dataverse 6.1 and later)."""
+        query = '?excludeFiles=true' if exclude_files else ''
+        return self.get_request("{url}/api/datasets/{dsid}/versions/{version}" + query,
+                                dsid=dataset_id, version=version)
+
+    def search(self, query='*', types=('dataset', 'file'), subtree=None,
+               per_page=SEARCH_PAGE_SIZE, **params):
+        """Generate the items of a search, e.g. all datasets and files in the dataverse with
+        alias `subtree` and its sub-dataverses; one request per page of `per_page` items.
+        Other Search API parameters, such as sort or fq, can be given as keyword arguments."""
+        params = dict(params, q=query, type=list(types), per_page=per_page, show_entity_ids='true')
+        if subtree is not None:
+            params['subtree'] = subtree
+        start = 0
+        while True:
+            params['start'] = start
+            query_string = urlencode(params, doseq=True).replace('{', '{{').replace('}', '}}')
+            page = self.get_request("{url}/api/search?" + query_string)
+            if not isinstance(page, dict) or 'items' not in page:
+                raise DataverseError(f"search failed at start={start}: {page}")
+            yield from page['items']
+            start += len(page['items'])
+            if not page['items'] or start >= page.get('total_count', 0):
+                return
+
+    def dataset_add_file(self, dataset_id, filename, metadata, progress=None,
+                         chunk_size=DEFAULT_CHUNK_SIZE):
+        """Add a file to a dataset. The file is streamed in chunks, so memory use does not
+        depend on its size. `metadata` is a dict with e.g. description, directoryLabel and
+        restrict; `progress` is an optional callable progress(bytes_sent, total_bytes)."""
+        json_data = json.dumps(metadata)
+        with open(filename, 'rb') as file_obj:
+            body = MultipartEncoder([('file', (basename(filename), file_obj)),
+                                     ('jsonData', json_data)],
+                                    chunk_size=chunk_size, progress=progress)
+            return self.post_request("{url}/api/datasets/{dsid}/add", dsid=dataset_id,
+                                     data=body, headers={'Content-Type': body.content_type})
+
     def dataset_contents(self, dataset_id, verson):
         """Retrieve contents of a version of a dataset."""
         return self.get_request("{url}/api/dataverses/{dvid}/datasets", dvid=dataset_id)
@@ -1,73 +1,244 @@
 #!/usr/bin/env python3
 
-import sys
-from os.path import abspath, splitext
+"""Convert SPSS .sav or SAS .sas7bdat files to zip files with the data in CSV form and
+a codebook. The data are read in chunks of rows and written straight into a compressed
+zip entry, so memory use is bounded and no intermediate CSV files are written.
+Files and directories (searched recursively) or glob patterns can be given: files are
+converted in parallel, large files by several processes each, and a file whose zip file
+is newer than the file itself is skipped."""
+
+import argparse, glob, io, os, time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from os.path import abspath, exists, getmtime, getsize, isdir, join, splitdrive, splitext
+from itertools import chain
+import numpy as np
 import pandas as pd
 import pyreadstat
-from zipfile import ZipFile
+from zipfile import ZipFile, ZipInfo, ZIP_DEFLATED
 
-def stat_to_csv(fname, fextension):
-    """convert SPSS .sav or SAS .sas7bdat files to csv, also creates a codebook csv file"""
-    file_path = fname+fextension
-    file_name = fname
-    # retrieve data and metadata from SPSS or SAS file
+DEFAULT_MAX_MEMORY = 256  # MB for a chunk of rows
+DEFAULT_SPLIT_ABOVE = 512 # MB: larger files are read by several processes
+STRING_OVERHEAD = 50      # bytes of a Python str object, besides its characters
+CODEBOOK_CHUNK = 10000    # variables per chunk of the codebook
+CSV_FACTOR = 3            # a chunk is in memory as values, as objects, and as CSV text
+
+known_extensions = {
+    '.sav'     : 'SPSS',
+    '.sas7bdat': 'SAS'
+}
+
+def read_function(fextension):
+    """return the pyreadstat function that reads files with extension `fextension`"""
     if fextension == '.sav':
-        data, metadata = pyreadstat.read_sav(file_path)
+        return pyreadstat.read_sav
     elif fextension == '.sas7bdat':
-        data, metadata = pyreadstat.read_sas7bdat(file_path)
+        return pyreadstat.read_sas7bdat
     else:
         raise ValueError(f"statistic file extension '{fextension}' not implemented yet")
-    # retrieve variable labels from metadata and put these in a dataframe
-    variable_labels = pd.DataFrame().\
-        from_dict(metadata.column_names_to_labels, orient='index').\
-        reset_index().rename(columns={'index': 'variable_name', 0: 'variable_label'})
-    # variables are linked to an option label group through an option group ID
-    variable_label_id = pd.DataFrame().from_dict(metadata.variable_to_label, orient='index').\
-        reset_index().rename(columns={'index': 'variable_name', 0: 'value_label_id'})
-    # join the data frames variable_labels and variable_label_id on 'variable_name'
-    variable_labels_with_id = pd.merge(variable_labels, variable_label_id, how='left',
-        left_on='variable_name', right_on='variable_name').fillna('')
-    # value labels are stored in a dictionary;
-    # convert this to a table 'value_label', 'value', 'value_label_id'
-    value_labels_dict = metadata.value_labels
-    if len(value_labels_dict) == 0: # no value labels, so codebook is very simple
-        print('no value labels')
-        codebook = variable_labels
-    else:
-        collect = []
-        for k1, v1 in value_labels_dict.items():
-            for k2, v2 in v1.items():
-                # the str.replace is necessary because to_csv adds decimals to the values
-                collect.append([str(k2).replace('.0', ''), v2, k1])
-        value_labels = pd.DataFrame(collect).\
-            rename(columns={0: 'value_label', 1: 'value', 2: 'value_label_id'})
-        # final codebook contains variable labels and value labels
-        print('variable_labels has columns {}'.format(variable_labels.columns))
-        print('value_labels has columns {}'.format(value_labels.columns))
-        print('merge variable_labels and value_labels on value_label_id')
-        codebook = pd.merge(variable_labels_with_id, value_labels, how='left',
-                            left_on='value_label_id',
-                            right_on='value_label_id').fillna('').drop('value_label_id', axis=1)
-        print('codebook has columns {}'.format(codebook.columns))           
-
-    data_filename = file_name + '.csv'
-    codebook_filename = file_name + '_codebook.csv'
-    data.to_csv(data_filename, index=False, sep=';')
-    codebook.to_csv(codebook_filename, index=False, sep=';')
+
+def row_size(metadata):
+    """estimate the number of bytes of one row in a DataFrame, from the metadata"""
+    size = 0
+    for name in metadata.column_names:
+        if metadata.readstat_variable_types.get(name) == 'string':
+            size += STRING_OVERHEAD + metadata.variable_storage_width.get(name, 8)
+        else:
+            size += 8
+    return max(size, 1)
+
+def chunk_rows(metadata, chunk_size=None, max_memory=DEFAULT_MAX_MEMORY):
+    """return the number of rows per chunk: `chunk_size`, but no more than fit in
+    `max_memory` MB"""
+    ceiling = max(1, (max_memory << 20) // (row_size(metadata) * CSV_FACTOR))
+    return min(chunk_size, ceiling) if chunk_size else ceiling
+
+def format_values(values, numeric):
+    """format the values of value labels like the values in the data: whole numbers
+    without decimals, other numbers in their shortest form, strings as they are;
+    `numeric` is a boolean array that tells which values are numbers"""
+    result = np.array(values, dtype=object)
+    if numeric.any():
+        positions = np.flatnonzero(numeric)
+        numbers = result[positions].astype(float)
+        whole = np.isfinite(numbers) & (numbers == np.trunc(numbers)) & (np.abs(numbers) < 2**53)
+        result[positions[whole]] = numbers[whole].astype(np.int64).astype(str).astype(object)
+        result[positions[~whole]] = numbers[~whole].astype(str).astype(object)
+    return result
+
+def value_table(value_labels):
+    """return a DataFrame with the value labels of all label sets in the dict
+    `value_labels` {label set: {value: label}}, in columns 'value_label' (the value),
+    'value' (its label) and 'value_label_id' (the label set)"""
+    label_sets = list(value_labels.values())
+    lengths = np.fromiter(map(len, label_sets), dtype=np.int64, count=len(label_sets))
+    values = list(chain.from_iterable(label_sets))
+    # per value: a label set can mix numbers and strings, e.g. SAS special missing values
+    is_numeric = np.fromiter((isinstance(value, (int, float)) for value in values),
+                             dtype=bool, count=len(values))
+    labels = list(chain.from_iterable(labels.values() for labels in label_sets))
+    return pd.DataFrame({
+        'value_label': format_values(values, is_numeric),
+        'value': labels,
+        'value_label_id': np.repeat(np.array(list(value_labels.keys()), dtype=object), lengths)
+    })
+
+def codebook_chunks(metadata, chunk_variables=CODEBOOK_CHUNK):
+    """generate the codebook, with the variable labels and value labels in `metadata`, as
+    DataFrames for `chunk_variables` variables at a time: a label set can be shared by
+    many variables, so the whole codebook can be much larger than the metadata"""
+    names = list(metadata.column_names_to_labels.keys())
+    with_values = len(metadata.value_labels) > 0
+    if with_values:
+        # every variable gets the rows of its label set, or one row without value label
+        values = value_table(metadata.value_labels)
+        value_column = np.append(values['value_label'].to_numpy(dtype=object), '')
+        label_column = np.append(values['value'].to_numpy(dtype=object), '')
+        set_number = {label_set: k for k, label_set in enumerate(metadata.value_labels)}
+        lengths = np.fromiter(map(len, metadata.value_labels.values()), dtype=np.int64,
+                              count=len(set_number))
+        starts = np.cumsum(lengths) - lengths
+    for start in range(0, max(len(names), 1), chunk_variables):
+        part = names[start:start + chunk_variables]
+        variable_labels = [metadata.column_names_to_labels[name] for name in part]
+        if not with_values: # no value labels, so codebook is very simple
+            yield pd.DataFrame({'variable_name': part, 'variable_label': variable_labels})
+            continue
+        sets = np.array([set_number.get(metadata.variable_to_label.get(name), -1) for name in part],
+                        dtype=np.int64)
+        labelled = sets >= 0
+        counts = np.where(labelled, lengths[sets], 0)
+        rows = np.maximum(counts, 1)
+        variable_rows = np.repeat(np.arange(len(part)), rows)
+        offsets = np.arange(rows.sum()) - np.repeat(np.cumsum(rows) - rows, rows)
+        # index of the value label of every row, or the index of the final '' if there is none
+        label_rows = np.where(np.repeat(counts, rows) > 0,
+                              np.repeat(np.where(labelled, starts[sets], 0), rows) + offsets, -1)
+        yield pd.DataFrame({
+            'variable_name': np.array(part, dtype=object)[variable_rows],
+            'variable_label': pd.Series(variable_labels, dtype=object).fillna('').to_numpy()[variable_rows],
+            'value_label': value_column[label_rows],
+            'value': label_column[label_rows]})
+
+def make_codebook(metadata):
+    """return a DataFrame with the variable labels and value labels in `metadata`"""
+    return pd.concat(list(codebook_chunks(metadata)), ignore_index=True)
+
+def arcname(path):
+    """name of `path` in the zip file, as ZipFile.write would store it"""
+    return splitdrive(path)[1].lstrip('/\\')
+
+def stat_to_csv(fname, fextension, chunk_size=None, max_memory=DEFAULT_MAX_MEMORY,
+                num_processes=1):
+    """convert SPSS .sav or SAS .sas7bdat files to csv, also creates a codebook csv file;
+    with `num_processes` > 1, every chunk is read by that number of processes.
+    Return the number of rows."""
+    file_path = fname+fextension
+    file_name = fname
+    read = read_function(fextension)
+    # retrieve metadata from SPSS or SAS file, then the data in chunks
+    _, metadata = read(file_path, metadataonly=True)
+    rows = chunk_rows(metadata, chunk_size, max_memory)
+    total = 0
     zip_filename = file_name + '.zip'
-    with ZipFile(zip_filename, 'w') as zip_file:
-        zip_file.write(data_filename)
-        zip_file.write(codebook_filename)
+    try:
+        with ZipFile(zip_filename, 'w', ZIP_DEFLATED) as zip_file:
+            info = ZipInfo(arcname(file_name + '.csv'), date_time=time.localtime()[:6])
+            info.compress_type = ZIP_DEFLATED
+            with zip_file.open(info, 'w', force_zip64=True) as entry:
+                text = io.TextIOWrapper(entry, encoding='utf-8', newline='')
+                chunks = pyreadstat.read_file_in_chunks(read, file_path, chunksize=rows,
+                                                        multiprocess=num_processes > 1,
+                                                        num_processes=max(num_processes, 1))
+                for data, _ in chunks:
+                    data.to_csv(text, index=False, sep=';', header=(total == 0))
+                    total += len(data)
+                if total == 0:  # no rows: only the header
+                    pd.DataFrame(columns=metadata.column_names).to_csv(text, index=False, sep=';')
+                text.flush()
+                text.detach()
+            info = ZipInfo(arcname(file_name + '_codebook.csv'), date_time=time.localtime()[:6])
+            info.compress_type = ZIP_DEFLATED
+            with zip_file.open(info, 'w', force_zip64=True) as entry:
+                text = io.TextIOWrapper(entry, encoding='utf-8', newline='')
+                for number, codebook in enumerate(codebook_chunks(metadata)):
+                    codebook.to_csv(text, index=False, sep=';', header=(number == 0))
+                text.flush()
+                text.detach()
+    except BaseException:
+        if exists(zip_filename):  # do not leave a partial zip file that looks up to date
+            os.remove(zip_filename)
+        raise
+    return total
 
-known_extensions = {
-    '.sav'     : 'SPSS',
-    '.sas7bdat': 'SAS'
-}
-fname, fextension = splitext(abspath(sys.argv[1]))
-if fextension in known_extensions.keys():
+def find_files(patterns):
+    """return the statistics files in `patterns`: files, directories or glob patterns"""
+    result = []
+    for pattern in patterns:
+        for path in sorted(glob.glob(pattern, recursive=True)) or [pattern]:
+            if isdir(path):
+                for dirpath, _, filenames in os.walk(path):
+                    result.extend(join(dirpath, name) for name in sorted(filenames)
+                                  if splitext(name)[1] in known_extensions)
+            else:
+                result.append(path)
+    return list(dict.fromkeys(abspath(path) for path in result))
+
+def up_to_date(path):
+    """True if the zip file of `path` is newer than `path`"""
+    zip_filename = splitext(path)[0] + '.zip'
+    return exists(zip_filename) and getmtime(zip_filename) >= getmtime(path)
+
+def convert(path, chunk_size=None, max_memory=DEFAULT_MAX_MEMORY, num_processes=1):
+    """convert one file; return (path, number of rows, seconds, error message)"""
+    start = time.monotonic()
+    fname, fextension = splitext(path)
     try:
-        stat_to_csv(fname, fextension)
+        rows = stat_to_csv(fname, fextension, chunk_size, max_memory, num_processes)
+        return path, rows, time.monotonic() - start, None
     except Exception as e:
-        print(f"could not convert due to {e}")
-else:
-    print(f"unknown extension {fextension}")
+        return path, 0, time.monotonic() - start, str(e)
+
+def print_summary(results):
+    print(f"{'rows':>12} {'seconds':>9} {'rows/s':>10}  file")
+    for path, rows, seconds, error in results:
+        if error:
+            print(f"{'':>12} {seconds:9.1f} {'':>10}  {path}: could not convert due to {error}")
+        else:
+            print(f"{rows:12} {seconds:9.1f} {rows / max(seconds, 1e-9):10.0f}  {path}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('files', nargs='+', help='SPSS (.sav) or SAS (.sas7bdat) files, directories or glob patterns')
+    parser.add_argument('--chunk-size', type=int, help='number of rows per chunk')
+    parser.add_argument('--max-memory', type=int, default=DEFAULT_MAX_MEMORY,
+                        help=f'MB of memory for a chunk of rows (default {DEFAULT_MAX_MEMORY})')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count(),
+                        help='number of processes (default: number of cores)')
+    parser.add_argument('--split-above', type=int, default=DEFAULT_SPLIT_ABOVE,
+                        help=f'MB above which a file is read by all processes (default {DEFAULT_SPLIT_ABOVE})')
+    parser.add_argument('--force', action='store_true', help='also convert files that are up to date')
+    args = parser.parse_args()
+    small, large = [], []
+    for path in find_files(args.files):
+        if splitext(path)[1] not in known_extensions:
+            print(f"unknown extension {splitext(path)[1]} of {path}")
+        elif not exists(path):
+            print(f"file {path} does not exist")
+        elif not args.force and up_to_date(path):
+            print(f"skip {path}: zip file is up to date")
+        elif getsize(path) > args.split_above << 20:
+            large.append(path)
+        else:
+            small.append(path)
+    results = []
+    # small files in parallel, one process each
+    if len(small) == 1 or args.jobs <= 1:
+        results.extend(convert(path, args.chunk_size, args.max_memory) for path in small)
+    elif small:
+        with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+            futures = [executor.submit(convert, path, args.chunk_size, args.max_memory) for path in small]
+            results.extend(future.result() for future in as_completed(futures))
+    # large files one at a time, each read by all processes
+    results.extend(convert(path, args.chunk_size, args.max_memory, args.jobs) for path in large)
+    if results:
+        print_summary(results)
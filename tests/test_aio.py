@@ -0,0 +1,111 @@
+"""Tests of dave.aio.AsyncApi against the mock server (bench/mockserver.py), and of the
+blocking Api next to it"""
+
+import hashlib, os, tempfile, unittest
+from bench.mockserver import Faults, Tree, running
+from dave import Api
+from dave.scheduler import get_scheduler
+try:
+    import aiohttp
+    from dave.aio import AsyncApi
+except ImportError:  # optional dependency
+    aiohttp = None
+
+@unittest.skipIf(aiohttp is None, 'aiohttp is not installed')
+class AsyncApiTest(unittest.IsolatedAsyncioTestCase):
+    def faults(self):
+        return None
+
+    def setUp(self):
+        # dv0 with sub-dataverse dv1, dv2 with dv3; 12 datasets of 2 files
+        self.tree = Tree(dataverses=4, datasets=12, files=2, depth=2)
+        context = running(self.tree, self.faults())
+        self.server = context.__enter__()
+        self.addCleanup(context.__exit__, None, None, None)
+        # every server has its own port, so its own scheduler
+        self.scheduler = get_scheduler(self.server.url)
+        self.scheduler.configure(rate=1000, min_rate=100, backoff=0.01, max_retries=10)
+
+    async def test_methods(self):
+        api = Api(self.server.url, 'key')
+        async with AsyncApi(self.server.url, 'key') as aapi:
+            self.assertEqual(await aapi.dataverse_view('dv0'), api.dataverse_view('dv0'))
+            self.assertEqual(await aapi.dataverse_contents('dv0'), api.dataverse_contents('dv0'))
+            dsid = next(iter(self.tree.datasets))
+            self.assertEqual(await aapi.dataset_versions(dsid), api.dataset_versions(dsid))
+            self.assertEqual(await aapi.dataset_version(dsid, exclude_files=True),
+                             api.dataset_version(dsid, exclude_files=True))
+            missing = await aapi.dataverse_view('missing')
+            self.assertEqual(missing['status'], 'ERROR')  # an error dict, as Api returns it
+
+    async def test_crawl_and_versions(self):
+        async with AsyncApi(self.server.url, 'key', limit=4) as api:
+            found = [(alias, dataset['id'], versions[0]['versionState'])
+                     async for alias, dataset, versions in api.versions(api.crawl('root'))]
+        self.assertEqual(sorted(dsid for _, dsid, _ in found), sorted(self.tree.datasets))
+        for alias, dsid, state in found:
+            dataset = self.tree.datasets[dsid]
+            self.assertEqual(self.tree.dataverses[dataset['owner']]['alias'], alias)
+            self.assertEqual(dataset['state'], state)
+
+    async def test_search(self):
+        async with AsyncApi(self.server.url, 'key') as api:
+            items = [item async for item in api.search(types=('dataset',), subtree='dv0', per_page=2)]
+        below = [dsid for dvid in self.tree.subtree(self.tree.dataverse('dv0'))
+                 for dsid in self.tree.dataverses[dvid]['datasets']]
+        self.assertEqual(sorted(item['entity_id'] for item in items), sorted(below))
+        self.assertEqual(self.server.stats['GET /search'], 3)  # 2 + 2 + 2
+
+    async def test_add_file(self):
+        dsid = next(iter(self.tree.datasets))
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'data.csv')
+            content = b'a;b\n' * 10000
+            with open(path, 'wb') as f:
+                f.write(content)
+            async with AsyncApi(self.server.url, 'key') as api:
+                result = await api.dataset_add_file(dsid, path, {'directoryLabel': 'upload'}, chunk_size=4096)
+        self.assertEqual(result['files'][0]['dataFile']['md5'], hashlib.md5(content).hexdigest())
+        self.assertEqual(self.tree.datasets[dsid]['files'][-1]['directoryLabel'], 'upload')
+
+@unittest.skipIf(aiohttp is None, 'aiohttp is not installed')
+class AsyncRetryTest(AsyncApiTest):
+    """the same tests, with a third of the requests failing with 503: every failure is retried"""
+    def faults(self):
+        return Faults(error_rate=0.3, error_status=503, seed=1)
+
+    def tearDown(self):
+        self.assertEqual(self.scheduler.retries, self.server.stats.get('failed', 0))
+        self.assertEqual(self.scheduler.throttled, self.scheduler.retries)
+
+    async def test_crawl_and_versions(self):
+        await super().test_crawl_and_versions()
+        self.assertGreater(self.scheduler.retries, 0)
+
+    async def test_search(self):
+        async with AsyncApi(self.server.url, 'key') as api:
+            items = [item async for item in api.search(types=('dataset',), per_page=2)]
+        self.assertEqual(sorted(item['entity_id'] for item in items), sorted(self.tree.datasets))
+
+@unittest.skipIf(aiohttp is None, 'aiohttp is not installed')
+class SharedSchedulerTest(unittest.IsolatedAsyncioTestCase):
+    async def test_throttling_is_shared(self):
+        tree = Tree(dataverses=2, datasets=4, files=1)
+        faults = Faults(error_rate=0.5, error_status=429, seed=2)
+        with running(tree, faults) as server:
+            scheduler = get_scheduler(server.url)
+            scheduler.configure(rate=1000, min_rate=100, backoff=0.01, max_retries=20)
+            api, aapi = Api(server.url, 'key'), AsyncApi(server.url, 'key')
+            self.assertIs(api.scheduler, aapi.scheduler)
+            async with aapi:
+                views = [await aapi.dataverse_view(alias) for alias in ('root', 'dv0', 'dv1')]
+            throttled = scheduler.throttled
+            self.assertGreater(throttled, 0)
+            self.assertLess(scheduler.rate, 1000)
+            # the blocking Api keeps working, through the same scheduler
+            self.assertEqual([api.dataverse_view(alias) for alias in ('root', 'dv0', 'dv1')], views)
+            self.assertGreater(scheduler.throttled, throttled)
+            self.assertEqual(server.stats['failed'], scheduler.throttled)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+"""Tests of the bulk creation of datasets from a manifest (dave.bulk)"""
+
+import os, tempfile, unittest
+from requests import ConnectionError
+from dave.bulk import DatasetTemplate, IdMap, create_datasets
+from dave.common import DataverseError
+
+TEMPLATE = DatasetTemplate('{"datasetVersion": {"metadataBlocks": {"citation": {"fields": ['
+                           '{"typeName": "title", "value": "$title"}, '
+                           '{"typeName": "author", "value": "$authorname"}]}}}}')
+
+class FakeApi:
+    """creates datasets with ids from 100 on; the titles in `unreachable` raise ConnectionError"""
+    def __init__(self, unreachable=()):
+        self.unreachable = unreachable
+        self.created = []
+
+    def dataset_create(self, dataverse_id, props):
+        title = props['datasetVersion']['metadataBlocks']['citation']['fields'][0]['value']
+        if title in self.unreachable:
+            raise ConnectionError('Connection aborted.')
+        self.created.append(title)
+        return {'id': 99 + len(self.created), 'persistentId': f"doi:10.5072/FK2/{len(self.created)}"}
+
+    def dataset_publish(self, persistent_id):
+        return {'status': 'OK'}
+
+class RenderTest(unittest.TestCase):
+    def test_render(self):
+        metadata = TEMPLATE.render({'title': 'A "quoted"\ntitle', 'authorname': ''})
+        fields = metadata['datasetVersion']['metadataBlocks']['citation']['fields']
+        self.assertEqual([field['value'] for field in fields], ['A "quoted"\ntitle', ''])
+
+    def test_missing_field(self):
+        with self.assertRaises(DataverseError) as context:
+            TEMPLATE.render({'title': 'Title'})
+        self.assertIn('authorname', str(context.exception))
+
+class CreateTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'ids.jsonl')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_network_error_fails_one_record(self):
+        records = [{'key': f"k{n}", 'dataverse': 'dv', 'title': f"T{n}", 'authorname': 'A'} for n in range(4)]
+        api = FakeApi(unreachable=('T2',))
+        with IdMap(self.path) as id_map:
+            results = {key: (status, entry) for key, status, entry in
+                       create_datasets(api, records, TEMPLATE, id_map, jobs=2, publish=True)}
+        self.assertEqual(results['k2'][0], 'failed')
+        self.assertIn('Connection aborted', results['k2'][1])
+        self.assertEqual(sorted(key for key, (status, _) in results.items() if status == 'published'),
+                         ['k0', 'k1', 'k3'])
+        with IdMap(self.path) as id_map:
+            self.assertEqual(sorted(id_map.entries), ['k0', 'k1', 'k3'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+"""Tests of the response cache of Api (dave.cache) against the mock server (bench/mockserver.py)"""
+
+import unittest
+from bench.mockserver import AUTHORITY, Tree, running
+from dave import Api
+from dave.cache import ResponseCache
+from dave.scheduler import get_scheduler
+
+class CacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tree = Tree(dataverses=1, datasets=2, files=1)
+        context = running(self.tree)
+        self.server = context.__enter__()
+        self.addCleanup(context.__exit__, None, None, None)
+        get_scheduler(self.server.url).configure(rate=1000)
+        self.cache = ResponseCache()
+        self.api = Api(self.server.url, 'key', cache=self.cache)
+        self.draft = next(dsid for dsid, dataset in self.tree.datasets.items() if dataset['state'] == 'DRAFT')
+        self.pid = f"doi:{AUTHORITY}/{self.tree.datasets[self.draft]['identifier']}"
+
+    def requests(self, route):
+        return self.server.stats.get(route, 0)
+
+    def test_hit(self):
+        self.api.dataverse_view('dv0')
+        self.api.dataverse_view('dv0')
+        self.assertEqual(self.requests('GET /dataverses/([^/]+)'), 1)
+        self.assertEqual(self.cache.summary()['hits'], 1)
+
+    def test_write_by_alias_invalidates_id(self):
+        dvid = self.tree.aliases['dv0']
+        self.api.dataverse_view(dvid)
+        self.api.dataverse_publish('dv0')
+        self.api.dataverse_view(dvid)
+        self.assertEqual(self.requests('GET /dataverses/([^/]+)'), 2)
+
+    def test_publish_by_persistent_id(self):
+        self.assertEqual(self.api.dataset_versions(self.draft)[0]['versionState'], 'DRAFT')
+        self.api.dataset_publish(self.pid)
+        self.assertEqual(self.api.dataset_versions(self.draft)[0]['versionState'], 'RELEASED')
+        self.assertEqual(self.requests(r'GET /datasets/(\d+|:persistentId)/versions'), 2)
+
+    def test_publish_of_unknown_persistent_id(self):
+        other = next(dsid for dsid in self.tree.datasets if dsid != self.draft)
+        self.api.dataverse_view('dv0')
+        self.api.dataset_version(other)  # not the dataset that is published
+        self.api.dataset_publish(self.pid)
+        # the dataset id of the persistent id is not known, so every dataset is dropped
+        self.assertEqual(self.cache.summary()['entries'], 1)
+        self.api.dataverse_view('dv0')
+        self.assertEqual(self.cache.summary()['hits'], 1)
+
+    def test_publish_keeps_other_datasets(self):
+        other = next(dsid for dsid in self.tree.datasets if dsid != self.draft)
+        self.api.dataset_versions(self.draft)
+        self.api.dataset_versions(other)
+        self.api.dataset_publish(self.pid)
+        self.api.dataset_versions(other)
+        self.assertEqual(self.cache.summary()['hits'], 1)
+
+if __name__ == '__main__':
+    unittest.main()
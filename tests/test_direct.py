@@ -0,0 +1,121 @@
+"""Tests of direct upload to the store of a dataset (dave.direct), against the S3
+stand-in of the mock server (bench/mockserver.py)"""
+
+import hashlib, os, tempfile, unittest
+from unittest import mock
+from bench.mockserver import ROUTES, Faults, Store, Tree, running
+from dave import Connection, DataverseError
+from dave.direct import DirectUploadUnavailable, file_entry, register_files, upload_to_store, upload_urls
+from dave.scheduler import get_scheduler
+
+PART_SIZE = 64 * 1024
+S3_PUT = next(methods for pattern, methods in ROUTES if pattern.startswith('/s3/'))
+
+def failing_put(parts, status=500):
+    """PUT of the S3 stand-in that answers `status` for the part numbers in `parts`, a dict
+    {part number: number of failures}, or always for a failure count of None"""
+    put = S3_PUT['PUT']
+    def handler(handler, tree, query, body, key):
+        number = int(query.get('partNumber', ['0'])[0])
+        if number in parts and (parts[number] is None or parts[number] > 0):
+            if parts[number] is not None:
+                parts[number] -= 1
+            return handler.reply(status, message='InternalError')
+        return put(handler, tree, query, body, key)
+    return handler
+
+class DirectUploadTest(unittest.TestCase):
+    def setUp(self):
+        self.tree = Tree(dataverses=1, datasets=1, files=0, store=Store(PART_SIZE))
+        self.dataset_id = next(iter(self.tree.datasets))
+        self.faults = Faults()
+        context = running(self.tree, self.faults)
+        self.server = context.__enter__()
+        self.addCleanup(context.__exit__, None, None, None)
+        get_scheduler(self.server.url).configure(rate=1000, min_rate=100, backoff=0.01, max_retries=2)
+        self.connection = Connection(self.server.url, 'key')
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def make_file(self, size):
+        path = os.path.join(self.directory.name, f"data{size}.bin")
+        content = os.urandom(size)
+        with open(path, 'wb') as f:
+            f.write(content)
+        return path, hashlib.md5(content).hexdigest()
+
+    def stored(self, storage_identifier):
+        return self.tree.store.objects.get(storage_identifier.rpartition(':')[2])
+
+    def test_single_part(self):
+        path, md5 = self.make_file(PART_SIZE // 2)
+        identifier = upload_to_store(self.connection, self.dataset_id, path)
+        self.assertEqual(self.stored(identifier), (PART_SIZE // 2, md5))
+
+    def test_parts(self):
+        path, md5 = self.make_file(4 * PART_SIZE + 100)
+        sent = []
+        identifier = upload_to_store(self.connection, self.dataset_id, path, jobs=3,
+                                     progress=lambda done, total: sent.append(done), chunk_size=8192)
+        self.assertEqual(self.stored(identifier), (4 * PART_SIZE + 100, md5))
+        self.assertEqual(self.server.stats['PUT /s3/mockbucket/([^/]+)'], 5)
+        self.assertEqual(max(sent), 4 * PART_SIZE + 100)
+        self.assertEqual(self.tree.store.uploads, {})
+
+    def test_part_is_retried(self):
+        path, md5 = self.make_file(3 * PART_SIZE)
+        with mock.patch.dict(S3_PUT, PUT=failing_put({2: 2})):
+            identifier = upload_to_store(self.connection, self.dataset_id, path)
+        self.assertEqual(self.stored(identifier), (3 * PART_SIZE, md5))
+        self.assertEqual(self.server.stats['PUT /s3/mockbucket/([^/]+)'], 5)  # part 2 three times
+
+    def test_failed_part_aborts(self):
+        path, _ = self.make_file(3 * PART_SIZE)
+        with mock.patch.dict(S3_PUT, PUT=failing_put({3: None})):
+            with self.assertRaises(DataverseError) as context:
+                upload_to_store(self.connection, self.dataset_id, path)
+        self.assertIn('HTTP error 500', str(context.exception))
+        self.assertEqual(self.server.stats['DELETE /datasets/mpupload'], 1)
+        self.assertEqual(self.tree.store.uploads, {})  # the parts are removed
+        self.assertEqual(self.tree.store.objects, {})
+
+    def test_refused_part_is_not_retried(self):
+        path, _ = self.make_file(2 * PART_SIZE)
+        with mock.patch.dict(S3_PUT, PUT=failing_put({1: None}, status=403)):
+            with self.assertRaises(DataverseError):
+                upload_to_store(self.connection, self.dataset_id, path)
+        self.assertEqual(self.server.stats['PUT /s3/mockbucket/([^/]+)'], 2)  # once each part
+        self.assertEqual(self.server.stats['DELETE /datasets/mpupload'], 1)
+
+    def test_register_with_checksum(self):
+        path, md5 = self.make_file(2 * PART_SIZE)
+        identifier = upload_to_store(self.connection, self.dataset_id, path)
+        files = register_files(self.connection, self.dataset_id,
+                               [file_entry(path, identifier, ('md5', md5), {'directoryLabel': 'raw'})])
+        self.assertEqual(files[0]['dataFile']['md5'], md5)
+        self.assertEqual(self.tree.datasets[self.dataset_id]['files'][0]['directoryLabel'], 'raw')
+
+    def test_register_with_wrong_checksum(self):
+        path, _ = self.make_file(PART_SIZE)
+        identifier = upload_to_store(self.connection, self.dataset_id, path)
+        with self.assertRaises(DataverseError) as context:
+            register_files(self.connection, self.dataset_id,
+                           [file_entry(path, identifier, ('MD5', '0' * 32), {})])
+        self.assertIn('does not match', str(context.exception))
+        self.assertEqual(self.tree.datasets[self.dataset_id]['files'], [])
+
+    def test_store_without_direct_upload(self):
+        self.tree.store = None
+        with self.assertRaises(DirectUploadUnavailable):
+            upload_urls(self.connection, self.dataset_id, 100)
+
+    def test_upload_urls_errors(self):
+        self.faults.error_rate = 1.0
+        for status in (401, 429, 503):
+            self.faults.error_status = status
+            with self.assertRaises(DataverseError) as context:
+                upload_urls(self.connection, self.dataset_id, 100)
+            self.assertNotIsInstance(context.exception, DirectUploadUnavailable)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,172 @@
+"""Tests of dave.inventory with an in-memory stand-in for dave.Api"""
+
+import os, tempfile, unittest
+from dave.common import DataverseError
+from dave.inventory import Inventory, VersionCache, current_version, summarize
+
+def version(number, state, updated, files=()):
+    result = {'versionState': state, 'lastUpdateTime': updated, 'datasetPersistentId': 'doi:10.5072/FK2/ABC',
+              'metadataBlocks': {'citation': {'fields': [
+                  {'typeName': 'title', 'value': 'Dataset'},
+                  {'typeName': 'author', 'value': [{'authorName': {'value': 'Author'}}]}]}},
+              'files': [{'label': label, 'dataFile': {'id': fid, 'filesize': size, 'contentType': 'text/csv',
+                                                      'md5': 'x'}} for fid, label, size in files]}
+    if number is not None:
+        result['versionNumber'], result['versionMinorNumber'] = number
+    return result
+
+ERROR = {'status': 'ERROR', 'message': 'Internal server error'}  # what Api returns for a failure
+
+class FakeApi:
+    """dataset_versions and dataset_version(':latest') of a fixed set of datasets, and the
+    views, contents, groups and roles of a tree of dataverses; `requests` counts the calls
+    per method, and `failing` holds the (method, dataverse id) calls that return ERROR"""
+    def __init__(self, datasets, dataverses=None):
+        self.datasets = datasets
+        self.dataverses = dataverses or {}
+        self.requests = {}
+        self.failing = set()
+
+    def dataverse(self, dataverse_id):
+        return next(elt for elt in self.dataverses.values()
+                    if dataverse_id in (elt['view']['id'], elt['view']['alias']))
+
+    def dataverse_view(self, dataverse_id):
+        self.count('dataverse_view')
+        dataverse = self.dataverse(dataverse_id)
+        return ERROR if ('view', dataverse['view']['id']) in self.failing else dataverse['view']
+
+    def dataverse_contents(self, dataverse_id):
+        self.count('dataverse_contents')
+        dataverse = self.dataverse(dataverse_id)
+        return ERROR if ('contents', dataverse['view']['id']) in self.failing else dataverse['contents']
+
+    def dataverse_groups(self, dataverse_id):
+        return []
+
+    def dataverse_roles(self, dataverse_id):
+        return []
+
+    def count(self, name):
+        self.requests[name] = self.requests.get(name, 0) + 1
+
+    def dataset_versions(self, dataset_id):
+        self.count('dataset_versions')
+        return self.datasets[dataset_id]
+
+    def dataset_version(self, dataset_id, version=':latest', exclude_files=False):
+        self.count('dataset_version')
+        latest = current_version(self.datasets[dataset_id])
+        return {key: value for key, value in latest.items() if key != 'files' or not exclude_files}
+
+DRAFT_OVER_RELEASE = [version(None, 'DRAFT', '2024-02-01T00:00:00Z', [(3, 'b.csv', 20)]),
+                      version((1, 0), 'RELEASED', '2024-01-01T00:00:00Z', [(2, 'a.csv', 10)])]
+
+class VersionCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'versions.sqlite')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_current_version_is_the_draft(self):
+        self.assertEqual(current_version(DRAFT_OVER_RELEASE)['versionState'], 'DRAFT')
+        self.assertEqual(current_version(DRAFT_OVER_RELEASE[1:])['versionState'], 'RELEASED')
+
+    def test_stamp_matches_latest(self):
+        summary = summarize(DRAFT_OVER_RELEASE)
+        self.assertEqual(summary['stamp'], '2024-02-01T00:00:00Z|DRAFT')
+        self.assertEqual(summary['files'], [['a.csv', 10, 'text/csv']])  # the report shows the latest release
+
+    def test_draft_over_release_is_cached(self):
+        api = FakeApi({1: DRAFT_OVER_RELEASE})
+        with VersionCache(self.path, 'http://test') as cache:
+            first = cache.summary(api, 1)
+            second = cache.summary(api, 1)
+            self.assertEqual(first, second)
+            self.assertEqual((cache.hits, cache.misses), (1, 1))
+        self.assertEqual(api.requests['dataset_versions'], 1)
+
+    def test_changed_draft_is_fetched_again(self):
+        api = FakeApi({1: list(DRAFT_OVER_RELEASE)})
+        with VersionCache(self.path, 'http://test') as cache:
+            cache.summary(api, 1)
+            api.datasets[1][0] = version(None, 'DRAFT', '2024-03-01T00:00:00Z')
+            cache.summary(api, 1)
+            self.assertEqual((cache.hits, cache.misses), (0, 2))
+        self.assertEqual(api.requests['dataset_versions'], 2)
+
+    def test_failed_versions_raise(self):
+        api = FakeApi({1: ERROR})
+        with VersionCache(self.path, 'http://test') as cache:
+            with self.assertRaises(DataverseError):
+                cache.summary(api, 1, incremental=False)
+            self.assertIsNone(cache.get(1, '2024-02-01T00:00:00Z|DRAFT'))
+
+def tree():
+    """root (1) with sub-dataverse sub (2); dataset 10 in root, dataset 20 (a draft over a
+    release) in sub"""
+    dataverses = {
+        1: {'view': {'id': 1, 'alias': 'root', 'name': 'Root'},
+            'contents': [{'type': 'dataverse', 'id': 2}, {'type': 'dataset', 'id': 10}]},
+        2: {'view': {'id': 2, 'alias': 'sub', 'name': 'Sub', 'ownerId': 1},
+            'contents': [{'type': 'dataset', 'id': 20}]}}
+    datasets = {10: [version((1, 0), 'RELEASED', '2024-01-01T00:00:00Z', [(11, 'a.csv', 100)])],
+                20: DRAFT_OVER_RELEASE}
+    return FakeApi(datasets, dataverses)
+
+class InventoryTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.inventory = Inventory(os.path.join(self.directory.name, 'inventory.sqlite'), 'http://test')
+
+    def tearDown(self):
+        self.inventory.close()
+        self.directory.cleanup()
+
+    def test_sync(self):
+        counts = self.inventory.sync(tree(), 'root', jobs=2)
+        self.assertEqual((counts['dataverses'], counts['updated'], counts['errors']), (2, 2, 0))
+        rollup = {row['dataverse']: row for row in self.inventory.rollup(1)}
+        self.assertEqual((rollup['root']['size'], rollup['sub']['size']), (100, 20))
+
+    def test_draft_over_release(self):
+        api = tree()
+        self.inventory.sync(api, 'root', jobs=2)
+        counts = self.inventory.sync(api, 'root', jobs=2)
+        self.assertEqual((counts['updated'], counts['unchanged']), (0, 2))
+        drafts = self.inventory.datasets(1, state='draft')
+        self.assertEqual([(row['id'], row['files'], row['size']) for row in drafts], [(20, 1, 20)])
+        self.assertEqual([row['label'] for row in self.inventory.files(20)], ['b.csv'])
+
+    def test_failed_listing_keeps_subtree(self):
+        api = tree()
+        self.inventory.sync(api, 'root', jobs=2)
+        api.failing.add(('contents', 2))
+        counts = self.inventory.sync(api, 'root', jobs=2)
+        self.assertEqual((counts['errors'], counts['removed']), (1, 0))
+        self.assertEqual(sorted(row['id'] for row in self.inventory.datasets(1)), [10, 20])
+
+    def test_failed_view_keeps_dataverse(self):
+        api = tree()
+        self.inventory.sync(api, 'root', jobs=2)
+        api.failing.add(('view', 2))
+        api.datasets[20] = [version(None, 'DRAFT', '2024-03-01T00:00:00Z', [(4, 'c.csv', 30)])] + api.datasets[20][1:]
+        counts = self.inventory.sync(api, 'root', jobs=2)
+        self.assertEqual(counts['removed'], 0)
+        self.assertGreater(counts['errors'], 0)
+        self.assertEqual(self.inventory.resolve('sub'), 2)
+        self.assertEqual(sorted(row['id'] for row in self.inventory.datasets(1)), [10, 20])
+        self.assertEqual([row['id'] for row in self.inventory.datasets(2)], [20])
+
+    def test_deleted_dataset_is_removed(self):
+        api = tree()
+        self.inventory.sync(api, 'root', jobs=2)
+        api.dataverses[2]['contents'] = []
+        counts = self.inventory.sync(api, 'root', jobs=2)
+        self.assertEqual((counts['errors'], counts['removed']), (0, 1))
+        self.assertEqual([row['id'] for row in self.inventory.datasets(1)], [10])
+
+if __name__ == '__main__':
+    unittest.main()
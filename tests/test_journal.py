@@ -0,0 +1,43 @@
+"""Tests of the upload journal of dvupload (dave.journal)"""
+
+import os, tempfile, unittest
+from dave.journal import Journal
+
+class JournalTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'upload.jsonl')
+        self.data = os.path.join(self.directory.name, 'data.csv')
+        with open(self.data, 'w') as f:
+            f.write('a,b\n1,2\n')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_uploaded_file_is_skipped(self):
+        with Journal(self.path) as journal:
+            journal.record_file('FILE1', self.data, 'OK')
+        with Journal(self.path) as journal:
+            self.assertTrue(journal.uploaded('FILE1', self.data))
+
+    def test_moved_file_is_not_uploaded(self):
+        with Journal(self.path) as journal:
+            journal.record_file('FILE1', self.data, 'OK')
+        os.rename(self.data, self.data + '.moved')
+        with Journal(self.path) as journal:
+            self.assertFalse(journal.uploaded('FILE1', self.data))
+
+    def test_failure_of_missing_file(self):
+        missing = os.path.join(self.directory.name, 'missing.csv')
+        with Journal(self.path) as journal:
+            journal.record_file('FILE1', missing, 'FAILED', message='No such file')
+            with self.assertRaises(OSError):
+                journal.record_file('FILE2', missing, 'OK')
+        with Journal(self.path) as journal:
+            self.assertEqual(journal.files['FILE1']['status'], 'FAILED')
+            self.assertIsNone(journal.files['FILE1']['size'])
+            self.assertNotIn('FILE2', journal.files)
+            self.assertFalse(journal.uploaded('FILE1', missing))
+
+if __name__ == '__main__':
+    unittest.main()
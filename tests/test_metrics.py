@@ -0,0 +1,65 @@
+"""Tests of the request metrics (dave.metrics)"""
+
+import argparse, os, tempfile, unittest
+from bench.mockserver import Tree, running
+from dave import Api, Connection
+from dave.metrics import Metrics, add_hook, add_metrics_arguments, apply_metrics_arguments, \
+                         endpoint_template, remove_hook
+from dave.scheduler import get_scheduler
+
+class TemplateTest(unittest.TestCase):
+    def test_connection_and_api_agree(self):
+        # Connection passes the URL, Api the format string of the request
+        for url, api in (
+                ('https://dataverse.nl/api/dataverses/UMCU/contents', '{url}/api/dataverses/{dvid}/contents'),
+                ('https://dataverse.nl/api/v1/dataverses/12', '{url}/api/dataverses/{dvid}'),
+                ('https://dataverse.nl/api/dataverses/:root', '{url}/api/dataverses/{dvid}'),
+                ('https://dataverse.nl/api/datasets/:persistentId/?persistentId=doi:10.5072/FK2/ABC',
+                 '{url}/api/datasets/{dsid}'),
+                ('https://dataverse.nl/api/datasets/:persistentId/actions/:publish?persistentId=doi:1/2&type=major',
+                 '{url}/api/datasets/:persistentId/actions/:publish?persistentId={pid}&type={dstype}'),
+                ('https://dataverse.nl/api/datasets/7/versions/:latest', '{url}/api/datasets/{dsid}/versions/{version}'),
+                ('https://dataverse.nl/api/search?q=*&start=0', '{url}/api/search?q=%2A&type=dataset')):
+            self.assertEqual(endpoint_template(url), endpoint_template(api), url)
+
+    def test_templates(self):
+        self.assertEqual(endpoint_template('{url}/api/dataverses/{dvid}/assignments/{asid}'),
+                         '/api/dataverses/{id}/assignments/{id}')
+        self.assertEqual(endpoint_template('https://dataverse.nl/api/v1/datasets/:persistentId/versions/1.0'),
+                         '/api/datasets/{id}/versions/{id}')
+        self.assertEqual(endpoint_template('https://dataverse.nl/api/datasets/mpupload?uploadid=1'),
+                         '/api/datasets/mpupload')
+        self.assertEqual(endpoint_template('https://dataverse.nl/api/access/datafile/42'),
+                         '/api/access/datafile/{id}')
+        self.assertEqual(endpoint_template('https://dataverse.nl/api/info/server'), '/api/info/server')
+
+    def test_one_label_per_endpoint(self):
+        tree = Tree(dataverses=2, datasets=2, files=1)
+        metrics = Metrics()
+        add_hook(metrics)
+        self.addCleanup(remove_hook, metrics)
+        with running(tree) as server:
+            get_scheduler(server.url).configure(rate=1000)
+            connection = Connection(server.url, 'key')
+            connection.get_dataverse('dv0')
+            connection.get_dataverse(tree.root)
+            Api(server.url, 'key').dataverse_view('dv1')
+        self.assertEqual(metrics.summary()['GET /api/dataverses/{id}']['count'], 3)
+
+class SlowLogTest(unittest.TestCase):
+    def test_closed_at_exit(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'slow.log')
+            parser = argparse.ArgumentParser()
+            add_metrics_arguments(parser)
+            args = parser.parse_args(['--slow-threshold', '0', '--slow-log', path])
+            exits = []
+            metrics = apply_metrics_arguments(args, register=lambda func, *args: exits.append((func, args)))
+            remove_hook(metrics)
+            slow_log = metrics.slow_log
+            for func, func_args in reversed(exits):  # atexit calls the last registered first
+                func(*func_args)
+            self.assertTrue(slow_log.closed)
+
+if __name__ == '__main__':
+    unittest.main()
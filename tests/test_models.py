@@ -0,0 +1,83 @@
+"""Tests of the lazily loaded dataverses and datasets of a contents listing (dave.models)"""
+
+import threading, time, unittest
+from dave.common import DataverseError
+from dave.models import DatasetProxy
+
+class Response:
+    def __init__(self, data, status_code=200):
+        self.data = data
+        self.status_code = status_code
+
+    def json(self):
+        if self.status_code != 200:
+            return {'status': 'ERROR', 'message': self.data}
+        return {'status': 'OK', 'data': self.data}
+
+class FakeConnection:
+    """answers GET /datasets/{id}, after `failures` requests that raise DataverseError;
+    with `status`, every answer is an error with that status; every answer takes `delay` seconds"""
+    def __init__(self, failures=0, status=200, delay=0):
+        self.failures = failures
+        self.status = status
+        self.delay = delay
+        self.requests = 0
+
+    def get_request(self, endpoint, **kwarg):
+        self.requests += 1
+        time.sleep(self.delay)
+        if self.requests <= self.failures:
+            raise DataverseError('GET: HTTP error 503 - {0}: Service unavailable'.format(endpoint))
+        if self.status != 200:
+            return Response('Dataset with ID 7 not found.', self.status)
+        return Response({'id': 7, 'identifier': 'FK2/ABC', 'protocol': 'doi', 'authority': '10.5072',
+                         'latestVersion': {'createTime': '2024-01-01T00:00:00Z'}})
+
+ITEM = {'id': 7, 'identifier': 'FK2/ABC', 'protocol': 'doi', 'authority': '10.5072'}
+
+class LazyTest(unittest.TestCase):
+    def test_listing_attributes_need_no_request(self):
+        connection = FakeConnection()
+        dataset = DatasetProxy(connection, ITEM)
+        self.assertEqual(dataset.pid(), 'doi:10.5072/FK2/ABC')
+        self.assertEqual(connection.requests, 0)
+
+    def test_load_once(self):
+        connection = FakeConnection()
+        dataset = DatasetProxy(connection, ITEM)
+        self.assertEqual(dataset.ctime, '2024-01-01T00:00:00Z')
+        self.assertIsNone(dataset.title)
+        self.assertEqual(connection.requests, 1)
+        with self.assertRaises(AttributeError):
+            dataset.missing
+
+    def test_failed_load_is_retried(self):
+        connection = FakeConnection(failures=1)
+        dataset = DatasetProxy(connection, ITEM)
+        with self.assertRaises(DataverseError):
+            dataset.ctime
+        self.assertEqual(dataset.ctime, '2024-01-01T00:00:00Z')
+        self.assertEqual(connection.requests, 2)
+
+    def test_not_found(self):
+        connection = FakeConnection(status=404)
+        dataset = DatasetProxy(connection, ITEM)
+        with self.assertRaises(DataverseError) as context:
+            dataset.ctime
+        self.assertIn('Dataset with ID 7 not found. (404)', str(context.exception))
+
+    def test_threads_share_one_load(self):
+        connection = FakeConnection(delay=0.05)
+        dataset = DatasetProxy(connection, ITEM)
+        results = []
+        threads = [threading.Thread(target=lambda: results.append((dataset.ctime, dataset.title)))
+                   for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [('2024-01-01T00:00:00Z', None)] * 8)
+        self.assertEqual(connection.requests, 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+"""Tests of Api.search and dvstats --search against the mock server (bench/mockserver.py)"""
+
+import json, os, subprocess, sys, tempfile, unittest
+from os.path import abspath, dirname, join
+from bench.mockserver import Faults, Tree, running
+from dave import Api, DataverseError
+
+REPO = abspath(join(dirname(__file__), '..'))
+
+class SearchTest(unittest.TestCase):
+    def setUp(self):
+        # dv0 with sub-dataverse dv1, dv2 with dv3; 20 datasets of 2 files
+        self.tree = Tree(dataverses=4, datasets=20, files=2, depth=2)
+
+    def test_pages(self):
+        with running(self.tree) as server:
+            items = list(Api(server.url, 'key').search(types=('dataset',), per_page=7))
+            self.assertEqual(server.stats['GET /search'], 3)  # 7 + 7 + 6
+        self.assertEqual(sorted(item['entity_id'] for item in items), sorted(self.tree.datasets))
+
+    def test_last_page_is_full(self):
+        with running(self.tree) as server:
+            items = list(Api(server.url, 'key').search(types=('dataset',), per_page=10))
+            self.assertEqual(server.stats['GET /search'], 2)  # no request for an empty third page
+        self.assertEqual(len(items), 20)
+
+    def test_subtree(self):
+        with running(self.tree) as server:
+            items = list(Api(server.url, 'key').search(types=('dataset', 'file'), subtree='dv0'))
+        below = [dsid for dvid in self.tree.subtree(self.tree.dataverse('dv0'))
+                 for dsid in self.tree.dataverses[dvid]['datasets']]
+        self.assertEqual(len(below), 10)
+        self.assertEqual(sorted(item['entity_id'] for item in items if item['type'] == 'dataset'), sorted(below))
+        self.assertEqual(sorted(int(item['dataset_id']) for item in items if item['type'] == 'file'),
+                         sorted(below * 2))
+
+    def test_empty(self):
+        empty = self.tree.add_dataverse(self.tree.root, 'empty', 'Empty')
+        with running(self.tree) as server:
+            self.assertEqual(list(Api(server.url, 'key').search(subtree='empty')), [])
+            self.assertEqual(server.stats['GET /search'], 1)
+        self.assertEqual(self.tree.dataverses[empty]['datasets'], [])
+
+    def test_results_shrink_while_paging(self):
+        with running(self.tree) as server:
+            items = Api(server.url, 'key').search(types=('dataset',), per_page=5)
+            first = [next(items) for _ in range(5)]
+            for dataverse in self.tree.dataverses.values():
+                dataverse['datasets'] = []  # the next page is empty
+            self.assertEqual(list(items), [])
+            self.assertEqual(server.stats['GET /search'], 2)
+        self.assertEqual(len(first), 5)
+
+    def test_error_page(self):
+        faults = Faults(error_rate=1.0, error_status=400)
+        with running(self.tree, faults) as server:
+            with self.assertRaises(DataverseError) as context:
+                list(Api(server.url, 'key').search())
+        self.assertIn('search failed at start=0', str(context.exception))
+
+class DvstatsSearchTest(unittest.TestCase):
+    """dvstats --search, with a configuration file in a temporary home directory"""
+    def run_dvstats(self, server, *args):
+        with tempfile.TemporaryDirectory() as home:
+            os.makedirs(join(home, '.config'))
+            with open(join(home, '.config', 'dataverse.json'), 'w') as f:
+                json.dump({'production': {'url': server.url, 'root': 'dv0', 'key': 'key'}}, f)
+            result = subprocess.run([sys.executable, join(REPO, 'dvstats'), '--search', *args],
+                                    env=dict(os.environ, HOME=home), cwd=REPO,
+                                    capture_output=True, text=True, check=True)
+        return result.stdout.splitlines()
+
+    def test_filesize_and_status(self):
+        tree = Tree(dataverses=4, datasets=20, files=2, depth=2)
+        with running(tree) as server:
+            files = self.run_dvstats(server, '--filesize')
+            status = self.run_dvstats(server, '--status')
+        self.assertEqual(files[0], 'dataverse;dataset;file_name;file_size;file_type')
+        self.assertEqual(len(files) - 1, 20)  # 10 datasets below dv0, 2 files each
+        self.assertEqual(status[0], 'dataverse;dataset;last_update;publishing_state;authors')
+        self.assertEqual(len(status) - 1, 10)
+        self.assertEqual({row.split(';')[0] for row in status[1:]}, {'dv0', 'dv1'})
+        self.assertTrue(all(row.split(';')[3] in ('RELEASED', 'DRAFT') for row in status[1:]))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,33 @@
+"""Tests of the codebook of stat2csv.py, compared with the codebook of the code before it
+was vectorized (bench/bench_codebook.py)"""
+
+import unittest
+from bench.bench_codebook import compare, legacy_codebook, make_metadata
+from stat2csv import make_codebook, value_table
+
+class CodebookTest(unittest.TestCase):
+    def test_same_as_legacy(self):
+        metadata = make_metadata(variables=500, labels=2000, set_size=20)
+        equal, mangled = compare(legacy_codebook(metadata), make_codebook(metadata))
+        self.assertGreater(equal, 0)
+        self.assertGreater(mangled, 0)  # 10.05 was '105'
+
+    def test_mixed_label_set(self):
+        # SAS special missing values are strings in a label set of numbers
+        metadata = make_metadata(variables=50, labels=40, set_size=20)
+        metadata.value_labels['mixed'] = {1.0: 'yes', 0.0: 'no', 'A': 'not asked', '.B': 'refused'}
+        metadata.variable_to_label['q0'] = 'mixed'
+        codebook = make_codebook(metadata)
+        compare(legacy_codebook(metadata), codebook)
+        rows = codebook[codebook['variable_name'] == 'q0']
+        self.assertEqual(list(rows['value_label']), ['1', '0', 'A', '.B'])
+        self.assertEqual(list(rows['value']), ['yes', 'no', 'not asked', 'refused'])
+
+    def test_values_formatted_like_data(self):
+        table = value_table({'numbers': {1.0: 'a', 0.5: 'b', -2.0: 'c', float('nan'): 'd'},
+                             'strings': {'01': 'e', '1.0': 'f'}})
+        self.assertEqual(list(table['value_label']), ['1', '0.5', '-2', 'nan', '01', '1.0'])
+        self.assertEqual(list(table['value_label_id']), ['numbers'] * 4 + ['strings'] * 2)
+
+if __name__ == '__main__':
+    unittest.main()